@@ -1,23 +1,32 @@
 import os
+import json
 import time
 import numpy as np
 import hashlib
 import threading
 from threading import Lock
-from flask import Blueprint, request, jsonify, send_file
-import torch
+from contextlib import ExitStack
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 # from app.utils.redis_manager import RedisManager
 from app.utils.pg_manager import PostgresManager
-from app.utils.misc import calculate_file_hash
-from app.models.bge import BGEModel
-from app.models._docling import Docling
+from app.utils.pg_queries import parse_positive_int, parse_window_sizes
+from app.utils.index_maintenance import IndexMaintenance
+from app.utils.misc import calculate_file_hash, generate_passage_id
+from app.utils.ingestion import IngestionService, UNAVAILABLE_ERRORS
+from app.models.encoder_service import RemoteEncoder, RemoteDocling
 from app.utils.misc import passages_generator
+from app.utils.fusion import fuse_window_results
+from app.utils.highlight import highlight_passages
+from app.utils.metrics import StageTimer, metrics
+from app.utils.scheduler import LaneScheduler, Overloaded
 from app.utils.docs2text import extractors
 from config import config
 from werkzeug.utils import secure_filename
 
 api_routes = Blueprint("api", __name__)
 
+scheduler_config = config.config.get("scheduler", {})
+
 # redis_manager = RedisManager(
 #     host=config.config["redis"]["host"],
 #     port=config.config["redis"]["port"],
@@ -29,14 +38,101 @@ postgres_manager = PostgresManager(
     # user=config.config["postgres"]["user"],
     # password=config.config["postgres"]["password"],
     # dbname=config.config["postgres"]["database"],
+    default_precision=config.config.get("vector_index", {}).get("precision", "float32"),
+    default_oversample=config.config.get("vector_index", {}).get("oversample", 4),
+    index_config_ttl=config.config.get("vector_index", {}).get("config_ttl", 60),
+    explain_threshold_ms=config.config.get("search", {}).get("explain_threshold_ms"),
+    pool_min=config.config["postgres"].get("pool_min", 1),
+    pool_max=config.config["postgres"].get("pool_max", 10),
+    pool_timeout=config.config["postgres"].get("pool_timeout", 30),
+    prepare_statements=config.config["postgres"].get("prepared_statements", True),
+    lexical_storage=config.config["postgres"].get("lexical_storage", "table"),
+    pool_reserved=scheduler_config.get("db_reserved", 2),
 )
 
+index_maintenance = IndexMaintenance(postgres_manager)
+
+deletion_config = config.config.get("deletion", {})
+
+# The pool is created on first use, so an unreachable database does not keep
+# the app from starting: /healthz answers and /readyz reports it as pending
+database_ready = threading.Event()
+
+
+def connect_database(retry_interval: float = 5):
+    """Reach the database in the background, then start the work that needs it"""
+    while not postgres_manager.ping():
+        time.sleep(retry_interval)
+    database_ready.set()
+    postgres_manager.start_tombstone_reaper(
+        interval=deletion_config.get("reap_interval", 10),
+        batch_size=deletion_config.get("reap_batch_size", 5000),
+    )
+
+
+threading.Thread(target=connect_database, name="database-connect", daemon=True).start()
+
 # model = None
 # tokenizer = None
 # last_model_use_time = 0
 # MODEL_TIMEOUT = 600  # Unload models after 10 minutes of inactivity
 
-docling = Docling()
+encoder_config = config.config.get("encoder", {})
+# Worker processes share one encoder service per node instead of loading
+# their own models, see app/models/encoder_service.py
+remote_encoder = (
+    encoder_config.get("mode", "local") == "remote"
+    or config.config["backend"].get("server", "flask") == "gunicorn"
+)
+
+# Searches (interactive lane) take the model and the database before
+# ingestion (bulk lane), and each lane admits a bounded number of requests
+scheduler = LaneScheduler(
+    scheduler_config.get("max_pending", {}),
+    # The encoder service batches the requests of all threads itself
+    encoder_slots=scheduler_config.get("encoder_slots")
+    or (config.config["backend"].get("threads", 4) if remote_encoder else 1),
+)
+
+
+@api_routes.errorhandler(Overloaded)
+def overloaded(e):
+    response = jsonify({"error": str(e)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+class LazyDocling:
+    """Build Docling (layout and table models) on first use instead of at import"""
+
+    def __init__(self):
+        self.docling = None
+        self.lock = Lock()
+
+    @property
+    def loaded(self):
+        return self.docling is not None
+
+    def get(self):
+        with self.lock:
+            if self.docling is None:
+                from app.models._docling import Docling
+                self.docling = Docling()
+            return self.docling
+
+    def extract_text(self, source: str) -> str:
+        return self.get().extract_text(source)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+docling = (
+    RemoteDocling(encoder_config.get("socket", "/tmp/chishiki-encoder.sock"))
+    if remote_encoder
+    else LazyDocling()
+)
 
 class ModelManager:
     def __init__(self, timeout=600):
@@ -58,14 +154,20 @@ class ModelManager:
 
     def load_model(self):
         if self.model is None and config.config["ml_services"]["use_bge"]:
-            self.model = BGEModel()
+            if remote_encoder:
+                self.model = RemoteEncoder(encoder_config.get("socket", "/tmp/chishiki-encoder.sock"))
+            else:
+                # FlagEmbedding and torch take seconds to import, only pay for it here
+                from app.models.bge import BGEModel
+                self.model = BGEModel()
             self.tokenizer = self.model.tokenizer
         self.last_use_time = time.time()
         return self.model, self.tokenizer
 
     def auto_unload(self):
         with self.lock:
-            if self.model and time.time() - self.last_use_time > self.timeout:
+            # A remote encoder holds no model memory in this process
+            if self.model and not remote_encoder and time.time() - self.last_use_time > self.timeout:
                 self.model = None
                 self.tokenizer = None
                 print("Model unloaded due to inactivity")
@@ -78,6 +180,34 @@ class ModelManager:
 
 model_manager = ModelManager(timeout=600) # Unload models after 10 minutes of inactivity
 
+started_at = time.time()
+warm_up_done = threading.Event()
+
+
+def warm_up():
+    """Load the models in the background so the first requests do not pay for it"""
+    try:
+        if config.config["ml_services"].get("preload", True):
+            model_manager.get_model()
+            if isinstance(docling, LazyDocling) and config.config["ml_services"].get("preload_docling", False):
+                docling.get()
+    except Exception as e:
+        print(f"Error loading models: {e}")
+    finally:
+        warm_up_done.set()
+
+
+threading.Thread(target=warm_up, name="model-warm-up", daemon=True).start()
+
+# In-process ingestion API, also used by boot sync and the watchdog
+ingestion_service = IngestionService(
+    postgres_manager,
+    model_manager,
+    docling,
+    deletion_mode=deletion_config.get("mode", "hard"),
+    scheduler=scheduler,
+)
+
 
 # def load_model():
 #     global model, tokenizer, last_model_use_time
@@ -100,12 +230,6 @@ model_manager = ModelManager(timeout=600) # Unload models after 10 minutes of in
 #         unload_model()
 
 
-def generate_passage_id(dense_vector, doc_path):
-    dense_str = ",".join(str(x) for x in dense_vector)
-    passage_id = hashlib.md5((dense_str + doc_path).encode()).hexdigest()
-    return passage_id
-
-
 # @api_routes.route("/create_index", methods=["POST"])
 # def create_index():
 #     # redis_manager.create_index()
@@ -113,6 +237,129 @@ def generate_passage_id(dense_vector, doc_path):
 #     return jsonify({"message": "Index created successfully"})
 
 
+@api_routes.route("/create_vector_index", methods=["POST"])
+def create_vector_index():
+    data = request.get_json()
+    window_size = data.get("window_size")
+    precision = data.get("precision", "float32")
+    oversample = data.get("oversample", 4)
+    method = data.get("method", "hnsw")
+    index_params = data.get("index_params", {})
+
+    if window_size is None:
+        return jsonify({"error": "Missing 'window_size' parameter"}), 400
+
+    try:
+        index_name = postgres_manager.create_vector_index(
+            window_size,
+            precision=precision,
+            oversample=oversample,
+            method=method,
+            index_params=index_params,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error creating vector index: {str(e)}"}), 500
+
+    return jsonify(
+        {
+            "message": f"Vector index '{index_name}' created successfully",
+            "window_size": window_size,
+            "precision": precision,
+            "oversample": oversample,
+        }
+    )
+
+
+@api_routes.route("/index_maintenance", methods=["GET"])
+def inspect_vector_indexes():
+    try:
+        report = index_maintenance.inspect()
+    except Exception as e:
+        return jsonify({"error": f"Error inspecting vector indexes: {str(e)}"}), 500
+    return jsonify({"windows": report})
+
+
+@api_routes.route("/index_maintenance/rebuild", methods=["POST"])
+def rebuild_vector_index():
+    data = request.get_json()
+    window_size = data.get("window_size")
+
+    if window_size is None:
+        return jsonify({"error": "Missing 'window_size' parameter"}), 400
+
+    try:
+        result = index_maintenance.rebuild(
+            window_size,
+            method=data.get("method"),
+            precision=data.get("precision"),
+            oversample=data.get("oversample"),
+            index_params=data.get("index_params"),
+            min_recall=data.get("min_recall"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error rebuilding vector index: {str(e)}"}), 500
+
+    return jsonify(result)
+
+
+@api_routes.route("/index_maintenance/retune", methods=["POST"])
+def retune_vector_indexes():
+    data = request.get_json(silent=True) or {}
+    try:
+        actions = index_maintenance.retune(dry_run=data.get("dry_run", False))
+    except Exception as e:
+        return jsonify({"error": f"Error retuning vector indexes: {str(e)}"}), 500
+    return jsonify({"actions": actions})
+
+
+@api_routes.route("/drop_window_size", methods=["POST"])
+def drop_window_size():
+    data = request.get_json()
+    window_size = data.get("window_size")
+
+    if window_size is None:
+        return jsonify({"error": "Missing 'window_size' parameter"}), 400
+
+    try:
+        postgres_manager.drop_window_partition(window_size)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error dropping window size: {str(e)}"}), 500
+
+    return jsonify({"message": f"Window size {window_size} dropped successfully"})
+
+
+@api_routes.route("/migrate_lexical_storage", methods=["POST"])
+def migrate_lexical_storage():
+    """
+    Copy the lexical weights of all passages into their compact sparsevec
+    column. Safe to re-run; set "lexical_storage": "sparsevec" afterwards.
+    """
+    data = request.get_json(silent=True) or {}
+    batch_size = data.get("batch_size", 1000)
+    truncate = data.get("truncate", False)
+
+    try:
+        migrated = postgres_manager.migrate_lexical_weights(
+            batch_size=batch_size, truncate=truncate
+        )
+    except Exception as e:
+        return jsonify({"error": f"Error migrating lexical weights: {str(e)}"}), 500
+
+    return jsonify(
+        {
+            "message": "Lexical weights migrated successfully",
+            "migrated_passages": migrated,
+            "truncated": truncate,
+        }
+    )
+
+
 # @api_routes.route("/flush_datastore", methods=["POST"])
 # def flush_datastore():
 #     redis_manager.flush_datastore()
@@ -126,6 +373,7 @@ def generate_passage_id(dense_vector, doc_path):
 
 
 @api_routes.route("/insert_passage", methods=["POST"])
+@scheduler.admitted("bulk")
 def insert_passage():
     data = request.get_json()
     doc_path = data["doc_path"]
@@ -152,9 +400,10 @@ def insert_passage():
     tokenized = tokenizer(text, return_tensors="pt")
     ids, mask = tokenized["input_ids"][0], tokenized["attention_mask"][0]
 
-    encoded = model.encode(
-        [(ids, mask)], return_dense=True, return_sparse=True, return_colbert_vecs=False
-    )
+    with scheduler.encoder.slot():
+        encoded = model.encode(
+            [(ids, mask)], return_dense=True, return_sparse=True, return_colbert_vecs=False
+        )
     dense_vector = encoded["dense_vecs"][0]
     passage_id = generate_passage_id(dense_vector, doc_path)
     lexical_weights = encoded["lexical_weights"][0]
@@ -174,112 +423,99 @@ def insert_passage():
 
 
 @api_routes.route("/insert_documents", methods=["POST"])
+@scheduler.admitted("bulk")
 def insert_documents():
     data = request.get_json()
     doc_paths = data["doc_paths"]
     window_sizes = data.get("window_sizes", [512])
     stride = data.get("stride", 0.75)
 
-    for doc_path in doc_paths:
-        file_hash = calculate_file_hash(doc_path)
-        filename = os.path.basename(doc_path)
-        file_extension = (
-            os.path.splitext(filename)[1][1:] if "." in filename else filename
-        )
-        # UNIX timestamps
-        creation_time = os.path.getctime(doc_path)
-        modification_time = os.path.getmtime(doc_path)
-        size = os.path.getsize(doc_path)
-
-        postgres_manager.insert_metadata(
-            doc_path,
-            file_hash,
-            filename,
-            file_extension,
-            creation_time,
-            modification_time,
-            size,
-        )
+    try:
+        result = ingestion_service.ingest(doc_paths, window_sizes=window_sizes, stride=stride)
+    except UNAVAILABLE_ERRORS as e:
+        return jsonify({"error": str(e)}), 500
 
-        model, tokenizer = model_manager.get_model()
-        if model is None:
-            postgres_manager.update_doc_ml_synced(doc_path, False)
-            return (
-                jsonify(
-                    {"error": 'ML service not enabled, set "use_bge" to True to enable'}
-                ),
-                500,
-            )
-
-        if doc_path.split(".")[-1] not in extractors:
-            postgres_manager.update_doc_ml_synced(doc_path, False)
-            print(f"Document {doc_path} not supported")
-            continue
-
-        if docling and doc_path.split(".")[-1] == "pdf":
-            text = extractors[doc_path.split(".")[-1]](doc_path, docling)
-        else:
-            text = extractors[doc_path.split(".")[-1]](doc_path, docling)
+    return jsonify({"message": "Documents inserted successfully", **result})
 
-        postgres_manager.set_doc_text(doc_path, text)
-
-        all_dense_vectors = []
-
-        for window_size in window_sizes:
-            passage_generator = passages_generator(
-                text, tokenizer, window_size=window_size, stride=stride
-            )
-            for i, (passage_ids, passage_mask, start_pos, end_pos) in enumerate(
-                passage_generator
-            ):
-                print(f"Inserting passage {i + 1} with window size {window_size}")
-                with torch.no_grad():
-                    encoding = model.encode(
-                        [(passage_ids, passage_mask)],
-                        return_dense=True,
-                        return_sparse=True,
-                    )
-                    dense_vector, lexical_weights = (
-                        encoding["dense_vecs"][0],
-                        encoding["lexical_weights"][0],
-                    )
-                all_dense_vectors.append(dense_vector)
-                passage_id = generate_passage_id(dense_vector, doc_path)
-                postgres_manager.insert_passage(
-                    passage_id,
-                    doc_path,
-                    file_hash,
-                    filename,
-                    dense_vector,
-                    lexical_weights,
-                    start_pos,
-                    end_pos,
-                    window_size,
-                )
 
-        mean_dense_vector = np.mean(all_dense_vectors, axis=0)
-        postgres_manager.insert_mean_dense_vector(doc_path, mean_dense_vector)
+@api_routes.route("/move_documents", methods=["POST"])
+@scheduler.admitted("bulk")
+def move_documents():
+    data = request.get_json()
+    moves = data.get("moves", [])
 
-        postgres_manager.update_doc_ml_synced(doc_path, True)
+    if not moves:
+        return jsonify({"error": "Missing 'moves' parameter"}), 400
+    if any("src_path" not in move or "dest_path" not in move for move in moves):
+        return jsonify({"error": "Each move needs 'src_path' and 'dest_path'"}), 400
 
-    return jsonify({"message": "Documents inserted successfully"})
+    moved, missing = ingestion_service.move({move["src_path"]: move["dest_path"] for move in moves})
+    return jsonify(
+        {
+            "message": f"{len(moved)} documents moved successfully",
+            "moved": moved,
+            # Sources that are not stored, their destination has to be ingested
+            "missing": missing,
+        }
+    )
 
 
 @api_routes.route("/delete_documents", methods=["POST"])
+@scheduler.admitted("bulk")
 def delete_documents():
     data = request.get_json()
     doc_paths = data.get("doc_paths", [])
+    mode = data.get("mode")
 
     if not doc_paths:
         return jsonify({"error": "Missing 'doc_paths' parameter"}), 400
 
-    for doc_path in doc_paths:
-        postgres_manager.delete_doc(doc_path)
+    try:
+        deleted = ingestion_service.delete(doc_paths, mode=mode)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"message": f"Documents deleted successfully", "deleted": deleted})
+
+
+def encode_query(model, tokenizer, query, timer=None):
+    timer = timer or StageTimer()
+    with timer.stage("tokenize"):
+        tokenized = tokenizer(query, return_tensors="pt")
+        query_ids, query_mask = tokenized["input_ids"][0], tokenized["attention_mask"][0]
+
+    import torch
+
+    with timer.stage("encode"), scheduler.encoder.slot(), torch.no_grad():
+        encoding = model.encode(
+            [(query_ids, query_mask)], return_dense=True, return_sparse=True
+        )
+    return encoding["dense_vecs"][0], encoding["lexical_weights"][0]
+
 
-    return jsonify({"message": f"Documents deleted successfully"})
+def hydrate_passages(passages, doc_texts=None):
+    doc_texts = {} if doc_texts is None else doc_texts
+    for passage in passages:
+        doc_path = passage["doc_path"]
+        if doc_path not in doc_texts:
+            doc_texts[doc_path] = postgres_manager.get_doc_text(doc_path) or ""
+        passage["text"] = doc_texts[doc_path][
+            int(passage["start_pos"]) : int(passage["end_pos"])
+        ]
+    return passages
+
+
+def add_highlights(tokenizer, passages, query_lexical_weights):
+    highlights = highlight_passages(
+        tokenizer, [passage["text"] for passage in passages], query_lexical_weights
+    )
+    for passage, spans in zip(passages, highlights):
+        passage["highlights"] = spans
+    return passages
 
 
 @api_routes.route("/search", methods=["POST"])
+@scheduler.admitted("interactive")
 def search():
     data = request.get_json()
 
@@ -291,12 +527,49 @@ def search():
     path = data.get("path", None)
     filename = data.get("filename", None)
     window_size = data.get("window_size", 512)
+    window_sizes = data.get("window_sizes", None)  # Multi-window search when set
+    fusion = data.get("fusion", "rrf")
+    group_by = data.get("group_by", None)  # "document" to collapse passages by document
+    n_docs = data.get("n_docs", 10)
+    passages_per_doc = data.get("passages_per_doc", 3)
+    doc_score = data.get("doc_score", "max")
+    highlight = data.get(
+        "highlight", config.config.get("search", {}).get("highlight", True)
+    )
     dense_weight = data.get("dense_weight", 0.7)
     sparse_weight = data.get("sparse_weight", None)
     k = data.get("k", 30)
     size_filter = data.get("size_filter", None)
+    debug = data.get("debug", False)
+
+    try:
+        window_size = parse_positive_int(window_size, "window_size")
+        k = parse_positive_int(k, "k")
+        if window_sizes is not None:
+            window_sizes = parse_window_sizes(window_sizes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if fusion not in ("rrf", "max"):
+        return jsonify({"error": "'fusion' must be either 'rrf' or 'max'"}), 400
+    if group_by not in (None, "document"):
+        return jsonify({"error": "'group_by' must be 'document' when set"}), 400
+    if doc_score not in ("max", "sum"):
+        return jsonify({"error": "'doc_score' must be either 'max' or 'sum'"}), 400
+
+    timer = StageTimer()
+    sql_stats = {}
+
+    def respond(key, value):
+        response = {key: value}
+        if debug:
+            response["timings_ms"] = timer.finish()
+            response["sql"] = sql_stats
+        else:
+            timer.finish()
+        return jsonify(response)
 
-    model, tokenizer = model_manager.get_model()
+    with timer.stage("model"):
+        model, tokenizer = model_manager.get_model()
     if model is None:
         return (
             jsonify(
@@ -309,44 +582,78 @@ def search():
     # global last_model_use_time
     # last_model_use_time = time.time()
 
-    tokenized = tokenizer(query, return_tensors="pt")
-    query_ids, query_mask = tokenized["input_ids"][0], tokenized["attention_mask"][0]
-
-    with torch.no_grad():
-        encoding = model.encode(
-            [(query_ids, query_mask)], return_dense=True, return_sparse=True
-        )
-        query_dense_vector, query_lexical_weights = (
-            encoding["dense_vecs"][0],
-            encoding["lexical_weights"][0],
-        )
-
-    search_results = postgres_manager.ml_search(
-        query_dense_vector,
-        query_lexical_weights,
-        tags=tags,
-        path=path,
-        filename=filename,
-        window_size=window_size,
-        dense_weight=dense_weight,
-        sparse_weight=sparse_weight,
-        k=k,
-        # size_filter=size_filter,
+    # The query is encoded once, whatever the number of window sizes searched
+    query_dense_vector, query_lexical_weights = encode_query(
+        model, tokenizer, query, timer
     )
 
-    passages = []
-    for (doc_path, start_pos, end_pos), scores in search_results:
-        doc_text = postgres_manager.get_doc_text(doc_path)
-        passage_text = doc_text[int(start_pos) : int(end_pos)]
-        passages.append(
+    if group_by == "document":
+        with timer.stage("sql"):
+            documents = postgres_manager.ml_search_documents(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes=window_sizes or [window_size],
+                tags=tags,
+                path=path,
+                filename=filename,
+                dense_weight=dense_weight,
+                sparse_weight=sparse_weight,
+                n_docs=n_docs,
+                passages_per_doc=passages_per_doc,
+                doc_score=doc_score,
+                overfetch=config.config.get("search", {}).get("doc_overfetch", 4),
+                stats=sql_stats,
+            )
+        if highlight:
+            with timer.stage("highlight"):
+                add_highlights(
+                    tokenizer,
+                    [passage for document in documents for passage in document["passages"]],
+                    query_lexical_weights,
+                )
+        return respond("documents", documents)
+
+    if window_sizes:
+        with timer.stage("sql"):
+            search_results = postgres_manager.ml_search_multi(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes=window_sizes,
+                tags=tags,
+                path=path,
+                filename=filename,
+                dense_weight=dense_weight,
+                sparse_weight=sparse_weight,
+                k=k,
+                stats=sql_stats,
+            )
+        with timer.stage("fusion"):
+            passages = fuse_window_results(search_results, k=k, method=fusion)
+    else:
+        with timer.stage("sql"):
+            search_results = postgres_manager.ml_search(
+                query_dense_vector,
+                query_lexical_weights,
+                tags=tags,
+                path=path,
+                filename=filename,
+                window_size=window_size,
+                dense_weight=dense_weight,
+                sparse_weight=sparse_weight,
+                k=k,
+                # size_filter=size_filter,
+                stats=sql_stats,
+            )
+
+        passages = [
             {
-                "text": passage_text,
                 "doc_path": doc_path,
                 "start_pos": start_pos,
                 "end_pos": end_pos,
                 "scores": scores,
             }
-        )
+            for (doc_path, start_pos, end_pos), scores in search_results
+        ]
 
     # filter only passages with path in the doc_path, remove after fixing metadata_search
     # if path:
@@ -354,7 +661,182 @@ def search():
     #         passage for passage in passages if passage["doc_path"].startswith(path)
     #     ]
 
-    return jsonify({"passages": passages})
+    with timer.stage("hydrate"):
+        hydrate_passages(passages)
+    if highlight:
+        with timer.stage("highlight"):
+            add_highlights(tokenizer, passages, query_lexical_weights)
+
+    return respond("passages", passages)
+
+
+@api_routes.route("/search_batch", methods=["POST"])
+def search_batch():
+    # Admitted until the last result is streamed, not until the view returns
+    with ExitStack() as admission:
+        admission.enter_context(scheduler.admit("bulk"))
+        response = _search_batch()
+        if isinstance(response, Response):
+            # Released by the server once the response is sent or dropped
+            response.call_on_close(admission.pop_all().close)
+        return response
+
+
+def _search_batch():
+    data = request.get_json()
+    queries = data.get("queries", [])
+    search_config = config.config.get("search", {})
+
+    if not queries or not isinstance(queries, list):
+        return jsonify({"error": "Missing 'queries' parameter"}), 400
+    if len(queries) > search_config.get("max_batch_queries", 1000):
+        return jsonify({"error": "Too many queries in a single batch"}), 400
+
+    # Shared parameters, each query can override them
+    shared = {
+        "tags": data.get("tags", []),
+        "path": data.get("path", None),
+        "filename": data.get("filename", None),
+        "window_size": data.get("window_size", 512),
+        "dense_weight": data.get("dense_weight", 0.7),
+        "sparse_weight": data.get("sparse_weight", None),
+        "k": data.get("k", 30),
+    }
+    highlight = data.get("highlight", search_config.get("highlight", True))
+
+    batch = []
+    for query in queries:
+        query = {"query": query} if isinstance(query, str) else dict(query)
+        if not query.get("query") or not query["query"].strip():
+            return jsonify({"error": "Every query needs a non-empty 'query'"}), 400
+        query = {**shared, **query}
+        try:
+            query["window_size"] = parse_positive_int(query["window_size"], "window_size")
+            query["k"] = parse_positive_int(query["k"], "k")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        batch.append(query)
+
+    model, tokenizer = model_manager.get_model()
+    if model is None:
+        return (
+            jsonify(
+                {"error": 'ML service not enabled, set "use_bge" to True to enable'}
+            ),
+            500,
+        )
+
+    # Encode all the queries with batched forward passes, taking the encoder
+    # slot per batch so that searches can run in between
+    tokenized = [tokenizer(query["query"], return_tensors="pt") for query in batch]
+    batch_encode_size = search_config.get("batch_encode_size", 64)
+    import torch
+
+    encoding = {"dense_vecs": [], "lexical_weights": []}
+    for start in range(0, len(tokenized), batch_encode_size):
+        with scheduler.encoder.slot(), torch.no_grad():
+            encoded = model.encode(
+                [
+                    (t["input_ids"][0], t["attention_mask"][0])
+                    for t in tokenized[start:start + batch_encode_size]
+                ],
+                batch_size=batch_encode_size,
+                return_dense=True,
+                return_sparse=True,
+            )
+        encoding["dense_vecs"].extend(encoded["dense_vecs"])
+        encoding["lexical_weights"].extend(encoded["lexical_weights"])
+
+    # Queries sharing the same filters are resolved with a single statement
+    groups = {}
+    for i, query in enumerate(batch):
+        key = json.dumps({name: query[name] for name in shared}, sort_keys=True)
+        groups.setdefault(key, []).append(i)
+
+    def generate():
+        for indices in groups.values():
+            params = {name: batch[indices[0]][name] for name in shared}
+            results = postgres_manager.ml_search_batch(
+                [
+                    (encoding["dense_vecs"][i], encoding["lexical_weights"][i])
+                    for i in indices
+                ],
+                **params,
+            )
+            doc_texts = {}
+            for i, search_results in zip(indices, results):
+                passages = [
+                    {
+                        "doc_path": doc_path,
+                        "start_pos": start_pos,
+                        "end_pos": end_pos,
+                        "scores": scores,
+                    }
+                    for (doc_path, start_pos, end_pos), scores in search_results
+                ]
+                hydrate_passages(passages, doc_texts)
+                if highlight:
+                    add_highlights(tokenizer, passages, encoding["lexical_weights"][i])
+                yield json.dumps(
+                    {"index": i, "query": batch[i]["query"], "passages": passages}
+                ) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@api_routes.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process serves requests, whatever is still loading
+    return jsonify({"status": "ok", "uptime_s": round(time.time() - started_at, 3)})
+
+
+@api_routes.route("/readyz", methods=["GET"])
+def readyz():
+    if not config.config["ml_services"]["use_bge"]:
+        model_state = "disabled"
+    elif model_manager.model is not None:
+        model_state = "loaded"
+    elif not warm_up_done.is_set():
+        model_state = "loading"
+    else:
+        model_state = "on demand"
+
+    if not isinstance(docling, LazyDocling):
+        docling_state = "remote"
+    else:
+        docling_state = "loaded" if docling.loaded else "on demand"
+
+    if not database_ready.is_set():
+        database_state = "pending"
+    else:
+        database_state = "ok" if postgres_manager.ping() else "unavailable"
+
+    components = {
+        "database": database_state,
+        "model": model_state,
+        "docling": docling_state,
+    }
+    ready = components["database"] == "ok" and warm_up_done.is_set()
+    return (
+        jsonify(
+            {
+                "status": "ready" if ready else "not ready",
+                "uptime_s": round(time.time() - started_at, 3),
+                "components": components,
+            }
+        ),
+        200 if ready else 503,
+    )
+
+
+@api_routes.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@api_routes.route("/debug/slow_queries", methods=["GET"])
+def get_slow_queries():
+    return jsonify({"slow_queries": list(postgres_manager.slow_query_plans)})
 
 
 @api_routes.route("/search_similar_docs", methods=["POST"])
@@ -436,11 +918,36 @@ def search_by_metadata():
     return jsonify({"doc_paths": doc_paths})
 
 
+@api_routes.route("/manifest", methods=["GET"])
+def get_manifest():
+    prefix = request.args.get("prefix", None)
+    after = request.args.get("after", None)
+    limit = request.args.get("limit", 5000, type=int)
+
+    if limit <= 0 or limit > 50000:
+        return jsonify({"error": "'limit' must be between 1 and 50000"}), 400
+
+    try:
+        documents, next_after = ingestion_service.manifest(prefix=prefix, after=after, limit=limit)
+    except Exception as e:
+        return jsonify({"error": f"Error getting manifest: {str(e)}"}), 500
+
+    return jsonify(
+        {
+            "documents": documents,
+            # Pass as 'after' to get the next page, null on the last page
+            "next_after": next_after,
+        }
+    )
+
+
 @api_routes.route("/delete_doc", methods=["POST"])
 def delete_doc():
     data = request.get_json()
     doc_path = data["doc_path"]
-    postgres_manager.delete_doc(doc_path)
+    postgres_manager.delete_doc(
+        doc_path, tombstone=deletion_config.get("mode", "hard") == "tombstone"
+    )
     return jsonify({"message": f"Document '{doc_path}' deleted successfully"})
 
 
@@ -0,0 +1,35 @@
+# app/api_async/__init__.py
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart
+from app.api import create_app
+from app.api_async.routes import async_routes
+
+
+class AsyncDispatcher:
+    """
+    Serve the routes ported to asyncio from the Quart app, and every other route
+    (ingestion, uploads, tag updates...) from the Flask app on a thread pool, so
+    both share one server, one port and one model.
+    """
+
+    def __init__(self, async_app, wsgi_app):
+        self.async_app = async_app
+        self.wsgi_app = WsgiToAsgi(wsgi_app)
+        self.async_paths = {
+            rule.rule for rule in async_app.url_map.iter_rules() if rule.endpoint != "static"
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.async_paths:
+            await self.async_app(scope, receive, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+
+def create_async_app():
+    app = Quart(__name__)
+
+    # Register the async API routes blueprint
+    app.register_blueprint(async_routes)
+
+    return AsyncDispatcher(app, create_app())
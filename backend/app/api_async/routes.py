@@ -0,0 +1,436 @@
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Blueprint, Response, request, jsonify
+
+from app.api.routes import model_manager, encode_query, add_highlights, scheduler
+from app.utils.fusion import fuse_window_results
+from app.utils.metrics import StageTimer, metrics
+from app.utils.pg_async import AsyncPostgresManager
+from app.utils.pg_queries import parse_positive_int, parse_window_sizes
+from app.utils.scheduler import lane
+from config import config
+
+async_routes = Blueprint("async_api", __name__)
+
+async_config = config.config.get("backend", {}).get("async", {})
+
+postgres_manager = AsyncPostgresManager(
+    host=config.config["postgres"]["host"],
+    port=config.config["postgres"]["port"],
+    default_precision=config.config.get("vector_index", {}).get("precision", "float32"),
+    default_oversample=config.config.get("vector_index", {}).get("oversample", 4),
+    index_config_ttl=config.config.get("vector_index", {}).get("config_ttl", 60),
+    explain_threshold_ms=config.config.get("search", {}).get("explain_threshold_ms"),
+    pool_min=config.config["postgres"].get("pool_min", 1),
+    pool_max=config.config["postgres"].get("pool_max", 10),
+    pool_timeout=config.config["postgres"].get("pool_timeout", 30),
+    prepare_statements=config.config["postgres"].get("prepared_statements", True),
+    lexical_storage=config.config["postgres"].get("lexical_storage", "table"),
+)
+
+
+class EncoderQueue:
+    """
+    Run the model on a small dedicated thread pool, in front of which at most
+    `max_pending` requests may wait. Past that, requests are turned away instead
+    of piling up behind the model while holding their Postgres slot or socket.
+    """
+
+    def __init__(self, workers=1, max_pending=64):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encoder")
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def full(self) -> bool:
+        return self.pending >= self.max_pending
+
+    async def run(self, fn, *args):
+        self.pending += 1
+        queued = metrics.gauge("encoder_queue_pending", "Requests waiting for or running on the encoder")
+        queued.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            queued.dec()
+
+
+encoder_queue = EncoderQueue(
+    workers=async_config.get("encoder_workers", 1),
+    max_pending=async_config.get("encoder_max_pending", 64),
+)
+
+
+def encode_queries(model, tokenizer, queries, batch_size):
+    tokenized = [tokenizer(query, return_tensors="pt") for query in queries]
+    import torch
+
+    # Bulk work, the encoder slot is taken per batch so searches run in between
+    encoding = {"dense_vecs": [], "lexical_weights": []}
+    with lane("bulk"):
+        for start in range(0, len(tokenized), batch_size):
+            with scheduler.encoder.slot(), torch.no_grad():
+                encoded = model.encode(
+                    [
+                        (t["input_ids"][0], t["attention_mask"][0])
+                        for t in tokenized[start:start + batch_size]
+                    ],
+                    batch_size=batch_size,
+                    return_dense=True,
+                    return_sparse=True,
+                )
+            encoding["dense_vecs"].extend(encoded["dense_vecs"])
+            encoding["lexical_weights"].extend(encoded["lexical_weights"])
+    return encoding
+
+
+def encoder_busy():
+    metrics.counter("encoder_queue_rejected_total", "Requests rejected because the encoder queue was full").inc()
+    return jsonify({"error": "Encoder queue is full, retry later"}), 429, {"Retry-After": "1"}
+
+
+async def hydrate_passages(passages, doc_texts=None):
+    doc_texts = {} if doc_texts is None else doc_texts
+    missing = {passage["doc_path"] for passage in passages} - doc_texts.keys()
+    doc_texts.update(await postgres_manager.get_doc_texts(list(missing)))
+    for passage in passages:
+        passage["text"] = (doc_texts.get(passage["doc_path"]) or "")[
+            int(passage["start_pos"]) : int(passage["end_pos"])
+        ]
+    return passages
+
+
+@async_routes.before_app_serving
+async def open_pool():
+    await postgres_manager.open()
+
+
+@async_routes.after_app_serving
+async def close_pool():
+    await postgres_manager.close()
+
+
+@async_routes.route("/search", methods=["POST"])
+async def search():
+    data = await request.get_json()
+
+    if "query" not in data or not data["query"] or data["query"].strip() == "":
+        return jsonify({"error": "Missing 'query' parameter"}), 400
+
+    query = data["query"]
+    tags = data.get("tags", [])
+    path = data.get("path", None)
+    filename = data.get("filename", None)
+    window_size = data.get("window_size", 512)
+    window_sizes = data.get("window_sizes", None)
+    fusion = data.get("fusion", "rrf")
+    group_by = data.get("group_by", None)
+    n_docs = data.get("n_docs", 10)
+    passages_per_doc = data.get("passages_per_doc", 3)
+    doc_score = data.get("doc_score", "max")
+    highlight = data.get(
+        "highlight", config.config.get("search", {}).get("highlight", True)
+    )
+    dense_weight = data.get("dense_weight", 0.7)
+    sparse_weight = data.get("sparse_weight", None)
+    k = data.get("k", 30)
+    debug = data.get("debug", False)
+
+    try:
+        window_size = parse_positive_int(window_size, "window_size")
+        k = parse_positive_int(k, "k")
+        if window_sizes is not None:
+            window_sizes = parse_window_sizes(window_sizes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if fusion not in ("rrf", "max"):
+        return jsonify({"error": "'fusion' must be either 'rrf' or 'max'"}), 400
+    if group_by not in (None, "document"):
+        return jsonify({"error": "'group_by' must be 'document' when set"}), 400
+    if doc_score not in ("max", "sum"):
+        return jsonify({"error": "'doc_score' must be either 'max' or 'sum'"}), 400
+    if encoder_queue.full():
+        return encoder_busy()
+
+    timer = StageTimer()
+    sql_stats = {}
+    loop = asyncio.get_running_loop()
+
+    def respond(key, value):
+        response = {key: value}
+        if debug:
+            response["timings_ms"] = timer.finish()
+            response["sql"] = sql_stats
+        else:
+            timer.finish()
+        return jsonify(response)
+
+    with timer.stage("model"):
+        model, tokenizer = await encoder_queue.run(model_manager.get_model)
+    if model is None:
+        return (
+            jsonify(
+                {"error": 'ML service not enabled, set "use_bge" to True to enable'}
+            ),
+            500,
+        )
+
+    query_dense_vector, query_lexical_weights = await encoder_queue.run(
+        encode_query, model, tokenizer, query, timer
+    )
+    await postgres_manager.refresh_index_configs()
+
+    if group_by == "document":
+        with timer.stage("sql"):
+            documents = await postgres_manager.ml_search_documents(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes=window_sizes or [window_size],
+                tags=tags,
+                path=path,
+                filename=filename,
+                dense_weight=dense_weight,
+                sparse_weight=sparse_weight,
+                n_docs=n_docs,
+                passages_per_doc=passages_per_doc,
+                doc_score=doc_score,
+                overfetch=config.config.get("search", {}).get("doc_overfetch", 4),
+                stats=sql_stats,
+            )
+        if highlight:
+            with timer.stage("highlight"):
+                await loop.run_in_executor(
+                    None,
+                    add_highlights,
+                    tokenizer,
+                    [passage for document in documents for passage in document["passages"]],
+                    query_lexical_weights,
+                )
+        return respond("documents", documents)
+
+    if window_sizes:
+        with timer.stage("sql"):
+            search_results = await postgres_manager.ml_search_multi(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes=window_sizes,
+                tags=tags,
+                path=path,
+                filename=filename,
+                dense_weight=dense_weight,
+                sparse_weight=sparse_weight,
+                k=k,
+                stats=sql_stats,
+            )
+        with timer.stage("fusion"):
+            passages = fuse_window_results(search_results, k=k, method=fusion)
+    else:
+        with timer.stage("sql"):
+            search_results = await postgres_manager.ml_search(
+                query_dense_vector,
+                query_lexical_weights,
+                tags=tags,
+                path=path,
+                filename=filename,
+                window_size=window_size,
+                dense_weight=dense_weight,
+                sparse_weight=sparse_weight,
+                k=k,
+                stats=sql_stats,
+            )
+
+        passages = [
+            {
+                "doc_path": doc_path,
+                "start_pos": start_pos,
+                "end_pos": end_pos,
+                "scores": scores,
+            }
+            for (doc_path, start_pos, end_pos), scores in search_results
+        ]
+
+    with timer.stage("hydrate"):
+        await hydrate_passages(passages)
+    if highlight:
+        with timer.stage("highlight"):
+            await loop.run_in_executor(
+                None, add_highlights, tokenizer, passages, query_lexical_weights
+            )
+
+    return respond("passages", passages)
+
+
+@async_routes.route("/search_batch", methods=["POST"])
+async def search_batch():
+    data = await request.get_json()
+    queries = data.get("queries", [])
+    search_config = config.config.get("search", {})
+
+    if not queries or not isinstance(queries, list):
+        return jsonify({"error": "Missing 'queries' parameter"}), 400
+    if len(queries) > search_config.get("max_batch_queries", 1000):
+        return jsonify({"error": "Too many queries in a single batch"}), 400
+
+    shared = {
+        "tags": data.get("tags", []),
+        "path": data.get("path", None),
+        "filename": data.get("filename", None),
+        "window_size": data.get("window_size", 512),
+        "dense_weight": data.get("dense_weight", 0.7),
+        "sparse_weight": data.get("sparse_weight", None),
+        "k": data.get("k", 30),
+    }
+    highlight = data.get("highlight", search_config.get("highlight", True))
+
+    batch = []
+    for query in queries:
+        query = {"query": query} if isinstance(query, str) else dict(query)
+        if not query.get("query") or not query["query"].strip():
+            return jsonify({"error": "Every query needs a non-empty 'query'"}), 400
+        query = {**shared, **query}
+        try:
+            query["window_size"] = parse_positive_int(query["window_size"], "window_size")
+            query["k"] = parse_positive_int(query["k"], "k")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        batch.append(query)
+
+    if encoder_queue.full():
+        return encoder_busy()
+    model, tokenizer = await encoder_queue.run(model_manager.get_model)
+    if model is None:
+        return (
+            jsonify(
+                {"error": 'ML service not enabled, set "use_bge" to True to enable'}
+            ),
+            500,
+        )
+
+    encoding = await encoder_queue.run(
+        encode_queries,
+        model,
+        tokenizer,
+        [query["query"] for query in batch],
+        search_config.get("batch_encode_size", 64),
+    )
+    await postgres_manager.refresh_index_configs()
+
+    groups = {}
+    for i, query in enumerate(batch):
+        key = json.dumps({name: query[name] for name in shared}, sort_keys=True)
+        groups.setdefault(key, []).append(i)
+
+    async def generate():
+        loop = asyncio.get_running_loop()
+        for indices in groups.values():
+            params = {name: batch[indices[0]][name] for name in shared}
+            results = await postgres_manager.ml_search_batch(
+                [
+                    (encoding["dense_vecs"][i], encoding["lexical_weights"][i])
+                    for i in indices
+                ],
+                **params,
+            )
+            doc_texts = {}
+            for i, search_results in zip(indices, results):
+                passages = [
+                    {
+                        "doc_path": doc_path,
+                        "start_pos": start_pos,
+                        "end_pos": end_pos,
+                        "scores": scores,
+                    }
+                    for (doc_path, start_pos, end_pos), scores in search_results
+                ]
+                await hydrate_passages(passages, doc_texts)
+                if highlight:
+                    await loop.run_in_executor(
+                        None, add_highlights, tokenizer, passages, encoding["lexical_weights"][i]
+                    )
+                yield json.dumps(
+                    {"index": i, "query": batch[i]["query"], "passages": passages}
+                ) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@async_routes.route("/debug/slow_queries", methods=["GET"])
+async def get_slow_queries():
+    return jsonify({"slow_queries": list(postgres_manager.slow_query_plans)})
+
+
+@async_routes.route("/search_similar_docs", methods=["POST"])
+async def search_similar_docs():
+    data = await request.get_json()
+    doc_path = data["doc_path"]
+    k = data.get("k", 10)
+    threshold = data.get("threshold", 0.3)
+
+    mean_dense_vector = await postgres_manager.get_mean_dense_vector(doc_path)
+    if mean_dense_vector is None:
+        return (
+            jsonify({"error": "Mean dense vector not found for the given document"}),
+            404,
+        )
+
+    similar_docs = await postgres_manager.search_similar_docs(mean_dense_vector, k, threshold)
+    return jsonify({"similar_docs": similar_docs})
+
+
+@async_routes.route("/get_doc_text", methods=["GET"])
+async def get_doc_text():
+    doc_path = request.args.get("doc_path")
+    doc_text = await postgres_manager.get_doc_text(doc_path)
+    if doc_text:
+        return jsonify({"doc_text": doc_text})
+    else:
+        return jsonify({"error": "Document text not found"}), 404
+
+
+@async_routes.route("/get_ml_synced", methods=["GET"])
+async def get_ml_synced():
+    doc_path = request.args.get("doc_path")
+    ml_synced = await postgres_manager.get_doc_ml_synced(doc_path)
+    if ml_synced:
+        return jsonify({"ml_synced": ml_synced})
+    else:
+        return jsonify({"error": "Document ml_synced not found"}), 404
+
+
+@async_routes.route("/get_doc_metadata", methods=["GET"])
+async def get_doc_metadata():
+    doc_path = request.args.get("doc_path")
+    doc_metadata = await postgres_manager.get_doc_metadata(doc_path)
+    if doc_metadata:
+        return jsonify(doc_metadata)
+    else:
+        return jsonify({"error": "Document metadata not found"}), 404
+
+
+@async_routes.route("/search_by_metadata", methods=["POST"])
+async def search_by_metadata():
+    data = await request.get_json()
+    tags = data.get("tags", [])
+    path = data.get("path", None)
+    filename = data.get("filename", None)
+    size_filter = data.get("size_filter", None)
+
+    doc_paths = await postgres_manager.search_by_metadata(
+        tags=tags, path=path, filename=filename, size_filter=size_filter
+    )
+    return jsonify({"doc_paths": doc_paths})
+
+
+@async_routes.route("/get_doc_tags", methods=["GET"])
+async def get_doc_tags():
+    doc_path = request.args.get("doc_path")
+    if not doc_path:
+        return jsonify({"error": "Missing 'doc_path' parameter"}), 400
+
+    tags = await postgres_manager.get_doc_tags(doc_path)
+    if tags is not None:
+        return jsonify({"tags": tags})
+    else:
+        return jsonify({"error": "Tags not found for the given document"}), 404
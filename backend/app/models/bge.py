@@ -88,12 +88,19 @@ class BGEModel:
             desc="Inference Embeddings",
             disable=len(tokenized_sentences) < 16,
         ):
-            # tokenized_batch = tokenized_sentences[start_index:start_index + batch_size]
-            tokenized_batch = tokenized_sentences[start_index]
-            # print(tokenized_batch)
+            tokenized_batch = tokenized_sentences[start_index:start_index + batch_size]
+            # Pad the batch to its longest sequence, padding is masked out
             batch_data = {
-                "input_ids": tokenized_batch[0].unsqueeze(0).to(self.device),
-                "attention_mask": tokenized_batch[1].unsqueeze(0).to(self.device),
+                "input_ids": torch.nn.utils.rnn.pad_sequence(
+                    [torch.as_tensor(ids) for ids, _ in tokenized_batch],
+                    batch_first=True,
+                    padding_value=self.tokenizer.pad_token_id,
+                ).to(self.device),
+                "attention_mask": torch.nn.utils.rnn.pad_sequence(
+                    [torch.as_tensor(mask) for _, mask in tokenized_batch],
+                    batch_first=True,
+                    padding_value=0,
+                ).to(self.device),
             }
             output = self.bge.model(
                 batch_data,
@@ -0,0 +1,216 @@
+import os
+import time
+import queue
+import itertools
+import threading
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+from app.utils.scheduler import LANES, current_lane
+
+
+class EncoderServer:
+    """
+    Host BGE-M3 (and Docling, on first use) once per node for every API
+    worker, over a local Unix socket. Each client connection is served by a
+    thread; encode requests of all connections go through one queue and are
+    merged into micro-batches of up to `max_batch` sequences, waiting at most
+    `max_wait_ms` for more requests, so concurrent searches from several
+    workers share forward passes. Requests carry the lane of their caller,
+    and interactive ones are batched before any bulk one still queued.
+    """
+
+    def __init__(self, address, max_batch=64, max_wait_ms=5):
+        self.address = address
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.model = None
+        self.docling = None
+        self.docling_lock = threading.Lock()
+        self.jobs = queue.PriorityQueue()
+        self.counter = itertools.count()
+
+    def _get_docling(self):
+        with self.docling_lock:
+            if self.docling is None:
+                from app.models._docling import Docling
+                self.docling = Docling()
+            return self.docling
+
+    def serve_forever(self):
+        from app.models.bge import BGEModel
+        self.model = BGEModel()
+        threading.Thread(target=self._encode_loop, daemon=True).start()
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, family="AF_UNIX")
+        os.chmod(self.address, 0o600)
+        print(f"Encoder service listening on {self.address}")
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        try:
+            while True:
+                request = conn.recv()
+                try:
+                    if request[0] == "encode":
+                        done = threading.Event()
+                        job = {"pairs": request[1], "kwargs": request[2], "done": done}
+                        priority = LANES.index(request[3]) if len(request) > 3 else 0
+                        self.jobs.put((priority, next(self.counter), job))
+                        done.wait()
+                        result = job["result"]
+                    elif request[0] == "extract":
+                        docling = self._get_docling()
+                        with self.docling_lock:
+                            result = docling.extract_text(request[1])
+                    elif request[0] == "ping":
+                        result = "pong"
+                    else:
+                        result = ValueError(f"Unknown encoder request '{request[0]}'")
+                except Exception as e:
+                    result = e
+                conn.send(result)
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _encode_loop(self):
+        while True:
+            priority, _, job = self.jobs.get()
+            jobs = [job]
+            kwargs = job["kwargs"]
+            size = len(job["pairs"])
+            deadline = time.time() + self.max_wait
+            deferred = []
+            while size < self.max_batch:
+                try:
+                    item = self.jobs.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                job = item[2]
+                # Only requests asking for the same outputs can share a pass,
+                # and interactive ones do not wait for a bulk batch
+                if item[0] != priority or job["kwargs"] != kwargs or size + len(job["pairs"]) > self.max_batch:
+                    deferred.append(item)
+                    break
+                jobs.append(job)
+                size += len(job["pairs"])
+            for item in deferred:
+                self.jobs.put(item)
+
+            try:
+                pairs = [pair for job in jobs for pair in job["pairs"]]
+                output = self.model.encode(pairs, batch_size=self.max_batch, **kwargs)
+                start = 0
+                for job in jobs:
+                    end = start + len(job["pairs"])
+                    job["result"] = {
+                        key: value[start:end] if value is not None else None
+                        for key, value in output.items()
+                    }
+                    start = end
+            except Exception as e:
+                for job in jobs:
+                    job["result"] = e
+            for job in jobs:
+                job["done"].set()
+
+
+class EncoderClient:
+    """Connection to the encoder service, one per thread"""
+
+    def __init__(self, address, connect_timeout=300):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self.local = threading.local()
+
+    def _connect(self):
+        # The service may still be loading its models
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                return Client(self.address, family="AF_UNIX")
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _call(self, *request):
+        for attempt in range(2):
+            conn = getattr(self.local, "conn", None)
+            if conn is None:
+                conn = self.local.conn = self._connect()
+            try:
+                conn.send(request)
+                result = conn.recv()
+                break
+            except (EOFError, OSError):
+                # The service restarted, reconnect once
+                self.local.conn = None
+                if attempt:
+                    raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class RemoteEncoder(EncoderClient):
+    """Drop-in for BGEModel in API workers: tokenizes locally, encodes in the encoder service"""
+
+    def __init__(self, address, model_name="BAAI/bge-m3", connect_timeout=300):
+        super().__init__(address, connect_timeout)
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def encode(
+        self,
+        tokenized_sentences,
+        batch_size=1,
+        return_dense=True,
+        return_sparse=True,
+        return_colbert_vecs=False,
+    ):
+        pairs = [
+            (np.asarray(ids).tolist(), np.asarray(mask).tolist())
+            for ids, mask in tokenized_sentences
+        ]
+        return self._call(
+            "encode",
+            pairs,
+            {
+                "return_dense": return_dense,
+                "return_sparse": return_sparse,
+                "return_colbert_vecs": return_colbert_vecs,
+            },
+            current_lane(),
+        )
+
+    def decode(self, tokenized_batch, skip_special_tokens=True):
+        return self.tokenizer.decode(tokenized_batch, skip_special_tokens=skip_special_tokens)
+
+
+class RemoteDocling(EncoderClient):
+    """Drop-in for Docling in API workers, the conversion runs in the encoder service"""
+
+    def extract_text(self, source: str) -> str:
+        return self._call("extract", source)
+
+
+def main():
+    from config import config
+
+    encoder_config = config.config.get("encoder", {})
+    EncoderServer(
+        encoder_config.get("socket", "/tmp/chishiki-encoder.sock"),
+        max_batch=encoder_config.get("max_batch", 64),
+        max_wait_ms=encoder_config.get("max_wait_ms", 5),
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,114 +1,388 @@
 import os
-import requests
-import hashlib
+import json
+import time
+import queue
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.utils.misc import calculate_file_hash
+from app.utils.ingestion import UNAVAILABLE_ERRORS
 from config import config
 
 
-def calculate_file_hash(file_path):
-    with open(file_path, "rb") as file:
-        file_hash = hashlib.md5(file.read()).hexdigest()
-    return file_hash
+class ScanProgress:
+    """Counters shared by the scanner, the hashing pool and the ingestion stream"""
 
+    def __init__(self, interval=5):
+        self.interval = interval
+        self.start_time = time.time()
+        self.last_report = self.start_time
+        self.lock = threading.Lock()
+        self.counts = {"dirs": 0, "files": 0, "hashed": 0, "queued": 0, "ingested": 0}
 
-def sync_on_boot(docs_path):
-    # Get the list of documents in the docs_path directory
-    docs_in_filesystem = []
-    for root, _, files in os.walk(docs_path):
-        for file in files:
-            if file.endswith(tuple(config.config["extensions"])):
-                docs_in_filesystem.append(os.path.join(root, file))  # Absolute path
-    print(f"Found {len(docs_in_filesystem)} documents in {docs_path}.")
+    def add(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
 
-    # Get the list of documents in the datastore
-    payload = {"tags": [], "path": "", "filename": ""}
-    response = requests.post(
-        f"http://{config.config['backend']['host']}:{config.config['backend']['port']}/search_by_metadata",
-        json=payload,
-    )
-    if response.status_code == 200:
-        docs_in_datastore = response.json()["doc_paths"]
-        # docs_in_datastore = list(set(docs_in_datastore))
-        print(f"Found {len(docs_in_datastore)} documents in the datastore.")
-    else:
+    def report(self, force=False):
+        now = time.time()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        elapsed = max(now - self.start_time, 1e-6)
+        with self.lock:
+            counts = dict(self.counts)
         print(
-            f"Error retrieving document paths from the datastore: {response.status_code}"
+            f"Boot scan: {counts['dirs']} dirs, {counts['files']} files "
+            f"({counts['files'] / elapsed:.0f} files/s), {counts['hashed']} hashed, "
+            f"{counts['ingested']}/{counts['queued']} queued documents ingested, {elapsed:.1f}s"
         )
-        return
 
-    # Sync documents
-    docs_to_insert = []
-    docs_to_update = []
-    for doc_path in docs_in_filesystem:
-        file_hash = calculate_file_hash(doc_path)
 
-        # Check if the document exists in the datastore and get its metadata
-        response = requests.get(
-            f"http://{config.config['backend']['host']}:{config.config['backend']['port']}/get_doc_metadata",
-            params={"doc_path": doc_path},
-        )
+class BootScanner:
+    """
+    Enumerate the documents under docs_path with os.scandir, one directory per
+    task on a thread pool, and yield (doc_path, stat) as directories complete
+    instead of after the whole tree was walked.
+    """
+
+    def __init__(self, docs_path, extensions, workers=8, progress=None):
+        self.docs_path = docs_path
+        self.extensions = tuple(extensions)
+        self.workers = workers
+        self.progress = progress or ScanProgress()
+
+    def _scan_dir(self, path):
+        files, subdirs = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.endswith(self.extensions) and entry.is_file():
+                            files.append((entry.path, entry.stat()))
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Error scanning {path}: {e}")
+        self.progress.add("dirs")
+        return files, subdirs
+
+    def scan(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self._scan_dir, self.docs_path)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    for subdir in subdirs:
+                        pending.add(pool.submit(self._scan_dir, subdir))
+                    yield from files
+
+
+class BootJournal:
+    """
+    Append-only JSONL checkpoint of boot ingestion. Every ingested chunk appends
+    one line per document ({"doc_path", "status", "size", "mtime", "attempts",
+    "error"}), flushed to disk, so a boot interrupted halfway resumes after the
+    last acknowledged chunk. A document that failed max_attempts times is
+    quarantined: skipped by later boots until its size or mtime changes.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line of an interrupted boot
+                    continue
+                entries[entry["doc_path"]] = entry
+        return entries
+
+    @staticmethod
+    def _stamp(stat):
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def should_skip(self, doc_path, stat):
+        """Whether doc_path was ingested or quarantined in its current version"""
+        entry = self.entries.get(doc_path)
+        if entry is None or (entry["size"], entry["mtime"]) != (stat.st_size, stat.st_mtime):
+            return False
+        return entry["status"] == "done" or entry["attempts"] >= self.max_attempts
+
+    def quarantined(self):
+        return [
+            entry for entry in self.entries.values()
+            if entry["status"] == "failed" and entry["attempts"] >= self.max_attempts
+        ]
+
+    def record(self, results):
+        """Append [(doc_path, stat, error or None)] and flush"""
+        with self.lock:
+            lines = []
+            for doc_path, stat, error in results:
+                previous = self.entries.get(doc_path)
+                attempts = 0
+                if error is not None:
+                    same_version = previous is not None and (previous["size"], previous["mtime"]) == (
+                        stat.st_size, stat.st_mtime
+                    )
+                    attempts = (previous["attempts"] if same_version else 0) + 1
+                entry = {
+                    "doc_path": doc_path,
+                    "status": "failed" if error is not None else "done",
+                    **self._stamp(stat),
+                    "attempts": attempts,
+                    "error": error,
+                }
+                self.entries[doc_path] = entry
+                lines.append(json.dumps(entry) + "\n")
+            with open(self.path, "a") as file:
+                file.writelines(lines)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def compact(self, keep=None):
+        """
+        Rewrite the journal once a boot completed: "done" entries are only needed
+        to resume an interrupted boot, failures are kept to count attempts
+        """
+        with self.lock:
+            self.entries = {
+                doc_path: entry for doc_path, entry in self.entries.items()
+                if entry["status"] == "failed" and (keep is None or doc_path in keep)
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as file:
+                for entry in self.entries.values():
+                    file.write(json.dumps(entry) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+
+
+class IngestionStream:
+    """
+    Hand the documents found by the scan to the ingestion service from a
+    background thread, in chunks of at most batch_size, so the first documents
+    are searchable while the rest of the tree is still being scanned. The
+    outcome of every chunk is checkpointed in the journal, and a chunk that
+    failed as a whole is retried one document at a time so a single bad
+    document cannot sink the others. When ingestion itself is unavailable
+    (UNAVAILABLE_ERRORS), the stream stops without journaling anything, so the
+    documents do not use up attempts, and put and close raise the error.
+    """
+
+    def __init__(self, ingestion, batch_size=16, flush_interval=2.0, progress=None, journal=None):
+        self.ingestion = ingestion
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.progress = progress or ScanProgress()
+        self.journal = journal
+        self.queue = queue.Queue()
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, doc_path, stat, update=False):
+        if self.error is not None:
+            raise self.error
+        self.progress.add("queued")
+        self.queue.put((doc_path, stat, update))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        batch = []
+        closed = False
+        while not closed:
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closed = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._ingest(batch)
+                except UNAVAILABLE_ERRORS as e:
+                    self.error = e
+                    return
+                batch = []
 
-        if response.status_code == 200:
-            stored_doc = response.json()
-            stored_hash = stored_doc.get("file_hash")
-            ml_synced = stored_doc.get("ml_synced")
-        else:
-            stored_doc = None
-            stored_hash = None
-            ml_synced = None
-
-        if stored_doc is None:
-            docs_to_insert.append(doc_path)
-        elif stored_hash != file_hash or ml_synced == False:
-            docs_to_update.append(doc_path)
-        else:
-            print(f"Document {doc_path} already exists and is fully indexed.")
-
-    # Insert new documents
-    if docs_to_insert:
-        response = requests.post(
-            f"http://{config.config['backend']['host']}:{config.config['backend']['port']}/insert_documents",
-            json={
-                "doc_paths": docs_to_insert,
-                "window_sizes": config.config["windows"],
-            },
+    def _post(self, doc_paths):
+        """Return {doc_path: error} of the failed documents, raise if the whole chunk failed"""
+        result = self.ingestion.ingest(doc_paths, window_sizes=config.config["windows"])
+        return {failure["doc_path"]: failure["error"] for failure in result["failed"]}
+
+    def _ingest(self, batch):
+        doc_paths = [doc_path for doc_path, _, _ in batch]
+        try:
+            errors = self._post(doc_paths)
+        except UNAVAILABLE_ERRORS:
+            raise
+        except Exception as e:
+            if len(batch) > 1:
+                print(f"Error ingesting {len(batch)} documents ({e}), retrying one by one.")
+                for item in batch:
+                    self._ingest([item])
+                return
+            errors = {doc_paths[0]: str(e)}
+
+        results = []
+        for doc_path, stat, update in batch:
+            error = errors.get(doc_path)
+            if error is not None:
+                print(f"Error ingesting document {doc_path}: {error}")
+                self.failed += 1
+            elif update:
+                self.updated += 1
+            else:
+                self.inserted += 1
+            results.append((doc_path, stat, error))
+        if self.journal is not None:
+            self.journal.record(results)
+        self.progress.add("ingested", len(batch))
+
+
+def fetch_manifest(ingestion, prefix=None, page_size=5000):
+    """Return {doc_path: manifest entry} for the documents stored under prefix"""
+    manifest = {}
+    after = None
+    while True:
+        documents, after = ingestion.manifest(prefix=prefix, after=after, limit=page_size)
+        for document in documents:
+            manifest[document["doc_path"]] = document
+        if after is None:
+            return manifest
+
+
+def sync_on_boot(docs_path, ingestion):
+    sync_config = config.config.get("sync", {})
+
+    # Get the sync state of the datastore in a few pages
+    try:
+        docs_in_datastore = fetch_manifest(
+            ingestion,
+            page_size=sync_config.get("manifest_page_size", 5000),
         )
-        if response.status_code == 200:
-            print(f"Inserted {len(docs_to_insert)} new documents.")
-        else:
-            print(f"Error inserting new documents: {response.status_code}")
-
-    # Update existing documents
-    if docs_to_update:
-        response = requests.post(
-            f"http://{config.config['backend']['host']}:{config.config['backend']['port']}/insert_documents",
-            json={
-                "doc_paths": docs_to_update,
-                "window_sizes": config.config["windows"],
-            },
+        print(f"Found {len(docs_in_datastore)} documents in the datastore.")
+    except Exception as e:
+        print(f"Error retrieving the manifest from the datastore: {e}")
+        return
+
+    progress = ScanProgress(interval=sync_config.get("progress_interval", 5))
+    scanner = BootScanner(
+        docs_path,
+        config.config["extensions"],
+        workers=sync_config.get("scan_workers", 8),
+        progress=progress,
+    )
+    journal = BootJournal(
+        sync_config.get("journal_path")
+        or os.path.join(os.path.dirname(config.config_file), "boot_journal.jsonl"),
+        max_attempts=sync_config.get("max_attempts", 3),
+    )
+    if journal.entries:
+        print(f"Resuming boot sync from a journal of {len(journal.entries)} documents.")
+    stream = IngestionStream(
+        ingestion,
+        batch_size=sync_config.get("ingest_batch_size", 16),
+        progress=progress,
+        journal=journal,
+    )
+
+    # Hashing is I/O bound: a bounded pool, and a bounded number of files waiting
+    # for it so a huge tree does not pile up in memory
+    hash_workers = sync_config.get("hash_workers", 4)
+    hash_slots = threading.BoundedSemaphore(hash_workers * 4)
+
+    def check_hash(doc_path, stat, file_hash):
+        try:
+            if file_hash != calculate_file_hash(doc_path):
+                stream.put(doc_path, stat, update=True)
+        except OSError as e:
+            print(f"Error hashing {doc_path}: {e}")
+        finally:
+            progress.add("hashed")
+            hash_slots.release()
+
+    # Sync documents while the tree is scanned
+    docs_in_filesystem = set()
+    try:
+        with ThreadPoolExecutor(max_workers=hash_workers) as hash_pool:
+            for doc_path, stat in scanner.scan():
+                docs_in_filesystem.add(doc_path)
+                progress.add("files")
+                progress.report()
+                stored_doc = docs_in_datastore.get(doc_path)
+
+                if journal.should_skip(doc_path, stat):
+                    # Ingested before an interrupted boot, or quarantined
+                    continue
+                elif stored_doc is None:
+                    stream.put(doc_path, stat)
+                elif stored_doc["ml_synced"] == False:
+                    stream.put(doc_path, stat, update=True)
+                elif stored_doc["size"] == stat.st_size and datetime.datetime.fromisoformat(
+                    stored_doc["modification_time"]
+                ) == datetime.datetime.fromtimestamp(stat.st_mtime):
+                    # Same size and mtime as when it was indexed, skip hashing
+                    continue
+                else:
+                    hash_slots.acquire()
+                    hash_pool.submit(check_hash, doc_path, stat, stored_doc["file_hash"])
+        print(f"Found {len(docs_in_filesystem)} documents in {docs_path}.")
+
+        stream.close()
+    except UNAVAILABLE_ERRORS as e:
+        # The journal keeps what was acknowledged, the next boot resumes there
+        print(f"Boot sync stopped, ingestion is unavailable: {e}")
+        return
+    progress.report(force=True)
+    print(f"Inserted {stream.inserted} new documents.")
+    print(f"Updated {stream.updated} existing documents.")
+    if stream.failed:
+        print(f"Failed to ingest {stream.failed} documents.")
+    quarantined = [entry for entry in journal.quarantined() if entry["doc_path"] in docs_in_filesystem]
+    if quarantined:
+        print(
+            f"{len(quarantined)} documents quarantined after {journal.max_attempts} failed attempts, "
+            f"they are retried once modified (see {journal.path})."
         )
-        if response.status_code == 200:
-            print(f"Updated {len(docs_to_update)} existing documents.")
-        else:
-            print(f"Error updating existing documents: {response.status_code}")
+    # The boot completed, only failures are worth carrying over
+    journal.compact(keep=docs_in_filesystem)
 
     # Remove documents from the datastore that no longer exist in the file system
-    docs_to_remove = []
-    for doc_path in docs_in_datastore:
-        if doc_path not in docs_in_filesystem:
-            docs_to_remove.append(doc_path)
-
-    for window_size in config.config["windows"]:
-        if docs_to_remove:
-            response = requests.post(
-                f"http://{config.config['backend']['host']}:{config.config['backend']['port']}/delete_documents",
-                json={"doc_paths": docs_to_remove, "window_size": window_size},
-            )
-            if response.status_code == 200:
-                print(f"Removed {len(docs_to_remove)} documents from the datastore.")
-            else:
-                print(
-                    f"Error removing documents from the datastore: {response.status_code}"
-                )
+    docs_to_remove = list(docs_in_datastore.keys() - docs_in_filesystem)
+    if docs_to_remove:
+        try:
+            ingestion.delete(docs_to_remove)
+            print(f"Removed {len(docs_to_remove)} documents from the datastore.")
+        except Exception as e:
+            print(f"Error removing documents from the datastore: {e}")
 
     # Save the datastore
     # response = requests.post(
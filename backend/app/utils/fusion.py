@@ -0,0 +1,71 @@
+from typing import Dict, List, Tuple
+
+SearchResult = Tuple[Tuple[str, int, int], Tuple[float, float, float]]
+
+
+def span_overlap(start_a, end_a, start_b, end_b):
+    """Overlap of two spans, relative to the shorter one (1.0 if one contains the other)"""
+    intersection = min(end_a, end_b) - max(start_a, start_b)
+    if intersection <= 0:
+        return 0.0
+    return intersection / max(1, min(end_a - start_a, end_b - start_b))
+
+
+def fuse_window_results(
+    results_by_window: Dict[int, List[SearchResult]],
+    k: int = 30,
+    method: str = "rrf",
+    rrf_k: int = 60,
+    overlap_threshold: float = 0.5,
+) -> List[Dict]:
+    """
+    Fuse the ranked lists of several window sizes into a single ranking.
+
+    Hits are visited best first; a hit overlapping an already kept span of the same
+    document is folded into it instead of being returned twice. With "rrf" the
+    reciprocal ranks of folded hits are summed, so a span found at several
+    granularities ranks higher; with "max" the best combined score is kept.
+    """
+    if method not in ("rrf", "max"):
+        raise ValueError(f"Unsupported fusion method '{method}', expected 'rrf' or 'max'")
+
+    hits = []
+    for window_size, results in results_by_window.items():
+        for rank, ((doc_path, start_pos, end_pos), scores) in enumerate(results):
+            score = 1.0 / (rrf_k + rank + 1) if method == "rrf" else float(scores[2])
+            hits.append((score, window_size, doc_path, int(start_pos), int(end_pos), scores))
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+
+    kept_by_doc = {}
+    fused = []
+    for score, window_size, doc_path, start_pos, end_pos, scores in hits:
+        kept = next(
+            (
+                passage
+                for passage in kept_by_doc.get(doc_path, [])
+                if span_overlap(start_pos, end_pos, passage["start_pos"], passage["end_pos"])
+                >= overlap_threshold
+            ),
+            None,
+        )
+        if kept is not None:
+            if method == "rrf":
+                kept["fused_score"] += score
+            if window_size not in kept["window_sizes"]:
+                kept["window_sizes"].append(window_size)
+            continue
+
+        passage = {
+            "doc_path": doc_path,
+            "start_pos": start_pos,
+            "end_pos": end_pos,
+            "scores": scores,
+            "window_size": window_size,
+            "window_sizes": [window_size],
+            "fused_score": score,
+        }
+        kept_by_doc.setdefault(doc_path, []).append(passage)
+        fused.append(passage)
+
+    fused.sort(key=lambda passage: passage["fused_score"], reverse=True)
+    return fused[:k]
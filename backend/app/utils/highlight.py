@@ -0,0 +1,78 @@
+from itertools import chain
+from typing import Dict, List
+
+import numpy as np
+
+
+def highlight_passages(
+    tokenizer,
+    texts: List[str],
+    query_lexical_weights: Dict[str, float],
+    merge_gap: int = 1,
+) -> List[List[List[float]]]:
+    """
+    Compute highlight spans for a batch of passages.
+
+    All the passages are tokenized in a single call (offsets included), then the
+    tokens of the whole batch are matched against the query lexical weights as one
+    flat array. Returns, for every text, a list of [start, end, weight] character
+    spans; adjacent matched tokens (up to `merge_gap` characters apart) are merged
+    and keep the highest weight.
+    """
+    highlights = [[] for _ in texts]
+    if not texts or not query_lexical_weights:
+        return highlights
+
+    encoded = tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=False,
+        return_attention_mask=False,
+        return_offsets_mapping=True,
+    )
+    lengths = np.fromiter(
+        (len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts)
+    )
+    total = int(lengths.sum())
+    if total == 0:
+        return highlights
+
+    flat_ids = np.fromiter(
+        chain.from_iterable(encoded["input_ids"]), dtype=np.int64, count=total
+    )
+    flat_offsets = np.fromiter(
+        chain.from_iterable(chain.from_iterable(encoded["offset_mapping"])),
+        dtype=np.int64,
+        count=total * 2,
+    ).reshape(-1, 2)
+    text_index = np.repeat(np.arange(len(texts)), lengths)
+
+    # Lexical weights are keyed by the token id as a string
+    query_ids = np.fromiter(
+        (int(token) for token in query_lexical_weights), dtype=np.int64
+    )
+    query_weights = np.fromiter(
+        (float(weight) for weight in query_lexical_weights.values()), dtype=np.float64
+    )
+    order = np.argsort(query_ids)
+    query_ids, query_weights = query_ids[order], query_weights[order]
+
+    positions = np.clip(np.searchsorted(query_ids, flat_ids), 0, len(query_ids) - 1)
+    matched = np.nonzero(
+        (query_ids[positions] == flat_ids) & (flat_offsets[:, 1] > flat_offsets[:, 0])
+    )[0]
+
+    for i, start, end, weight in zip(
+        text_index[matched].tolist(),
+        flat_offsets[matched, 0].tolist(),
+        flat_offsets[matched, 1].tolist(),
+        query_weights[positions[matched]].tolist(),
+    ):
+        spans = highlights[i]
+        if spans and start - spans[-1][1] <= merge_gap:
+            spans[-1][1] = max(spans[-1][1], end)
+            spans[-1][2] = max(spans[-1][2], weight)
+        else:
+            spans.append([start, end, weight])
+
+    return highlights
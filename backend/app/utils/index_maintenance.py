@@ -0,0 +1,427 @@
+import re
+import json
+import time
+import logging
+import argparse
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any
+
+from app.utils.pg_manager import PostgresManager
+
+logger = logging.getLogger(__name__)
+
+
+# Passages of live documents only, tombstoned ones (see PostgresManager.delete_docs)
+# are invisible to searches and must not count as neighbours
+LIVE_PASSAGE = """
+    EXISTS (
+        SELECT 1 FROM document_metadata dm
+        WHERE dm.file_hash = p.file_hash AND dm.deleted_at IS NULL
+    )
+"""
+
+
+@contextmanager
+def autocommit(postgres_manager: PostgresManager):
+    """Pooled connection in autocommit mode, for the CONCURRENTLY statements"""
+    with postgres_manager.connection() as conn:
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            conn.autocommit = False
+
+
+class IndexMaintenance:
+    """
+    Inspect the ANN index of every window size and rebuild it online when the
+    corpus outgrew its parameters. A rebuilt index is only swapped in once its
+    recall on passages sampled from the corpus, measured against exact search,
+    reaches `min_recall`.
+    """
+
+    def __init__(
+        self,
+        postgres_manager: PostgresManager,
+        sample_queries: int = 50,
+        k: int = 10,
+        min_recall: float = 0.9,
+        lock_timeout_ms: int = 5000,
+    ):
+        self.postgres_manager = postgres_manager
+        self.sample_queries = sample_queries
+        self.k = k
+        self.min_recall = min_recall
+        self.lock_timeout_ms = lock_timeout_ms
+
+    def _table(self, window_size: int) -> str:
+        if self.postgres_manager.is_partitioned():
+            return f"passages_w{int(window_size)}"
+        return "passages"
+
+    @staticmethod
+    def recommend(method: str, rows: int) -> Dict[str, int]:
+        """Index parameters suited to a number of rows, following pgvector's guidance"""
+        if method == "ivfflat":
+            lists = rows // 1000 if rows <= 1_000_000 else int(rows ** 0.5)
+            return {"lists": max(10, lists)}
+        m = 16 if rows < 1_000_000 else 24 if rows < 10_000_000 else 32
+        return {"m": m, "ef_construction": 4 * m}
+
+    def inspect(self) -> List[Dict[str, Any]]:
+        """Corpus size, index parameters and health of every window size"""
+        with self.postgres_manager.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT window_size, count(*) FROM passages GROUP BY window_size ORDER BY window_size")
+            rows_by_window = dict(cur.fetchall())
+
+        report = []
+        for window_size, rows in rows_by_window.items():
+            index_config = self.postgres_manager.get_index_config(window_size)
+            index_name = f"idx_passages_dense_w{window_size}"
+            table = self._table(window_size)
+
+            with self.postgres_manager.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT pg_relation_size(c.oid), am.amname, c.reloptions, i.indisvalid, s.idx_scan
+                    FROM pg_class c
+                    JOIN pg_index i ON i.indexrelid = c.oid
+                    JOIN pg_am am ON am.oid = c.relam
+                    LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = c.oid
+                    WHERE c.relname = %s
+                """, (index_name,))
+                index_row = cur.fetchone()
+                cur.execute("""
+                    SELECT n_live_tup, n_dead_tup, last_vacuum, last_autovacuum
+                    FROM pg_stat_user_tables
+                    WHERE relname = %s
+                """, (table,))
+                table_row = cur.fetchone()
+
+            entry = {
+                "window_size": window_size,
+                "rows": rows,
+                "index": None,
+                "table": table,
+                "dead_tuple_ratio": None,
+                "last_vacuum": None,
+                "needs_reindex": False,
+                "needs_retune": False,
+            }
+            if table_row:
+                live, dead = table_row[0] or 0, table_row[1] or 0
+                entry["dead_tuple_ratio"] = round(dead / max(1, live + dead), 4)
+                last_vacuum = max(filter(None, table_row[2:4]), default=None)
+                entry["last_vacuum"] = last_vacuum.isoformat() if last_vacuum else None
+                entry["needs_reindex"] = entry["dead_tuple_ratio"] > 0.2
+
+            if index_row is None:
+                entry["needs_retune"] = rows > 0
+            else:
+                size, method, reloptions, valid, scans = index_row
+                params = {
+                    key: int(value)
+                    for key, value in (re.match(r"(\w+)=(\d+)", option).groups() for option in reloptions or [])
+                }
+                recommended = self.recommend(method, rows)
+                entry["index"] = {
+                    "name": index_name,
+                    "method": method,
+                    "precision": index_config["precision"],
+                    "params": params,
+                    "recommended_params": recommended,
+                    "size_bytes": size,
+                    "bytes_per_row": round(size / max(1, rows), 1),
+                    "valid": valid,
+                    "scans": scans,
+                }
+                entry["needs_reindex"] = entry["needs_reindex"] or not valid
+                if method == "ivfflat":
+                    lists = params.get("lists", 100)
+                    entry["needs_retune"] = not recommended["lists"] / 2 <= lists <= recommended["lists"] * 2
+                else:
+                    entry["needs_retune"] = params.get("m", 16) < recommended["m"]
+            report.append(entry)
+        return report
+
+    def _sample_queries(self, window_size: int) -> List[str]:
+        """Dense vectors of passages drawn at random, used as queries"""
+        with self.postgres_manager.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT p.dense_vector::text
+                FROM passages p
+                WHERE p.window_size = {int(window_size)} AND p.dense_vector IS NOT NULL
+                AND {LIVE_PASSAGE}
+                ORDER BY random()
+                LIMIT %s
+            """, (self.sample_queries,))
+            return [row[0] for row in cur.fetchall()]
+
+    def _exact_neighbours(self, window_size: int, queries: List[str]) -> List[set]:
+        with self.postgres_manager.connection() as conn, conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_indexscan = off")
+            cur.execute("SET LOCAL enable_bitmapscan = off")
+            neighbours = []
+            for query in queries:
+                cur.execute(f"""
+                    SELECT passage_id
+                    FROM passages p
+                    WHERE p.window_size = {int(window_size)}
+                    AND {LIVE_PASSAGE}
+                    ORDER BY p.dense_vector <=> %s::vector
+                    LIMIT %s
+                """, (query, self.k))
+                neighbours.append({row[0] for row in cur.fetchall()})
+            return neighbours
+
+    def _recall(self, cur, window_size: int, index_config: Dict, queries: List[str], exact: List[set]) -> float:
+        """
+        Recall@k of the two-stage search path (ANN candidates, exact rescoring)
+        through whatever vector index is visible to `cur`
+        """
+        pm = self.postgres_manager
+        precision = index_config["precision"]
+        oversample = max(1, int(index_config["oversample"])) if precision != "float32" else 1
+        order_by = pm._order_by_expression(precision, f"%s::vector({pm.dense_dim})")
+        cur.execute(
+            "SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+            (str(max(40, min(self.k * oversample, 1000))), str(max(1, int(index_config.get("probes", 1))))),
+        )
+
+        recalls = []
+        for query, expected in zip(queries, exact):
+            cur.execute(f"""
+                SELECT c.passage_id
+                FROM (
+                    SELECT p.passage_id, p.dense_vector
+                    FROM passages p
+                    WHERE p.window_size = {int(window_size)}
+                    AND {LIVE_PASSAGE}
+                    ORDER BY {order_by}
+                    LIMIT %s
+                ) c
+                ORDER BY c.dense_vector <=> %s::vector
+                LIMIT %s
+            """, (query, self.k * oversample, query, self.k))
+            found = {row[0] for row in cur.fetchall()}
+            recalls.append(len(found & expected) / max(1, len(expected)))
+        return round(sum(recalls) / max(1, len(recalls)), 4)
+
+    def measure_recall(self, window_size: int) -> Optional[float]:
+        """Recall@k of the current index of a window size"""
+        queries = self._sample_queries(window_size)
+        if not queries:
+            return None
+        exact = self._exact_neighbours(window_size, queries)
+        index_config = self.postgres_manager.get_index_config(window_size)
+        with self.postgres_manager.connection() as conn, conn.cursor() as cur:
+            return self._recall(cur, window_size, index_config, queries, exact)
+
+    def reindex(self, window_size: int) -> None:
+        """Rebuild the index of a window size as is, without blocking writes"""
+        index_name = f"idx_passages_dense_w{int(window_size)}"
+        with autocommit(self.postgres_manager) as conn, conn.cursor() as cur:
+            cur.execute(f"REINDEX INDEX CONCURRENTLY {index_name}")
+        logger.info(f"Vector index '{index_name}' reindexed")
+
+    def _swap(self, window_size: int, save_config) -> None:
+        """
+        Replace the index of a window size by the `_new` one. DROP INDEX locks
+        the passages table, so the transaction holds nothing else and gives up
+        after `lock_timeout_ms` instead of queueing searches behind it.
+        """
+        index_name = f"idx_passages_dense_w{int(window_size)}"
+        with self.postgres_manager.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT set_config('lock_timeout', %s, true)", (f"{self.lock_timeout_ms}ms",))
+            cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+            cur.execute(f"ALTER INDEX {index_name}_new RENAME TO {index_name}")
+            save_config(cur)
+
+    def _build_new(self, definition: str) -> None:
+        """Build the `_new` index of a window size without blocking writes"""
+        new_index_name = re.search(r"CREATE INDEX (?:CONCURRENTLY )?(\w+)", definition).group(1)
+        with autocommit(self.postgres_manager) as conn, conn.cursor() as cur:
+            # Leftover of an interrupted rebuild, possibly invalid
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_index_name}")
+            cur.execute(definition)
+
+    def _new_index_recall(self, window_size: int, index_config: Dict, queries: List[str], exact: List[set]) -> float:
+        """
+        Recall@k of the `_new` index of a window size, before it is swapped in.
+        The current index is dropped in a transaction that is always rolled
+        back, so the planner can only pick the new one while nothing changes for
+        other sessions. Searches wait on the passages table for the measurement,
+        and the lock is given up after `lock_timeout_ms` if it is not granted.
+        """
+        index_name = f"idx_passages_dense_w{int(window_size)}"
+        with self.postgres_manager.connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT set_config('lock_timeout', %s, true)", (f"{self.lock_timeout_ms}ms",))
+                    cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+                    return self._recall(cur, window_size, index_config, queries, exact)
+            finally:
+                conn.rollback()
+
+    def _drop_new(self, window_size: int) -> None:
+        with autocommit(self.postgres_manager) as conn, conn.cursor() as cur:
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS idx_passages_dense_w{int(window_size)}_new")
+
+    def rebuild(
+        self,
+        window_size: int,
+        method: Optional[str] = None,
+        precision: Optional[str] = None,
+        oversample: Optional[int] = None,
+        index_params: Optional[Dict[str, int]] = None,
+        min_recall: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Build a new index for a window size next to the current one, with
+        CREATE INDEX CONCURRENTLY, then swap it in. Parameters default to the
+        current ones, and index parameters to the recommended ones for the
+        current corpus size.
+
+        The recall of the new index is measured before the swap. Below
+        `min_recall`, the new index is dropped and the current one is left
+        alone, searches never run on a rejected index. The swap (drop the old
+        index, rename the new one, save the configuration) is a transaction of
+        its own: it locks the passages table, so it must not last longer than
+        those statements.
+        """
+        pm = self.postgres_manager
+        window_size = int(window_size)
+        min_recall = self.min_recall if min_recall is None else min_recall
+        current = pm.get_index_config(window_size)
+        method = method or current.get("method", "hnsw")
+        precision = precision or current["precision"]
+        oversample = oversample or current["oversample"]
+        index_name = f"idx_passages_dense_w{window_size}"
+        new_index_name = f"{index_name}_new"
+
+        with pm.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT count(*) FROM passages WHERE window_size = {window_size}")
+            rows = cur.fetchone()[0]
+        if index_params is None:
+            index_params = self.recommend(method, rows)
+
+        queries = self._sample_queries(window_size)
+        exact = self._exact_neighbours(window_size, queries)
+        previous_recall = None
+        if queries:
+            with pm.connection() as conn, conn.cursor() as cur:
+                previous_recall = self._recall(cur, window_size, current, queries, exact)
+
+        definition, params = pm.vector_index_definition(
+            window_size, precision, method, index_params, new_index_name, concurrently=True
+        )
+        start_time = time.perf_counter()
+        self._build_new(definition)
+        build_seconds = round(time.perf_counter() - start_time, 3)
+
+        result = {
+            "window_size": window_size,
+            "swapped": False,
+            "rows": rows,
+            "method": method,
+            "precision": precision,
+            "index_params": params,
+            "build_seconds": build_seconds,
+            "previous_recall": previous_recall,
+            "recall": None,
+        }
+        try:
+            if queries:
+                result["recall"] = self._new_index_recall(
+                    window_size, pm.index_config_params(precision, oversample, method, params), queries, exact
+                )
+            if result["recall"] is None or result["recall"] >= min_recall:
+                self._swap(
+                    window_size,
+                    lambda cur: pm.save_index_config(cur, window_size, precision, oversample, method, params),
+                )
+                result["swapped"] = True
+        except Exception as e:
+            logger.error(f"Vector index '{index_name}' not swapped: {str(e)}")
+            self._drop_new(window_size)
+            raise
+
+        if not result["swapped"]:
+            logger.error(
+                f"Recall {result['recall']} of the new index '{new_index_name}' is below {min_recall}, "
+                "keeping the current one"
+            )
+            self._drop_new(window_size)
+            return result
+
+        logger.info(f"Vector index '{index_name}' rebuilt ({method}, {params}, recall {result['recall']})")
+        return result
+
+    def retune(self, dry_run: bool = False) -> List[Dict[str, Any]]:
+        """Rebuild the indexes whose parameters no longer fit, reindex the bloated ones"""
+        actions = []
+        for entry in self.inspect():
+            if entry["needs_retune"]:
+                action = {"window_size": entry["window_size"], "action": "rebuild"}
+                if not dry_run:
+                    action["result"] = self.rebuild(entry["window_size"])
+                actions.append(action)
+            elif entry["needs_reindex"]:
+                action = {"window_size": entry["window_size"], "action": "reindex"}
+                if not dry_run:
+                    self.reindex(entry["window_size"])
+                actions.append(action)
+        return actions
+
+
+def main():
+    from config import config
+
+    parser = argparse.ArgumentParser(description="Inspect and retune the vector indexes")
+    parser.add_argument("command", choices=["inspect", "recall", "rebuild", "reindex", "retune"])
+    parser.add_argument("--window-size", type=int, default=None)
+    parser.add_argument("--method", choices=["hnsw", "ivfflat"], default=None)
+    parser.add_argument("--precision", choices=["float32", "halfvec", "binary"], default=None)
+    parser.add_argument("--params", type=json.loads, default=None,
+                        help='Index parameters as JSON, e.g. \'{"lists": 500}\'')
+    parser.add_argument("--sample-queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    postgres_manager = PostgresManager(
+        host=config.config["postgres"]["host"],
+        port=config.config["postgres"]["port"],
+        default_precision=config.config.get("vector_index", {}).get("precision", "float32"),
+        default_oversample=config.config.get("vector_index", {}).get("oversample", 4),
+    )
+    maintenance = IndexMaintenance(
+        postgres_manager,
+        sample_queries=args.sample_queries,
+        k=args.k,
+        min_recall=args.min_recall,
+    )
+
+    if args.command in ("recall", "rebuild", "reindex") and args.window_size is None:
+        parser.error(f"{args.command} needs --window-size")
+
+    if args.command == "inspect":
+        result = maintenance.inspect()
+    elif args.command == "recall":
+        result = {"window_size": args.window_size, "recall": maintenance.measure_recall(args.window_size)}
+    elif args.command == "rebuild":
+        result = maintenance.rebuild(
+            args.window_size, method=args.method, precision=args.precision, index_params=args.params
+        )
+    elif args.command == "reindex":
+        maintenance.reindex(args.window_size)
+        result = {"window_size": args.window_size, "reindexed": True}
+    else:
+        result = maintenance.retune(dry_run=args.dry_run)
+
+    print(json.dumps(result, indent=4, default=str))
+    postgres_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import numpy as np
+import psycopg2
+from contextlib import nullcontext
+from typing import Optional, List, Dict, Tuple, Any
+from app.utils.pg_manager import PoolTimeoutError
+from app.utils.misc import calculate_file_hash, passages_generator, generate_passage_id
+from app.utils.docs2text import extractors
+from app.utils.scheduler import lane
+
+
+class MLServiceUnavailable(Exception):
+    pass
+
+
+# Failures of the service as a whole rather than of one document: every other
+# document would fail the same way, so they abort the batch instead of being
+# reported per document
+UNAVAILABLE_ERRORS = (MLServiceUnavailable, PoolTimeoutError, psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class IngestionService:
+    """
+    In-process ingestion API shared by the HTTP routes and the sync components
+    (boot sync, watchdog), so they use the same database pool, model and
+    extraction pipeline without a loopback HTTP round trip per batch.
+
+    All of it runs in the bulk lane: with a `scheduler`, every passage waits
+    for an encoder slot, so searches get the model between two passages.
+    """
+
+    def __init__(self, postgres_manager, model_manager, docling=None, deletion_mode="hard", scheduler=None):
+        self.postgres_manager = postgres_manager
+        self.model_manager = model_manager
+        self.docling = docling
+        self.deletion_mode = deletion_mode
+        self.scheduler = scheduler
+
+    def _encoder_slot(self):
+        return self.scheduler.encoder.slot() if self.scheduler is not None else nullcontext()
+
+    def ingest(
+        self,
+        doc_paths: List[str],
+        window_sizes: Optional[List[int]] = None,
+        stride: float = 0.75,
+    ) -> Dict[str, List]:
+        """
+        Extract, embed and store documents. A failing document is reported in
+        "failed" and left unsynced, the others are still ingested. Raise
+        MLServiceUnavailable when the embedding model is disabled, and the
+        other UNAVAILABLE_ERRORS when the database cannot be reached.
+        """
+        window_sizes = window_sizes or [512]
+        inserted = []
+        failed = []
+        with lane("bulk"):
+            for doc_path in doc_paths:
+                try:
+                    if self._ingest_document(doc_path, window_sizes, stride):
+                        inserted.append(doc_path)
+                    else:
+                        failed.append({"doc_path": doc_path, "error": "Unsupported file type"})
+                except UNAVAILABLE_ERRORS:
+                    raise
+                except Exception as e:
+                    # One bad document must not abort the batch, leave it unsynced
+                    print(f"Error ingesting document {doc_path}: {e}")
+                    failed.append({"doc_path": doc_path, "error": str(e)})
+                    try:
+                        self.postgres_manager.update_doc_ml_synced(doc_path, False)
+                    except Exception:
+                        pass
+        return {"inserted": inserted, "failed": failed}
+
+    def _ingest_document(self, doc_path: str, window_sizes: List[int], stride: float) -> bool:
+        postgres_manager = self.postgres_manager
+        file_hash = calculate_file_hash(doc_path)
+        filename = os.path.basename(doc_path)
+        file_extension = (
+            os.path.splitext(filename)[1][1:] if "." in filename else filename
+        )
+        # Same content as a stored document whose file is gone: a rename or
+        # move, rewrite its path instead of extracting and embedding again
+        stored_doc = postgres_manager.get_doc_by_hash(file_hash)
+        if (
+            stored_doc is not None
+            and stored_doc["doc_path"] == doc_path
+            and stored_doc["ml_synced"]
+            and set(window_sizes) <= set(postgres_manager.get_doc_window_sizes(file_hash))
+        ):
+            # Already up to date, e.g. a change reported twice or a touched file
+            return True
+        if (
+            stored_doc is not None
+            and stored_doc["doc_path"] != doc_path
+            and stored_doc["ml_synced"]
+            and not os.path.exists(stored_doc["doc_path"])
+        ):
+            if postgres_manager.move_docs({stored_doc["doc_path"]: doc_path}):
+                print(f"Document {stored_doc['doc_path']} moved to {doc_path}")
+                return True
+
+        # UNIX timestamps
+        creation_time = os.path.getctime(doc_path)
+        modification_time = os.path.getmtime(doc_path)
+        size = os.path.getsize(doc_path)
+
+        postgres_manager.insert_metadata(
+            doc_path,
+            file_hash,
+            filename,
+            file_extension,
+            creation_time,
+            modification_time,
+            size,
+        )
+
+        model, tokenizer = self.model_manager.get_model()
+        if model is None:
+            postgres_manager.update_doc_ml_synced(doc_path, False)
+            raise MLServiceUnavailable('ML service not enabled, set "use_bge" to True to enable')
+
+        if doc_path.split(".")[-1] not in extractors:
+            postgres_manager.update_doc_ml_synced(doc_path, False)
+            print(f"Document {doc_path} not supported")
+            return False
+
+        text = extractors[doc_path.split(".")[-1]](doc_path, self.docling)
+
+        postgres_manager.set_doc_text(doc_path, text)
+
+        import torch
+
+        all_dense_vectors = []
+
+        for window_size in window_sizes:
+            passage_generator = passages_generator(
+                text, tokenizer, window_size=window_size, stride=stride
+            )
+            for i, (passage_ids, passage_mask, start_pos, end_pos) in enumerate(
+                passage_generator
+            ):
+                print(f"Inserting passage {i + 1} with window size {window_size}")
+                with self._encoder_slot(), torch.no_grad():
+                    encoding = model.encode(
+                        [(passage_ids, passage_mask)],
+                        return_dense=True,
+                        return_sparse=True,
+                    )
+                    dense_vector, lexical_weights = (
+                        encoding["dense_vecs"][0],
+                        encoding["lexical_weights"][0],
+                    )
+                all_dense_vectors.append(dense_vector)
+                passage_id = generate_passage_id(dense_vector, doc_path)
+                postgres_manager.insert_passage(
+                    passage_id,
+                    doc_path,
+                    file_hash,
+                    filename,
+                    dense_vector,
+                    lexical_weights,
+                    start_pos,
+                    end_pos,
+                    window_size,
+                )
+
+        mean_dense_vector = np.mean(all_dense_vectors, axis=0)
+        postgres_manager.insert_mean_dense_vector(doc_path, mean_dense_vector)
+
+        postgres_manager.update_doc_ml_synced(doc_path, True)
+        return True
+
+    def delete(self, doc_paths: List[str], mode: Optional[str] = None) -> int:
+        mode = mode or self.deletion_mode
+        if mode not in ("hard", "tombstone"):
+            raise ValueError("'mode' must be either 'hard' or 'tombstone'")
+        with lane("bulk"):
+            return self.postgres_manager.delete_docs(doc_paths, tombstone=mode == "tombstone")
+
+    def move(self, moves: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Return the moved sources, and the sources that are not stored"""
+        with lane("bulk"):
+            moved = self.postgres_manager.move_docs(moves)
+        moved_set = set(moved)
+        return moved, [src_path for src_path in moves if src_path not in moved_set]
+
+    def manifest(
+        self,
+        prefix: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = 5000,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return a page of the manifest, and the 'after' of the next page (None on the last one)"""
+        documents = self.postgres_manager.get_manifest(prefix=prefix, after=after, limit=limit)
+        return documents, documents[-1]["doc_path"] if len(documents) == limit else None
@@ -0,0 +1,159 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+
+class Counter(Gauge):
+    def dec(self, amount: float = 1) -> None:
+        raise ValueError("Counters can only increase")
+
+
+class MetricsRegistry:
+    """Minimal in-process metrics store, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self.values: Dict[Tuple[str, Tuple], Gauge] = {}
+        self.descriptions: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def _value(self, cls, name, description, labels):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = cls()
+                self.descriptions.setdefault(name, description)
+            return self.values[key]
+
+    def gauge(self, name: str, description: str = "", labels: Optional[Dict[str, str]] = None) -> Gauge:
+        return self._value(Gauge, name, description, labels)
+
+    def counter(self, name: str, description: str = "", labels: Optional[Dict[str, str]] = None) -> Counter:
+        return self._value(Counter, name, description, labels)
+
+    def histogram(
+        self,
+        name: str,
+        description: str = "",
+        labels: Optional[Dict[str, str]] = None,
+        buckets=DEFAULT_BUCKETS,
+    ) -> Histogram:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+                self.descriptions.setdefault(name, description)
+            return self.histograms[key]
+
+    def render(self) -> str:
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            values = sorted(self.values.items())
+
+        lines = []
+        last_name = None
+        for (name, labels), value in values:
+            if name != last_name:
+                metric_type = "counter" if isinstance(value, Counter) else "gauge"
+                lines.append(f"# HELP {name} {self.descriptions.get(name, '')}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                last_name = name
+            label_str = ",".join(f'{key}="{label}"' for key, label in labels)
+            suffix = f"{{{label_str}}}" if label_str else ""
+            lines.append(f"{name}{suffix} {value.value}")
+
+        for (name, labels), histogram in histograms:
+            if name != last_name:
+                lines.append(f"# HELP {name} {self.descriptions.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                last_name = name
+            counts, total, count = histogram.snapshot()
+            label_str = ",".join(f'{key}="{value}"' for key, value in labels)
+            prefix = label_str + "," if label_str else ""
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f"{{{label_str}}}" if label_str else ""
+            lines.append(f"{name}_sum{suffix} {total}")
+            lines.append(f"{name}_count{suffix} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class StageTimer:
+    """
+    Collect the wall time spent in each stage of a request, and record every stage
+    in the `<prefix>_stage_seconds` histogram.
+    """
+
+    def __init__(self, prefix: str = "search"):
+        self.prefix = prefix
+        self.timings = defaultdict(float)
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def record(self, name: str, elapsed: float) -> None:
+        self.timings[name] += elapsed
+        metrics.histogram(
+            f"{self.prefix}_stage_seconds",
+            f"Time spent in each {self.prefix} stage",
+            labels={"stage": name},
+        ).observe(elapsed)
+
+    def finish(self) -> Dict[str, float]:
+        """Record the total time and return the breakdown in milliseconds"""
+        self.record("total", time.perf_counter() - self.start_time)
+        return {name: round(elapsed * 1000, 3) for name, elapsed in self.timings.items()}
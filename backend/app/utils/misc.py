@@ -1,4 +1,3 @@
-import torch
 import hashlib
 
 def passages_generator(text, tokenizer, window_size=2048, stride=0.75):
@@ -27,7 +26,15 @@ def passages_generator(text, tokenizer, window_size=2048, stride=0.75):
         end_pos = start_pos + len(tokenizer.decode(passage_ids, skip_special_tokens=True))
         yield passage_ids, passage_mask, start_pos, end_pos
 
-def calculate_file_hash(file_path):
+def calculate_file_hash(file_path, chunk_size=1 << 20):
+    # Read in chunks, documents can be larger than the memory to spare
+    file_hash = hashlib.md5()
     with open(file_path, "rb") as file:
-        file_hash = hashlib.md5(file.read()).hexdigest()
-    return file_hash
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def generate_passage_id(dense_vector, doc_path):
+    dense_str = ",".join(str(x) for x in dense_vector)
+    passage_id = hashlib.md5((dense_str + doc_path).encode()).hexdigest()
+    return passage_id
@@ -0,0 +1,441 @@
+import time
+import datetime
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Tuple, Any
+
+import numpy as np
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from app.utils.metrics import metrics
+from app.utils.pg_manager import PoolTimeoutError
+from app.utils.pg_queries import SearchQueryBuilder, SearchResult, vector_to_str
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPostgresManager(SearchQueryBuilder):
+    """
+    Read side of PostgresManager on psycopg 3's asyncio driver, used by the async
+    API server. It shares the search SQL with the sync manager; the search
+    parameters and the statement are pipelined so a search is a single round trip.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=5432,
+        database="chishiki",
+        user="chishiki_user",
+        password="your_secure_password",
+        dense_dim=1024,
+        embedding_model="bge-m3",
+        default_precision="float32",
+        default_oversample=4,
+        explain_threshold_ms=None,
+        pool_min=1,
+        pool_max=10,
+        pool_timeout=30,
+        health_check_interval=30,
+        index_config_ttl=60,
+        prepare_statements=True,
+        max_prepared=100,
+        lexical_storage="table",
+    ):
+        self.pool = AsyncConnectionPool(
+            make_conninfo(host=host, port=port, dbname=database, user=user, password=password),
+            configure=self._configure_connection,
+            min_size=pool_min,
+            max_size=pool_max,
+            timeout=pool_timeout,
+            max_idle=health_check_interval * 10,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        self.pool_timeout = pool_timeout
+        # psycopg keeps track of the statements prepared on each connection itself
+        self.prepare = True if prepare_statements else None
+        self.max_prepared = max_prepared
+        self.dense_dim = dense_dim
+        self.embedding_model = embedding_model
+        self.lexical_storage = lexical_storage
+        self.default_precision = default_precision
+        self.default_oversample = default_oversample
+        self._index_configs = {}
+        self._index_configs_loaded_at = 0.0
+        self.index_config_ttl = index_config_ttl
+        self.explain_threshold_ms = explain_threshold_ms
+        self.slow_query_plans = deque(maxlen=20)
+
+    async def _configure_connection(self, conn) -> None:
+        conn.prepared_max = self.max_prepared
+
+    async def open(self) -> None:
+        await self.pool.open()
+        await self.load_index_configs()
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Check a connection out of the pool; the transaction ends with the block"""
+        start_time = time.perf_counter()
+        try:
+            async with self.pool.connection() as conn:
+                metrics.histogram(
+                    "pg_pool_wait_seconds", "Time spent waiting for a pooled connection"
+                ).observe(time.perf_counter() - start_time)
+                in_use = metrics.gauge("pg_pool_connections_in_use", "Pooled connections checked out")
+                in_use.inc()
+                try:
+                    yield conn
+                finally:
+                    in_use.dec()
+        except PoolTimeout:
+            metrics.counter("pg_pool_timeouts_total", "Connection checkouts that timed out").inc()
+            raise PoolTimeoutError(f"No database connection available after {self.pool_timeout}s")
+
+    async def load_index_configs(self) -> None:
+        """
+        Cache the index configuration of every window size. The query builders
+        are synchronous, so unlike PostgresManager the cache is filled up front.
+        """
+        try:
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT window_size, config_params
+                    FROM indexing_configurations
+                    WHERE embedding_model = %s
+                """, (self.embedding_model,))
+                self._index_configs = {
+                    window_size: self._parse_index_config(config_params)
+                    for window_size, config_params in await cur.fetchall()
+                }
+            self._index_configs_loaded_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error loading index configurations: {str(e)}")
+
+    async def refresh_index_configs(self) -> None:
+        """Pick up indexes (re)built through the sync API since the last load"""
+        if time.monotonic() - self._index_configs_loaded_at > self.index_config_ttl:
+            await self.load_index_configs()
+
+    def _parse_index_config(self, config_params: Optional[Dict]) -> Dict[str, Any]:
+        config_params = config_params or {}
+        return {
+            "precision": config_params.get("precision", self.default_precision),
+            "oversample": config_params.get("oversample", self.default_oversample),
+            "method": config_params.get("method", "hnsw"),
+            "probes": config_params.get("probes", 1),
+        }
+
+    def get_index_config(self, window_size: int) -> Dict[str, Any]:
+        if window_size not in self._index_configs:
+            return self._parse_index_config(None)
+        return self._index_configs[window_size]
+
+    async def _execute_search(
+        self, conn, query: str, params: List[Any], search_params: Tuple, stats: Optional[Dict] = None
+    ) -> List[Tuple]:
+        start_time = time.perf_counter()
+        async with conn.cursor() as cur:
+            async with conn.pipeline():
+                await cur.execute(*search_params)
+                await cur.execute(query, params, prepare=self.prepare)
+            results = await cur.fetchall()
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+            if stats is not None:
+                stats["sql_ms"] = round(stats.get("sql_ms", 0) + elapsed_ms, 3)
+
+            if self.explain_threshold_ms is not None and elapsed_ms > self.explain_threshold_ms:
+                try:
+                    await cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+                    plan = (await cur.fetchone())[0]
+                    self.slow_query_plans.append({
+                        "captured_at": datetime.datetime.now().isoformat(),
+                        "duration_ms": round(elapsed_ms, 3),
+                        "query": query,
+                        "plan": plan,
+                    })
+                    if stats is not None:
+                        stats["plan"] = plan
+                    logger.warning(f"Slow search statement ({elapsed_ms:.1f} ms), query plan captured")
+                except Exception as e:
+                    logger.error(f"Error capturing query plan: {str(e)}")
+        return results
+
+    async def search_by_metadata(
+        self,
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
+        size_filter: Optional[str] = None,
+        k: int = 1000
+    ) -> List[str]:
+        try:
+            query, params = self._build_metadata_query(tags, path, filename, size_filter, k)
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute(query, params, prepare=self.prepare)
+                return [row[0] for row in await cur.fetchall()]
+        except Exception as e:
+            logger.error(f"Error executing metadata search: {str(e)}")
+            return []
+
+    async def ml_search(
+        self,
+        query_dense_vector: np.ndarray,
+        query_lexical_weights: Dict[str, float],
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
+        window_size: int = 512,
+        dense_weight: float = 0.7,
+        sparse_weight: Optional[float] = None,
+        k: int = 30,
+        stats: Optional[Dict] = None,
+    ) -> List[SearchResult]:
+        results = await self.ml_search_multi(
+            query_dense_vector,
+            query_lexical_weights,
+            window_sizes=[window_size],
+            tags=tags,
+            path=path,
+            filename=filename,
+            dense_weight=dense_weight,
+            sparse_weight=sparse_weight,
+            k=k,
+            stats=stats,
+        )
+        # Results are keyed by int window sizes, also when "512" was passed
+        return results.get(int(window_size), [])
+
+    async def ml_search_multi(
+        self,
+        query_dense_vector: np.ndarray,
+        query_lexical_weights: Dict[str, float],
+        window_sizes: List[int],
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
+        dense_weight: float = 0.7,
+        sparse_weight: Optional[float] = None,
+        k: int = 30,
+        stats: Optional[Dict] = None,
+    ) -> Dict[int, List[SearchResult]]:
+        try:
+            pre_filtered_doc_paths = None
+            if tags or path or filename:
+                pre_filtered_doc_paths = await self.search_by_metadata(tags, path, filename)
+
+            query, params = self._build_multi_window_query(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes,
+                pre_filtered_doc_paths,
+                dense_weight,
+                sparse_weight,
+                k,
+            )
+            async with self.connection() as conn:
+                results = await self._execute_search(
+                    conn, query, params, self._search_params_query(window_sizes, k), stats
+                )
+            return self._parse_multi_window_rows(results, window_sizes)
+
+        except Exception as e:
+            logger.error(f"Error executing ML search: {str(e)}")
+            return {window_size: [] for window_size in window_sizes}
+
+    async def ml_search_documents(
+        self,
+        query_dense_vector: np.ndarray,
+        query_lexical_weights: Dict[str, float],
+        window_sizes: List[int],
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
+        dense_weight: float = 0.7,
+        sparse_weight: Optional[float] = None,
+        n_docs: int = 10,
+        passages_per_doc: int = 3,
+        doc_score: str = "max",
+        overfetch: int = 4,
+        stats: Optional[Dict] = None,
+    ) -> List[Dict]:
+        if doc_score not in ("max", "sum"):
+            raise ValueError(f"Unsupported document score '{doc_score}', expected 'max' or 'sum'")
+
+        k = n_docs * passages_per_doc * max(1, overfetch)
+        try:
+            pre_filtered_doc_paths = None
+            if tags or path or filename:
+                pre_filtered_doc_paths = await self.search_by_metadata(tags, path, filename)
+
+            hits_query, params = self._build_multi_window_query(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes,
+                pre_filtered_doc_paths,
+                dense_weight,
+                sparse_weight,
+                k,
+            )
+            query, params = self._build_documents_query(
+                hits_query, params, passages_per_doc, n_docs, doc_score
+            )
+            async with self.connection() as conn:
+                results = await self._execute_search(
+                    conn, query, params, self._search_params_query(window_sizes, k), stats
+                )
+            return self._parse_document_rows(results)
+
+        except Exception as e:
+            logger.error(f"Error executing document search: {str(e)}")
+            return []
+
+    async def ml_search_batch(
+        self,
+        queries: List[Tuple[np.ndarray, Dict[str, float]]],
+        window_size: int,
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
+        dense_weight: float = 0.7,
+        sparse_weight: Optional[float] = None,
+        k: int = 30,
+    ) -> List[List[SearchResult]]:
+        try:
+            pre_filtered_doc_paths = None
+            if tags or path or filename:
+                pre_filtered_doc_paths = await self.search_by_metadata(tags, path, filename)
+
+            query, params = self._build_batch_query(
+                queries, window_size, pre_filtered_doc_paths, dense_weight, sparse_weight, k
+            )
+            async with self.connection() as conn:
+                results = await self._execute_search(
+                    conn, query, params, self._search_params_query([window_size], k)
+                )
+            return self._parse_batch_rows(results, len(queries))
+
+        except Exception as e:
+            logger.error(f"Error executing batch ML search: {str(e)}")
+            return [[] for _ in queries]
+
+    async def get_doc_texts(self, doc_paths: List[str]) -> Dict[str, str]:
+        """Fetch the texts of several documents with a single statement"""
+        if not doc_paths:
+            return {}
+        try:
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT dm.doc_path, dt.content
+                    FROM document_texts dt
+                    JOIN document_metadata dm ON dt.file_hash = dm.file_hash
+                    WHERE dm.doc_path = ANY(%s) AND dm.deleted_at IS NULL
+                """, (list(doc_paths),), prepare=self.prepare)
+                return {row[0]: row[1] for row in await cur.fetchall()}
+        except Exception as e:
+            logger.error(f"Error getting document texts: {str(e)}")
+            return {}
+
+    async def get_doc_text(self, doc_path: str) -> Optional[str]:
+        return (await self.get_doc_texts([doc_path])).get(doc_path)
+
+    async def get_mean_dense_vector(self, doc_path: str) -> Optional[np.ndarray]:
+        try:
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT mean_dense_vector::text
+                    FROM document_metadata
+                    WHERE doc_path = %s AND deleted_at IS NULL
+                """, (doc_path,), prepare=self.prepare)
+                result = await cur.fetchone()
+                if result and result[0] is not None:
+                    vector_values = [float(x) for x in result[0][1:-1].split(',')]
+                    return np.array(vector_values, dtype=np.float32)
+            return None
+        except Exception as e:
+            logger.error(f"Error getting mean dense vector: {str(e)}")
+            return None
+
+    async def search_similar_docs(self, mean_dense_vector: np.ndarray, k: int, threshold: float) -> List[Dict]:
+        try:
+            vector_str = vector_to_str(mean_dense_vector)
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT
+                        doc_path,
+                        1 - (mean_dense_vector <=> %s::vector) as similarity_score
+                    FROM document_metadata
+                    WHERE mean_dense_vector IS NOT NULL
+                        AND deleted_at IS NULL
+                        AND 1 - (mean_dense_vector <=> %s::vector) > %s
+                    ORDER BY similarity_score DESC
+                    LIMIT %s
+                """, (vector_str, vector_str, threshold, k))
+                return [
+                    {"doc_path": row[0], "similarity_score": float(1 - row[1])}
+                    for row in await cur.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Error searching similar documents: {str(e)}")
+            return []
+
+    async def get_doc_ml_synced(self, doc_path: str) -> Optional[bool]:
+        try:
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT ml_synced
+                    FROM document_metadata
+                    WHERE doc_path = %s AND deleted_at IS NULL
+                """, (doc_path,), prepare=self.prepare)
+                result = await cur.fetchone()
+                return result[0] if result else None
+        except Exception as e:
+            logger.error(f"Error getting ML sync status: {str(e)}")
+            return None
+
+    async def get_doc_metadata(self, doc_path: str) -> Optional[Dict]:
+        try:
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT
+                        file_hash, filename, tags, creation_time,
+                        modification_time, ml_synced, size
+                    FROM document_metadata
+                    WHERE doc_path = %s AND deleted_at IS NULL
+                """, (doc_path,), prepare=self.prepare)
+                result = await cur.fetchone()
+                if result:
+                    return {
+                        "file_hash": result[0],
+                        "filename": result[1],
+                        "tags": result[2],
+                        "creation_time": result[3].isoformat(),
+                        "modification_time": result[4].isoformat(),
+                        "ml_synced": result[5],
+                        "size": result[6]
+                    }
+            return None
+        except Exception as e:
+            logger.error(f"Error getting document metadata: {str(e)}")
+            return None
+
+    async def get_doc_tags(self, doc_path: str) -> List[str]:
+        try:
+            async with self.connection() as conn, conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT tags
+                    FROM document_metadata
+                    WHERE doc_path = %s AND deleted_at IS NULL
+                """, (doc_path,), prepare=self.prepare)
+                result = await cur.fetchone()
+                return result[0] if result and result[0] else []
+        except Exception as e:
+            logger.error(f"Error getting document tags: {str(e)}")
+            return []
@@ -1,12 +1,31 @@
+import os
+import re
 import time
+import hashlib
+import threading
+import weakref
 import numpy as np
 import datetime
 import psycopg2
-from psycopg2.extras import execute_values
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values, Json
 from psycopg2.extensions import register_adapter, AsIs
 import logging
+from collections import deque
 from typing import Optional, List, Dict, Tuple, Any
 import json
+from app.utils.metrics import metrics
+from app.utils.scheduler import PriorityGate, lane
+from app.utils.pg_queries import (
+    VECTOR_PRECISIONS,
+    VECTOR_INDEX_METHODS,
+    LEXICAL_STORAGES,
+    LEXICAL_DIM,
+    SearchQueryBuilder,
+    SearchResult,
+    sparse_to_str,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,7 +39,23 @@ def addapt_numpy_float32(numpy_float32):
 register_adapter(np.ndarray, adapt_numpy_array)
 register_adapter(np.float32, addapt_numpy_float32)
 
-class PostgresManager:
+class PoolTimeoutError(Exception):
+    pass
+
+
+class KeepIdlePool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool opening `minconn` connections up front but keeping up
+    to `maxconn` of them idle: psycopg2 closes every connection put back while
+    `minconn` are idle, so each checkout past the first would reconnect.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.minconn = self.maxconn
+
+
+class PostgresManager(SearchQueryBuilder):
     def __init__(
         self,
         host="localhost",
@@ -29,15 +64,387 @@ class PostgresManager:
         user="chishiki_user",
         password="your_secure_password",
         dense_dim=1024,
+        embedding_model="bge-m3",
+        default_precision="float32",
+        default_oversample=4,
+        explain_threshold_ms=None,
+        pool_min=1,
+        pool_max=10,
+        pool_timeout=30,
+        health_check_interval=30,
+        prepare_statements=True,
+        max_prepared=100,
+        lexical_storage="table",
+        pool_reserved=0,
+        index_config_ttl=60,
     ):
-        self.conn = psycopg2.connect(
-            host=host,
-            port=port,
-            database=database,
-            user=user,
-            password=password
-        )
+        if lexical_storage not in LEXICAL_STORAGES:
+            raise ValueError(
+                f"Unsupported lexical storage '{lexical_storage}', expected one of {LEXICAL_STORAGES}"
+            )
+        # Connecting is deferred to the first use of the pool, so that building
+        # the manager (e.g. at import) never fails or waits on the database
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_args = (pool_min, pool_max)
+        self._connect_kwargs = dict(host=host, port=port, database=database, user=user, password=password)
+        # The pool raises instead of blocking when exhausted, so waiters queue
+        # here, interactive work first; `pool_reserved` connections are kept for it
+        self._pool_slots = PriorityGate("database", pool_max, reserved=pool_reserved)
+        # Keyed by the connection itself, a new connection may get the id() of a closed one
+        self._last_used = weakref.WeakKeyDictionary()
+        self.pool_timeout = pool_timeout
+        self.health_check_interval = health_check_interval
         self.dense_dim = dense_dim
+        self.embedding_model = embedding_model
+        self.lexical_storage = lexical_storage
+        self.default_precision = default_precision
+        self.default_oversample = default_oversample
+        # window size -> (loaded at, configuration), re-read after `index_config_ttl`
+        # seconds to pick up indexes (re)built by other processes
+        self._index_configs = {}
+        self.index_config_ttl = index_config_ttl
+        self._partitioned = None
+        self._window_partitions = set()
+        # Opt-in capture of EXPLAIN (ANALYZE, BUFFERS) for slow search statements
+        self.explain_threshold_ms = explain_threshold_ms
+        self.slow_query_plans = deque(maxlen=20)
+        # Names of the statements prepared on each pooled connection
+        self.prepare_statements = prepare_statements
+        self.max_prepared = max_prepared
+        self._prepared = weakref.WeakKeyDictionary()
+
+    @property
+    def pool(self) -> KeepIdlePool:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = KeepIdlePool(*self._pool_args, **self._connect_kwargs)
+        return self._pool
+
+    @property
+    def connected(self) -> bool:
+        """Whether the pool was created, i.e. the database was reached once"""
+        return self._pool is not None
+
+    @contextmanager
+    def connection(self):
+        """
+        Check a connection out of the pool for the duration of a unit of work.
+        The transaction is committed on success and rolled back on error, and
+        connections that broke while in use are discarded instead of being reused.
+        """
+        start_time = time.perf_counter()
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            metrics.counter("pg_pool_timeouts_total", "Connection checkouts that timed out").inc()
+            raise PoolTimeoutError(f"No database connection available after {self.pool_timeout}s")
+        metrics.histogram(
+            "pg_pool_wait_seconds", "Time spent waiting for a pooled connection"
+        ).observe(time.perf_counter() - start_time)
+        in_use = metrics.gauge("pg_pool_connections_in_use", "Pooled connections checked out")
+
+        conn = None
+        broken = False
+        try:
+            conn = self._checkout()
+            in_use.inc()
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                in_use.dec()
+                self._last_used[conn] = time.monotonic()
+                self.pool.putconn(conn, close=broken or bool(conn.closed))
+                if conn.closed:
+                    # Broken, or closed by the pool on its way back
+                    self._forget(conn)
+            self._pool_slots.release()
+
+    def _checkout(self):
+        """Get a healthy connection, reconnecting if the pooled one went away"""
+        conn = self.pool.getconn()
+        idle_time = time.monotonic() - self._last_used.get(conn, 0)
+        if not conn.closed and idle_time < self.health_check_interval:
+            return conn
+
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connection already closed")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logger.warning(f"Discarding broken database connection: {str(e)}")
+            metrics.counter("pg_pool_reconnects_total", "Broken pooled connections replaced").inc()
+            self._forget(conn)
+            self.pool.putconn(conn, close=True)
+            return self.pool.getconn()
+
+    def _forget(self, conn) -> None:
+        """Drop what is known about a connection that is closed"""
+        self._last_used.pop(conn, None)
+        self._prepared.pop(conn, None)
+
+    def get_index_config(self, window_size: int) -> Dict[str, Any]:
+        """Return the precision and oversampling factor used to search a window size"""
+        cached = self._index_configs.get(window_size)
+        if cached is not None and time.monotonic() - cached[0] < self.index_config_ttl:
+            return cached[1]
+
+        index_config = {
+            "precision": self.default_precision,
+            "oversample": self.default_oversample,
+        }
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT config_params
+                    FROM indexing_configurations
+                    WHERE window_size = %s AND embedding_model = %s
+                """, (window_size, self.embedding_model))
+                result = cur.fetchone()
+            if result and result[0]:
+                index_config.update({
+                    key: result[0][key]
+                    for key in ("precision", "oversample", "method", "probes")
+                    if key in result[0]
+                })
+        except Exception as e:
+            logger.error(f"Error getting index configuration: {str(e)}")
+            return index_config
+
+        self._index_configs[window_size] = (time.monotonic(), index_config)
+        return index_config
+
+    def vector_index_definition(
+        self,
+        window_size: int,
+        precision: str = "float32",
+        method: str = "hnsw",
+        index_params: Optional[Dict[str, int]] = None,
+        index_name: Optional[str] = None,
+        concurrently: bool = False,
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        Return the CREATE INDEX statement of the ANN index of a window size, and
+        the index parameters it uses. The index is built on an expression of
+        dense_vector, so full precision vectors stay in the heap for rescoring
+        while the index itself shrinks 2x (halfvec) or 32x (binary).
+        """
+        if precision not in VECTOR_PRECISIONS:
+            raise ValueError(f"Unsupported precision '{precision}', expected one of {VECTOR_PRECISIONS}")
+        if method not in VECTOR_INDEX_METHODS:
+            raise ValueError(f"Unsupported index method '{method}', expected one of {tuple(VECTOR_INDEX_METHODS)}")
+
+        window_size = int(window_size)
+        params = dict(VECTOR_INDEX_METHODS[method])
+        params.update({k: int(v) for k, v in (index_params or {}).items() if k in params})
+        with_clause = ", ".join(f"{k} = {v}" for k, v in params.items())
+        index_name = index_name or f"idx_passages_dense_w{window_size}"
+
+        if precision == "halfvec":
+            expression, opclass = f"(dense_vector::halfvec({self.dense_dim}))", "halfvec_cosine_ops"
+        elif precision == "binary":
+            expression, opclass = f"(binary_quantize(dense_vector)::bit({self.dense_dim}))", "bit_hamming_ops"
+        else:
+            expression, opclass = "dense_vector", "vector_cosine_ops"
+
+        if self.is_partitioned():
+            # The partition only holds this window size, no predicate needed
+            table, predicate = f"passages_w{window_size}", ""
+        else:
+            table, predicate = "passages", f"WHERE window_size = {window_size}"
+
+        definition = f"""
+            CREATE INDEX {"CONCURRENTLY " if concurrently else ""}{index_name}
+            ON {table} USING {method} ({expression} {opclass})
+            WITH ({with_clause})
+            {predicate}
+        """
+        return definition, params
+
+    @staticmethod
+    def index_config_params(precision: str, oversample: int, method: str, params: Dict[str, int]) -> Dict[str, Any]:
+        """Stored configuration of an index, also what searches through it are tuned with"""
+        config_params = {
+            "precision": precision,
+            "oversample": int(oversample),
+            "method": method,
+            "index_params": params,
+        }
+        if method == "ivfflat":
+            # Probing sqrt(lists) lists keeps recall steady as lists grow with the corpus
+            config_params["probes"] = max(1, round(params["lists"] ** 0.5))
+        return config_params
+
+    def save_index_config(
+        self,
+        cur,
+        window_size: int,
+        precision: str,
+        oversample: int,
+        method: str,
+        params: Dict[str, int],
+    ) -> None:
+        config_params = self.index_config_params(precision, oversample, method, params)
+        cur.execute(
+            "SELECT add_indexing_configuration(%s, %s, %s)",
+            (window_size, self.embedding_model, Json(config_params)),
+        )
+        self._index_configs.pop(window_size, None)
+
+    def create_vector_index(
+        self,
+        window_size: int,
+        precision: str = "float32",
+        oversample: int = 4,
+        method: str = "hnsw",
+        index_params: Optional[Dict[str, int]] = None,
+    ) -> str:
+        """(Re)create the ANN index of a window size with the given storage precision"""
+        window_size = int(window_size)
+        if self.is_partitioned():
+            self.ensure_window_partition(window_size)
+        index_name = f"idx_passages_dense_w{window_size}"
+        definition, params = self.vector_index_definition(
+            window_size, precision, method, index_params, index_name
+        )
+
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+                cur.execute(definition)
+                self.save_index_config(cur, window_size, precision, oversample, method, params)
+            self._index_configs.pop(window_size, None)
+            logger.info(f"Vector index '{index_name}' created ({method}, {precision})")
+            return index_name
+        except Exception as e:
+            logger.error(f"Error creating vector index: {str(e)}")
+            raise
+
+    def is_partitioned(self) -> bool:
+        """Whether passages and lexical_weights are partitioned by window size"""
+        if self._partitioned is None:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM pg_partitioned_table
+                        WHERE partrelid = 'passages'::regclass
+                    )
+                """)
+                self._partitioned = cur.fetchone()[0]
+        return self._partitioned
+
+    def ensure_window_partition(self, window_size: int) -> None:
+        """Create the passages and lexical_weights partitions of a window size"""
+        window_size = int(window_size)
+        if window_size in self._window_partitions:
+            return
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS passages_w{window_size}
+                    PARTITION OF passages FOR VALUES IN ({window_size})
+                """)
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS lexical_weights_w{window_size}
+                    PARTITION OF lexical_weights FOR VALUES IN ({window_size})
+                """)
+            self._window_partitions.add(window_size)
+        except Exception as e:
+            logger.error(f"Error creating the partitions of window size {window_size}: {str(e)}")
+            raise
+
+    def drop_window_partition(self, window_size: int) -> None:
+        """
+        Remove all the passages of a window size by detaching and dropping its
+        partitions, instead of deleting them row by row.
+        """
+        window_size = int(window_size)
+        if not self.is_partitioned():
+            raise ValueError("Passages are not partitioned by window size")
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                # lexical_weights references passages, so it goes first
+                for table in ("lexical_weights", "passages"):
+                    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {table}_w{window_size}")
+                    cur.execute(f"DROP TABLE {table}_w{window_size}")
+                cur.execute("""
+                    DELETE FROM indexing_configurations
+                    WHERE window_size = %s AND embedding_model = %s
+                """, (window_size, self.embedding_model))
+            self._window_partitions.discard(window_size)
+            self._index_configs.pop(window_size, None)
+            logger.info(f"Partitions of window size {window_size} dropped")
+        except Exception as e:
+            logger.error(f"Error dropping the partitions of window size {window_size}: {str(e)}")
+            raise
+
+    def _prepare(self, cur, query: str) -> str:
+        """
+        Prepare `query` server-side on the cursor's connection, once per connection,
+        and return the EXECUTE statement running it with the same %s parameters.
+        Statements are named after their text, so each shape is planned once.
+        """
+        if not self.prepare_statements:
+            return query
+
+        prepared = self._prepared.setdefault(cur.connection, set())
+        name = "chishiki_" + hashlib.md5(query.encode()).hexdigest()[:16]
+        n_params = query.count("%s")
+        if name not in prepared:
+            if len(prepared) >= self.max_prepared:
+                cur.execute("DEALLOCATE ALL")
+                prepared.clear()
+            positions = iter(range(1, n_params + 1))
+            cur.execute(f"PREPARE {name} AS " + re.sub(r"%s", lambda _: f"${next(positions)}", query))
+            prepared.add(name)
+            metrics.counter("pg_statements_prepared_total", "Statements prepared on pooled connections").inc()
+
+        return f"EXECUTE {name}({', '.join(['%s'] * n_params)})" if n_params else f"EXECUTE {name}"
+
+    def _execute_prepared(self, cur, query: str, params: Any = None) -> None:
+        cur.execute(self._prepare(cur, query), params)
+
+    def _execute_search(self, cur, query: str, params: List[Any], stats: Optional[Dict] = None) -> List[Tuple]:
+        """
+        Run a search statement, timing it and capturing its plan when it is slower
+        than `explain_threshold_ms`. The plan is taken by running the statement again
+        under EXPLAIN, in the same transaction so that SET LOCAL settings apply.
+        """
+        start_time = time.perf_counter()
+        statement = self._prepare(cur, query)
+        cur.execute(statement, params)
+        results = cur.fetchall()
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+        if stats is not None:
+            stats["sql_ms"] = round(stats.get("sql_ms", 0) + elapsed_ms, 3)
+
+        if self.explain_threshold_ms is not None and elapsed_ms > self.explain_threshold_ms:
+            try:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, params)
+                plan = cur.fetchone()[0]
+                self.slow_query_plans.append({
+                    "captured_at": datetime.datetime.now().isoformat(),
+                    "duration_ms": round(elapsed_ms, 3),
+                    "query": query,
+                    "plan": plan,
+                })
+                if stats is not None:
+                    stats["plan"] = plan
+                logger.warning(f"Slow search statement ({elapsed_ms:.1f} ms), query plan captured")
+            except Exception as e:
+                logger.error(f"Error capturing query plan: {str(e)}")
+        return results
 
     def insert_passage(
         self,
@@ -52,21 +459,44 @@ class PostgresManager:
         window_size: int,
     ) -> None:
         try:
-            with self.conn.cursor() as cur:
+            if self.is_partitioned():
+                self.ensure_window_partition(window_size)
+
+            with self.connection() as conn, conn.cursor() as cur:
                 # Insert passage; PostgreSQL will generate the passage ID automatically
                 vector_str = '[' + ','.join(map(str, dense_vector.tolist())) + ']'
 
-                cur.execute("""
-                    INSERT INTO passages (
-                        file_hash, dense_vector, start_pos, end_pos, window_size, embedding_model
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (file_hash, start_pos, end_pos, window_size)
-                    DO UPDATE SET dense_vector = EXCLUDED.dense_vector
-                    RETURNING passage_id
-                """, (
-                    file_hash, vector_str,
-                    start_pos, end_pos, window_size, "bge-m3"
-                ))
+                if self.lexical_storage == "sparsevec":
+                    # The lexical weights live on the passage row itself
+                    cur.execute("""
+                        INSERT INTO passages (
+                            file_hash, dense_vector, start_pos, end_pos, window_size, embedding_model,
+                            lexical_vector, lexical_tokens
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s::sparsevec, %s::int4[])
+                        ON CONFLICT (file_hash, start_pos, end_pos, window_size)
+                        DO UPDATE SET
+                            dense_vector = EXCLUDED.dense_vector,
+                            lexical_vector = EXCLUDED.lexical_vector,
+                            lexical_tokens = EXCLUDED.lexical_tokens
+                        RETURNING passage_id
+                    """, (
+                        file_hash, vector_str,
+                        start_pos, end_pos, window_size, "bge-m3",
+                        sparse_to_str(lexical_weights),
+                        sorted(int(token) for token in lexical_weights),
+                    ))
+                else:
+                    cur.execute("""
+                        INSERT INTO passages (
+                            file_hash, dense_vector, start_pos, end_pos, window_size, embedding_model
+                        ) VALUES (%s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (file_hash, start_pos, end_pos, window_size)
+                        DO UPDATE SET dense_vector = EXCLUDED.dense_vector
+                        RETURNING passage_id
+                    """, (
+                        file_hash, vector_str,
+                        start_pos, end_pos, window_size, "bge-m3"
+                    ))
 
                 # Get the passage ID
                 result = cur.fetchone()
@@ -87,6 +517,8 @@ class PostgresManager:
 
                 passage_id = result[0]
                 logger.info(f"Passage '{passage_id}' inserted successfully")
+                if self.lexical_storage == "sparsevec":
+                    return
 
                 # Insert lexical weights
                 lexical_weights_data = [
@@ -100,12 +532,66 @@ class PostgresManager:
                     DO UPDATE SET weight = EXCLUDED.weight
                 """, lexical_weights_data)
 
-            self.conn.commit()
             logger.info(f"Passage '{passage_id}' inserted successfully")
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error inserting passage: {str(e)}")
 
+    def migrate_lexical_weights(self, batch_size: int = 1000, truncate: bool = False) -> int:
+        """
+        Fill `passages.lexical_vector` and `passages.lexical_tokens` from the
+        `lexical_weights` table, in batches of passages each committed on its own
+        so the migration can run on a live database and resume after interruption.
+        Return the number of passages migrated.
+        """
+        migrated = 0
+        try:
+            while True:
+                with self.connection() as conn, conn.cursor() as cur:
+                    cur.execute(f"""
+                        WITH batch AS (
+                            SELECT passage_id
+                            FROM passages
+                            WHERE lexical_vector IS NULL
+                            ORDER BY passage_id
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        ), weights AS (
+                            SELECT
+                                b.passage_id,
+                                '{{' || COALESCE(string_agg(
+                                    (lw.token::integer + 1) || ':' || lw.weight,
+                                    ',' ORDER BY lw.token::integer
+                                ) FILTER (WHERE lw.weight <> 0), '') || '}}/{LEXICAL_DIM}' AS lexical_vector,
+                                COALESCE(
+                                    array_agg(lw.token::integer ORDER BY lw.token::integer)
+                                        FILTER (WHERE lw.token IS NOT NULL),
+                                    '{{}}'
+                                ) AS lexical_tokens
+                            FROM batch b
+                            LEFT JOIN lexical_weights lw ON lw.passage_id = b.passage_id
+                            GROUP BY b.passage_id
+                        )
+                        UPDATE passages p
+                        SET lexical_vector = w.lexical_vector::sparsevec,
+                            lexical_tokens = w.lexical_tokens
+                        FROM weights w
+                        WHERE p.passage_id = w.passage_id
+                    """, (batch_size,))
+                    updated = cur.rowcount
+                migrated += updated
+                if updated == 0:
+                    break
+                logger.info(f"Migrated the lexical weights of {migrated} passages")
+
+            if truncate:
+                with self.connection() as conn, conn.cursor() as cur:
+                    cur.execute("TRUNCATE lexical_weights")
+                logger.info("Legacy lexical_weights table truncated")
+            return migrated
+        except Exception as e:
+            logger.error(f"Error migrating lexical weights: {str(e)}")
+            raise
+
     def insert_metadata(
         self,
         doc_path: str,
@@ -121,7 +607,12 @@ class PostgresManager:
             creation_timestamp = datetime.datetime.fromtimestamp(float(creation_time))
             modification_timestamp = datetime.datetime.fromtimestamp(float(modification_time))
 
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
+                # A re-created document replaces its tombstone
+                cur.execute("""
+                    DELETE FROM document_metadata
+                    WHERE (doc_path = %s OR file_hash = %s) AND deleted_at IS NOT NULL
+                """, (doc_path, file_hash))
                 cur.execute("""
                     INSERT INTO document_metadata (
                         doc_path, file_hash, filename, tags, creation_time,
@@ -137,10 +628,8 @@ class PostgresManager:
                     doc_path, file_hash, filename, [file_extension],
                     creation_timestamp, modification_timestamp, False, size
                 ))
-            self.conn.commit()
             logger.info(f"Metadata for document '{doc_path}' inserted successfully")
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error inserting metadata: {str(e)}")
 
     def search_by_metadata(
@@ -152,33 +641,58 @@ class PostgresManager:
         k: int = 1000
     ) -> List[str]:
         try:
-            query = "SELECT doc_path FROM document_metadata WHERE 1=1"
-            params = []
-
-            if tags:
-                query += " AND tags && %s"
-                params.append(tags)
-            if path:
-                query += " AND doc_path LIKE %s"
-                params.append(f"{path}%")
-            if filename:
-                query += " AND filename ILIKE %s"
-                params.append(f"%{filename}%")
-            if size_filter:
-                size_op, size_value = size_filter.split()
-                query += f" AND size {size_op} %s"
-                params.append(int(size_value))
-
-            query += f" LIMIT {k}"
-
-            with self.conn.cursor() as cur:
-                cur.execute(query, params)
+            query, params = self._build_metadata_query(tags, path, filename, size_filter, k)
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, query, params)
                 results = cur.fetchall()
                 return [row[0] for row in results]
         except Exception as e:
             logger.error(f"Error executing metadata search: {str(e)}")
             return []
 
+    def get_manifest(
+        self,
+        prefix: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = 5000,
+    ) -> List[Dict]:
+        """
+        Return a page of the sync state of the corpus (or of the documents under
+        `prefix`), ordered by path. Pages are keyed on the last path of the
+        previous page, so each one is a range scan of the doc_path index.
+        """
+        query = """
+            SELECT doc_path, file_hash, size, modification_time, ml_synced
+            FROM document_metadata
+            WHERE deleted_at IS NULL
+        """
+        params = []
+        if prefix:
+            query += " AND doc_path LIKE %s"
+            params.append(prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if after is not None:
+            query += " AND doc_path > %s"
+            params.append(after)
+        query += " ORDER BY doc_path LIMIT %s"
+        params.append(int(limit))
+
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, query, params)
+                return [
+                    {
+                        "doc_path": row[0],
+                        "file_hash": row[1],
+                        "size": row[2],
+                        "modification_time": row[3].isoformat(),
+                        "ml_synced": row[4],
+                    }
+                    for row in cur.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Error getting manifest: {str(e)}")
+            raise
+
     def ml_search(
         self,
         query_dense_vector: np.ndarray,
@@ -186,114 +700,172 @@ class PostgresManager:
         tags: Optional[List[str]] = None,
         path: Optional[str] = None,
         filename: Optional[str] = None,
-        window_size: Optional[int] = None,
+        window_size: int = 512,
+        dense_weight: float = 0.7,
+        sparse_weight: Optional[float] = None,
+        k: int = 30,
+        stats: Optional[Dict] = None,
+    ) -> List[SearchResult]:
+        results = self.ml_search_multi(
+            query_dense_vector,
+            query_lexical_weights,
+            window_sizes=[window_size],
+            tags=tags,
+            path=path,
+            filename=filename,
+            dense_weight=dense_weight,
+            sparse_weight=sparse_weight,
+            k=k,
+            stats=stats,
+        )
+        # Results are keyed by int window sizes, also when "512" was passed
+        return results.get(int(window_size), [])
+
+    def ml_search_multi(
+        self,
+        query_dense_vector: np.ndarray,
+        query_lexical_weights: Dict[str, float],
+        window_sizes: List[int],
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
         dense_weight: float = 0.7,
         sparse_weight: Optional[float] = None,
         k: int = 30,
-    ) -> List[Tuple[Tuple[str, int, int], Tuple[float, float, float]]]:
+        stats: Optional[Dict] = None,
+    ) -> Dict[int, List[SearchResult]]:
+        """Search several window sizes with a single statement"""
         try:
-            sparse_weight = sparse_weight or (1 - dense_weight)
-            query_vector_str = '[' + ','.join(map(str, query_dense_vector.tolist())) + ']'
+            pre_filtered_doc_paths = None
+            if tags or path or filename:
+                pre_filtered_doc_paths = self.search_by_metadata(tags, path, filename)
 
-            # Build the query
-            query = """
-                WITH dense_scores AS (
-                    SELECT
-                        p.passage_id,
-                        p.file_hash,
-                        p.start_pos,
-                        p.end_pos,
-                        1 - (p.dense_vector <=> %s) as dense_score
-                    FROM passages p
-                    JOIN document_metadata dm ON p.file_hash = dm.file_hash
-                    WHERE p.window_size = %s
-            """
-            params = [query_vector_str, window_size]
+            query, params = self._build_multi_window_query(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes,
+                pre_filtered_doc_paths,
+                dense_weight,
+                sparse_weight,
+                k,
+            )
+
+            search_params = self._search_params_query(window_sizes, k)
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(*search_params)
+                results = self._execute_search(cur, query, params, stats)
+            return self._parse_multi_window_rows(results, window_sizes)
+
+        except Exception as e:
+            logger.error(f"Error executing ML search: {str(e)}")
+            return {window_size: [] for window_size in window_sizes}
 
+    def ml_search_documents(
+        self,
+        query_dense_vector: np.ndarray,
+        query_lexical_weights: Dict[str, float],
+        window_sizes: List[int],
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
+        dense_weight: float = 0.7,
+        sparse_weight: Optional[float] = None,
+        n_docs: int = 10,
+        passages_per_doc: int = 3,
+        doc_score: str = "max",
+        overfetch: int = 4,
+        stats: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """
+        Search passages and collapse them by document: return the top `n_docs`
+        documents, each with its best `passages_per_doc` non-overlapping passages.
+        Grouping, scoring and text slicing all happen in the database, so only the
+        passages actually returned are shipped back.
+        """
+        if doc_score not in ("max", "sum"):
+            raise ValueError(f"Unsupported document score '{doc_score}', expected 'max' or 'sum'")
+
+        # Over-fetch passages so that enough distinct documents survive the grouping
+        k = n_docs * passages_per_doc * max(1, overfetch)
+        try:
+            pre_filtered_doc_paths = None
             if tags or path or filename:
                 pre_filtered_doc_paths = self.search_by_metadata(tags, path, filename)
-                if pre_filtered_doc_paths:
-                    query += " AND dm.doc_path = ANY(%s)"
-                    params.append(pre_filtered_doc_paths)
 
-            query += """
-                    ORDER BY dense_score DESC
-                    LIMIT %s
-                )
-            """
-            params.append(k)
-
-            # Add lexical scores
-            if query_lexical_weights:
-                lexical_conditions = []
-                for token, weight in query_lexical_weights.items():
-                    lexical_conditions.append(
-                        f"COALESCE(SUM(CASE WHEN lw.token = %s THEN lw.weight * %s END), 0)"
-                    )
-                    params.extend([token, weight])
-
-                query += f"""
-                    , lexical_scores AS (
-                        SELECT
-                            ds.passage_id,
-                            ds.file_hash,
-                            ds.start_pos,
-                            ds.end_pos,
-                            ds.dense_score,
-                            ({' + '.join(lexical_conditions)}) as lexical_score
-                        FROM dense_scores ds
-                        LEFT JOIN lexical_weights lw ON ds.passage_id = lw.passage_id
-                        GROUP BY ds.passage_id, ds.file_hash, ds.start_pos, ds.end_pos, ds.dense_score
-                    )
-                    SELECT
-                        dm.doc_path,
-                        ls.start_pos,
-                        ls.end_pos,
-                        ls.dense_score,
-                        ls.lexical_score,
-                        (%s * ls.dense_score + %s * ls.lexical_score) as combined_score
-                    FROM lexical_scores ls
-                    JOIN document_metadata dm ON ls.file_hash = dm.file_hash
-                    ORDER BY combined_score DESC
-                    LIMIT %s
-                """
-                params.extend([dense_weight, sparse_weight, k])
-
-            with self.conn.cursor() as cur:
-                cur.execute(query, params)
-                results = cur.fetchall()
+            hits_query, params = self._build_multi_window_query(
+                query_dense_vector,
+                query_lexical_weights,
+                window_sizes,
+                pre_filtered_doc_paths,
+                dense_weight,
+                sparse_weight,
+                k,
+            )
+            query, params = self._build_documents_query(
+                hits_query, params, passages_per_doc, n_docs, doc_score
+            )
 
-                return [
-                    ((row[0], row[1], row[2]), (row[3], row[4], row[5]))
-                    for row in results
-                ]
+            search_params = self._search_params_query(window_sizes, k)
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(*search_params)
+                results = self._execute_search(cur, query, params, stats)
+            return self._parse_document_rows(results)
 
         except Exception as e:
-            logger.error(f"Error executing ML search: {str(e)}")
+            logger.error(f"Error executing document search: {str(e)}")
             return []
 
+    def ml_search_batch(
+        self,
+        queries: List[Tuple[np.ndarray, Dict[str, float]]],
+        window_size: int,
+        tags: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        filename: Optional[str] = None,
+        dense_weight: float = 0.7,
+        sparse_weight: Optional[float] = None,
+        k: int = 30,
+    ) -> List[List[SearchResult]]:
+        """Run many hybrid searches sharing the same filters in a single statement"""
+        try:
+            pre_filtered_doc_paths = None
+            if tags or path or filename:
+                pre_filtered_doc_paths = self.search_by_metadata(tags, path, filename)
+
+            query, params = self._build_batch_query(
+                queries, window_size, pre_filtered_doc_paths, dense_weight, sparse_weight, k
+            )
+
+            search_params = self._search_params_query([window_size], k)
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(*search_params)
+                results = self._execute_search(cur, query, params)
+            return self._parse_batch_rows(results, len(queries))
+
+        except Exception as e:
+            logger.error(f"Error executing batch ML search: {str(e)}")
+            return [[] for _ in queries]
+
     def insert_mean_dense_vector(self, doc_path: str, mean_dense_vector: np.ndarray) -> None:
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 vector_str = '[' + ','.join(map(str, mean_dense_vector.tolist())) + ']'
                 cur.execute("""
                     UPDATE document_metadata
                     SET mean_dense_vector = %s
                     WHERE doc_path = %s
                 """, (vector_str, doc_path))
-            self.conn.commit()
             logger.info(f"Mean dense vector for document '{doc_path}' inserted successfully")
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error inserting mean dense vector: {str(e)}")
 
     def get_mean_dense_vector(self, doc_path: str) -> Optional[np.ndarray]:
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     SELECT mean_dense_vector
                     FROM document_metadata
-                    WHERE doc_path = %s
+                    WHERE doc_path = %s AND deleted_at IS NULL
                 """, (doc_path,))
                 result = cur.fetchone()
                 if result and result[0] is not None:
@@ -307,7 +879,7 @@ class PostgresManager:
 
     def search_similar_docs(self, mean_dense_vector: np.ndarray, k: int, threshold: float) -> List[Dict]:
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 vector_str = '[' + ','.join(map(str, mean_dense_vector.tolist())) + ']'
 
                 cur.execute("""
@@ -316,6 +888,7 @@ class PostgresManager:
                         1 - (mean_dense_vector <=> %s) as similarity_score
                     FROM document_metadata
                     WHERE mean_dense_vector IS NOT NULL
+                        AND deleted_at IS NULL
                         AND 1 - (mean_dense_vector <=> %s) > %s
                     ORDER BY similarity_score DESC
                     LIMIT %s
@@ -334,44 +907,173 @@ class PostgresManager:
             logger.error(f"Error searching similar documents: {str(e)}")
             return []
 
-    def delete_doc(self, doc_path: str) -> None:
+    def delete_doc(self, doc_path: str, tombstone: bool = False) -> None:
+        self.delete_docs([doc_path], tombstone=tombstone)
+
+    def delete_docs(self, doc_paths: List[str], tombstone: bool = False) -> int:
+        """
+        Delete many documents with set-based statements and return how many were
+        found. With `tombstone`, documents are only marked deleted, which hides
+        them from search at once, and `reap_tombstones` reclaims their passages
+        later in bounded batches.
+        """
+        if not doc_paths:
+            return 0
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                if tombstone:
+                    cur.execute("""
+                        UPDATE document_metadata
+                        SET deleted_at = CURRENT_TIMESTAMP
+                        WHERE doc_path = ANY(%s) AND deleted_at IS NULL
+                    """, (list(doc_paths),))
+                    deleted = cur.rowcount
+                else:
+                    deleted = self._hard_delete(cur, doc_paths)
+
+            logger.info(
+                f"{deleted} documents {'tombstoned' if tombstone else 'and their related data deleted'} successfully"
+            )
+            return deleted
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            return 0
+
+    def _hard_delete(self, cur, doc_paths: List[str]) -> int:
+        """Delete documents and their related data in the cursor's transaction"""
+        cur.execute("""
+            SELECT file_hash
+            FROM document_metadata
+            WHERE doc_path = ANY(%s)
+        """, (list(doc_paths),))
+        file_hashes = [row[0] for row in cur.fetchall()]
+        # Delete bottom-up so that the cascades find nothing left to do
+        cur.execute("""
+            DELETE FROM lexical_weights lw
+            USING passages p
+            WHERE lw.passage_id = p.passage_id AND p.file_hash = ANY(%s)
+        """, (file_hashes,))
+        cur.execute("DELETE FROM passages WHERE file_hash = ANY(%s)", (file_hashes,))
+        cur.execute("DELETE FROM document_texts WHERE file_hash = ANY(%s)", (file_hashes,))
+        cur.execute("DELETE FROM document_metadata WHERE file_hash = ANY(%s)", (file_hashes,))
+        return len(file_hashes)
+
+    def move_docs(self, moves: Dict[str, str]) -> List[str]:
+        """
+        Rename or move documents, {source doc_path: destination doc_path}, by
+        rewriting their metadata: passages and texts are keyed by file_hash and
+        are left untouched. A document stored at the destination of a found
+        source is replaced, unless another move of the batch vacates it. Chains
+        (a -> b, b -> c) and swaps go through temporary paths, so doc_path stays
+        unique after every statement. All of it is one transaction. Return the
+        sources that were found.
+        """
+        moves = {source: destination for source, destination in moves.items() if source != destination}
+        if not moves:
+            return []
         try:
-            with self.conn.cursor() as cur:
-                # Get file_hash first
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
-                    SELECT file_hash
+                    SELECT doc_path
                     FROM document_metadata
-                    WHERE doc_path = %s
-                """, (doc_path,))
-                result = cur.fetchone()
-                if result:
-                    file_hash = result[0]
-                    # Due to CASCADE constraints, this will delete related passages and lexical weights
-                    cur.execute("""
-                        DELETE FROM document_metadata
-                        WHERE file_hash = %s
-                    """, (file_hash,))
+                    WHERE doc_path = ANY(%s) AND deleted_at IS NULL
+                    FOR UPDATE
+                """, (list(moves),))
+                found = {row[0] for row in cur.fetchall()}
 
-                    # Delete document text
-                    cur.execute("""
-                        DELETE FROM document_texts
-                        WHERE file_hash = %s
-                    """, (file_hash,))
+                # A destination can only receive one document
+                sources, destinations = [], []
+                for source, destination in moves.items():
+                    if source in found and destination not in destinations:
+                        sources.append(source)
+                        destinations.append(destination)
+                if not sources:
+                    return []
+
+                vacated = set(sources)
+                replaced = [destination for destination in destinations if destination not in vacated]
+                if replaced:
+                    self._hard_delete(cur, replaced)
 
-            self.conn.commit()
-            logger.info(f"Document '{doc_path}' and its related data deleted successfully")
+                # Absolute document paths never start with this prefix
+                temporary = [f"chishiki-move:{source}" for source in sources]
+                cur.execute("""
+                    UPDATE document_metadata dm
+                    SET doc_path = m.temporary
+                    FROM unnest(%s::text[], %s::text[]) AS m(source, temporary)
+                    WHERE dm.doc_path = m.source
+                """, (sources, temporary))
+                cur.execute("""
+                    UPDATE document_metadata dm
+                    SET doc_path = m.destination, filename = m.filename
+                    FROM unnest(%s::text[], %s::text[], %s::text[]) AS m(temporary, destination, filename)
+                    WHERE dm.doc_path = m.temporary
+                """, (temporary, destinations, [os.path.basename(destination) for destination in destinations]))
+            logger.info(f"{len(sources)} documents moved successfully")
+            return sources
         except Exception as e:
-            self.conn.rollback()
-            logger.error(f"Error deleting document '{doc_path}': {str(e)}")
+            logger.error(f"Error moving documents: {str(e)}")
+            return []
 
-    def get_doc_text(self, doc_path: str) -> Optional[str]:
+    def reap_tombstones(self, batch_size: int = 5000) -> int:
+        """
+        Reclaim one batch of the passages of tombstoned documents, then drop the
+        tombstones left without passages. Each call is a short
+        transaction; return the number of passages deleted.
+        """
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
+                    SELECT p.passage_id
+                    FROM passages p
+                    JOIN document_metadata dm ON dm.file_hash = p.file_hash
+                    WHERE dm.deleted_at IS NOT NULL
+                    LIMIT %s
+                    FOR UPDATE OF p SKIP LOCKED
+                """, (batch_size,))
+                passage_ids = [row[0] for row in cur.fetchall()]
+                if passage_ids:
+                    cur.execute(
+                        "DELETE FROM lexical_weights WHERE passage_id = ANY(%s)", (passage_ids,)
+                    )
+                    cur.execute("DELETE FROM passages WHERE passage_id = ANY(%s)", (passage_ids,))
+                else:
+                    cur.execute("""
+                        DELETE FROM document_metadata dm
+                        WHERE dm.deleted_at IS NOT NULL
+                        AND NOT EXISTS (
+                            SELECT 1 FROM passages p WHERE p.file_hash = dm.file_hash
+                        )
+                    """)
+            metrics.counter(
+                "tombstone_reaped_passages_total", "Passages of tombstoned documents reclaimed"
+            ).inc(len(passage_ids))
+            return len(passage_ids)
+        except Exception as e:
+            logger.error(f"Error reaping tombstoned documents: {str(e)}")
+            return 0
+
+    def start_tombstone_reaper(self, interval: float = 10, batch_size: int = 5000) -> threading.Thread:
+        """Reap tombstones in the background: back to back while there is work, then every `interval` seconds"""
+        def reap():
+            # Background work, searches get the connections first
+            with lane("bulk"):
+                while True:
+                    if self.reap_tombstones(batch_size) == 0:
+                        time.sleep(interval)
+
+        thread = threading.Thread(target=reap, name="tombstone-reaper", daemon=True)
+        thread.start()
+        return thread
+
+    def get_doc_text(self, doc_path: str) -> Optional[str]:
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
                     SELECT dt.content
                     FROM document_texts dt
                     JOIN document_metadata dm ON dt.file_hash = dm.file_hash
-                    WHERE dm.doc_path = %s
+                    WHERE dm.doc_path = %s AND dm.deleted_at IS NULL
                 """, (doc_path,))
                 result = cur.fetchone()
                 return result[0] if result else None
@@ -381,7 +1083,7 @@ class PostgresManager:
 
     def set_doc_text(self, doc_path: str, doc_text: str) -> None:
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO document_texts (file_hash, content)
                     SELECT file_hash, %s
@@ -390,19 +1092,17 @@ class PostgresManager:
                     ON CONFLICT (file_hash) DO UPDATE
                     SET content = EXCLUDED.content
                 """, (doc_text, doc_path))
-            self.conn.commit()
             logger.info(f"Document text for '{doc_path}' set successfully")
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error setting document text: {str(e)}")
 
     def get_doc_by_path(self, doc_path: str) -> Optional[Dict]:
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
                     SELECT file_hash, filename, ml_synced, size
                     FROM document_metadata
-                    WHERE doc_path = %s
+                    WHERE doc_path = %s AND deleted_at IS NULL
                 """, (doc_path,))
                 result = cur.fetchone()
                 if result:
@@ -419,41 +1119,72 @@ class PostgresManager:
             logger.error(f"Error getting document by path: {str(e)}")
             return None
 
+    def get_doc_by_hash(self, file_hash: str) -> Optional[Dict]:
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
+                    SELECT doc_path, filename, ml_synced, size
+                    FROM document_metadata
+                    WHERE file_hash = %s AND deleted_at IS NULL
+                """, (file_hash,))
+                result = cur.fetchone()
+                if result:
+                    return {
+                        "doc_path": result[0],
+                        "filename": result[1],
+                        "ml_synced": result[2],
+                        "size": result[3]
+                    }
+            return None
+        except Exception as e:
+            logger.error(f"Error getting document by hash: {str(e)}")
+            return None
+
+    def get_doc_window_sizes(self, file_hash: str) -> List[int]:
+        """Window sizes a document has passages for"""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
+                    SELECT DISTINCT window_size
+                    FROM passages
+                    WHERE file_hash = %s
+                """, (file_hash,))
+                return [row[0] for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting document window sizes: {str(e)}")
+            return []
+
     def update_doc_hash(self, doc_path: str, file_hash: str) -> None:
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     UPDATE document_metadata
                     SET file_hash = %s, ml_synced = false
                     WHERE doc_path = %s
                 """, (file_hash, doc_path))
-            self.conn.commit()
             logger.info(f"Document hash updated for '{doc_path}'")
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error updating document hash: {str(e)}")
 
     def update_doc_ml_synced(self, doc_path: str, ml_synced: bool) -> None:
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     UPDATE document_metadata
                     SET ml_synced = %s
                     WHERE doc_path = %s
                 """, (ml_synced, doc_path))
-            self.conn.commit()
             logger.info(f"ML sync status updated for '{doc_path}'")
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error updating ML sync status: {str(e)}")
 
     def get_doc_ml_synced(self, doc_path: str) -> Optional[bool]:
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
                     SELECT ml_synced
                     FROM document_metadata
-                    WHERE doc_path = %s
+                    WHERE doc_path = %s AND deleted_at IS NULL
                 """, (doc_path,))
                 result = cur.fetchone()
                 return result[0] if result else None
@@ -463,13 +1194,13 @@ class PostgresManager:
 
     def get_doc_metadata(self, doc_path: str) -> Optional[Dict]:
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
                     SELECT
                         file_hash, filename, tags, creation_time,
                         modification_time, ml_synced, size
                     FROM document_metadata
-                    WHERE doc_path = %s
+                    WHERE doc_path = %s AND deleted_at IS NULL
                 """, (doc_path,))
                 result = cur.fetchone()
                 if result:
@@ -489,11 +1220,11 @@ class PostgresManager:
 
     def get_doc_tags(self, doc_path: str) -> List[str]:
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
                     SELECT tags
                     FROM document_metadata
-                    WHERE doc_path = %s
+                    WHERE doc_path = %s AND deleted_at IS NULL
                 """, (doc_path,))
                 result = cur.fetchone()
                 return result[0] if result and result[0] else []
@@ -503,20 +1234,29 @@ class PostgresManager:
 
     def update_doc_tags(self, doc_path: str, tags: List[str]) -> None:
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
+            with self.connection() as conn, conn.cursor() as cur:
+                self._execute_prepared(cur, """
                     UPDATE document_metadata
                     SET tags = %s
-                    WHERE doc_path = %s
+                    WHERE doc_path = %s AND deleted_at IS NULL
                 """, (tags, doc_path))
-            self.conn.commit()
             logger.info(f"Tags updated for '{doc_path}'")
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error updating document tags: {str(e)}")
 
+    def ping(self) -> bool:
+        """Whether the database answers"""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.error(f"Error pinging the database: {str(e)}")
+            return False
+
     def close(self) -> None:
-        """Close the database connection"""
-        if self.conn:
-            self.conn.close()
-            logger.info("Database connection closed")
+        """Close all the pooled database connections"""
+        if self._pool is None:
+            return
+        self._pool.closeall()
+        logger.info("Database connections closed")
@@ -0,0 +1,521 @@
+import json
+from typing import Optional, List, Dict, Tuple, Any
+
+import numpy as np
+
+# Storage precision of the first-stage ANN index; candidates are always rescored
+# against the full precision vector(1024) column
+VECTOR_PRECISIONS = ("float32", "halfvec", "binary")
+VECTOR_INDEX_METHODS = {
+    "hnsw": {"m": 16, "ef_construction": 64},
+    "ivfflat": {"lists": 100},
+}
+
+# "table" keeps one lexical_weights row per (passage, token); "sparsevec" keeps a
+# single sparsevec per passage, indexed by token id + 1 (sparsevec is 1-based),
+# with an int4[] of its token ids under a GIN index as the posting lists
+LEXICAL_STORAGES = ("table", "sparsevec")
+LEXICAL_DIM = 250002  # Vocabulary size of the BGE-M3 tokenizer
+
+SearchResult = Tuple[Tuple[str, int, int], Tuple[float, float, float]]
+
+
+def vector_to_str(vector: np.ndarray) -> str:
+    return '[' + ','.join(map(str, vector.tolist())) + ']'
+
+
+def sparse_to_str(lexical_weights: Optional[Dict[str, float]], dim: int = LEXICAL_DIM) -> str:
+    """Text representation of a {token_id: weight} dict as a pgvector sparsevec"""
+    entries = sorted(
+        (int(token) + 1, float(weight))
+        for token, weight in (lexical_weights or {}).items()
+        if float(weight) != 0
+    )
+    return '{' + ','.join(f"{index}:{weight}" for index, weight in entries) + '}/' + str(dim)
+
+
+def parse_positive_int(value: Any, name: str) -> int:
+    """Validate a positive integer request parameter, accept "512" as 512"""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"Invalid {name} {value!r}")
+    try:
+        parsed = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name} {value!r}")
+    if parsed <= 0:
+        raise ValueError(f"Invalid {name} {value!r}")
+    return parsed
+
+
+def parse_window_sizes(window_sizes: Any) -> List[int]:
+    """Validate the window sizes of a multi-window search, accept "512" as 512"""
+    if not isinstance(window_sizes, list) or not window_sizes:
+        raise ValueError("'window_sizes' must be a non-empty list")
+    parsed = [parse_positive_int(window_size, "window size") for window_size in window_sizes]
+    if len(set(parsed)) != len(parsed):
+        raise ValueError("'window_sizes' must not contain duplicates")
+    return parsed
+
+
+class SearchQueryBuilder:
+    """
+    SQL of the search statements, shared by the sync (psycopg2) and async (psycopg)
+    managers. Both drivers use the %s paramstyle, so the builders only return
+    (query, params) pairs and leave execution to the manager.
+
+    Subclasses provide `dense_dim`, `lexical_storage` and `get_index_config(window_size)`.
+    """
+
+    lexical_storage = "table"
+
+    def _build_metadata_query(
+        self,
+        tags: Optional[List[str]],
+        path: Optional[str],
+        filename: Optional[str],
+        size_filter: Optional[str],
+        k: int,
+    ) -> Tuple[str, List[Any]]:
+        query = "SELECT doc_path FROM document_metadata WHERE deleted_at IS NULL"
+        params = []
+
+        if tags:
+            query += " AND tags && %s"
+            params.append(tags)
+        if path:
+            query += " AND doc_path LIKE %s"
+            params.append(f"{path}%")
+        if filename:
+            query += " AND filename ILIKE %s"
+            params.append(f"%{filename}%")
+        if size_filter:
+            size_op, size_value = size_filter.split()
+            if size_op not in ("<", "<=", "=", ">=", ">"):
+                raise ValueError(f"Unsupported size operator '{size_op}'")
+            query += f" AND size {size_op} %s"
+            params.append(int(size_value))
+
+        query += " LIMIT %s"
+        params.append(int(k))
+        return query, params
+
+    def _candidate_limit(self, window_sizes: List[int], k: int) -> int:
+        """Size of the largest oversampled candidate set fetched for these window sizes"""
+        oversample = max(
+            int(self.get_index_config(window_size)["oversample"])
+            for window_size in window_sizes
+        )
+        return k * max(1, oversample)
+
+    def _lexical_arrays(self, lexical_weights: Optional[Dict[str, float]]) -> Tuple[List[str], List[float]]:
+        lexical_weights = lexical_weights or {}
+        return (
+            [str(token) for token in lexical_weights],
+            [float(weight) for weight in lexical_weights.values()],
+        )
+
+    def _search_params_query(self, window_sizes: List[int], k: int) -> Tuple[str, List[Any]]:
+        """
+        Make sure the ANN scan can return the whole oversampled candidate set, and
+        probe as many IVF lists as the index of these window sizes asks for.
+        """
+        probes = max(
+            int(self.get_index_config(window_size).get("probes", 1))
+            for window_size in window_sizes
+        )
+        return (
+            "SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+            [str(max(40, min(self._candidate_limit(window_sizes, k), 1000))), str(max(1, probes))],
+        )
+
+    def _order_by_expression(self, precision: str, vector_expr: str) -> str:
+        """First-stage ORDER BY expression served by an index of this precision"""
+        if precision == "halfvec":
+            return f"p.dense_vector::halfvec({self.dense_dim}) <=> ({vector_expr})::halfvec({self.dense_dim})"
+        elif precision == "binary":
+            return f"binary_quantize(p.dense_vector)::bit({self.dense_dim}) <~> binary_quantize({vector_expr})"
+        return f"p.dense_vector <=> {vector_expr}"
+
+    def _dense_order_by(self, window_size: int, vector_expr: str) -> Tuple[str, int]:
+        """
+        Return the first-stage ORDER BY expression matching the index of a window
+        size, and the oversampling factor to apply before exact rescoring.
+        """
+        index_config = self.get_index_config(window_size)
+        precision = index_config["precision"]
+        oversample = max(1, int(index_config["oversample"])) if precision != "float32" else 1
+        return self._order_by_expression(precision, vector_expr), oversample
+
+    def _build_dense_stage(
+        self,
+        query_vector_str: str,
+        window_size: int,
+        k: int,
+        pre_filtered_doc_paths: Optional[List[str]] = None,
+    ) -> Tuple[str, List[Any]]:
+        """
+        Build the `dense_scores` CTE: a first-stage ANN lookup over the (possibly
+        quantized) index, followed by exact rescoring of the oversampled candidates.
+        The window size is inlined so that even a generic plan of the prepared
+        statement can use the partial index of that window size.
+        """
+        order_by, oversample = self._dense_order_by(window_size, f"%s::vector({self.dense_dim})")
+
+        query = f"""
+            WITH candidates AS (
+                SELECT
+                    p.passage_id,
+                    p.file_hash,
+                    p.start_pos,
+                    p.end_pos,
+                    p.dense_vector
+                FROM passages p
+                JOIN document_metadata dm ON p.file_hash = dm.file_hash
+                WHERE p.window_size = {int(window_size)}
+                AND dm.deleted_at IS NULL
+        """
+        params = []
+
+        if pre_filtered_doc_paths:
+            query += " AND dm.doc_path = ANY(%s)"
+            params.append(pre_filtered_doc_paths)
+
+        query += f"""
+                ORDER BY {order_by}
+                LIMIT %s
+            ), dense_scores AS (
+                SELECT
+                    c.passage_id,
+                    c.file_hash,
+                    c.start_pos,
+                    c.end_pos,
+                    1 - (c.dense_vector <=> %s::vector) as dense_score
+                FROM candidates c
+                ORDER BY dense_score DESC
+                LIMIT %s
+            )
+        """
+        params.extend([query_vector_str, k * oversample, query_vector_str, k])
+        return query, params
+
+    def _build_ml_search_query(
+        self,
+        query_vector_str: str,
+        query_lexical_weights: Dict[str, float],
+        window_size: int,
+        dense_weight: float,
+        sparse_weight: float,
+        k: int,
+        pre_filtered_doc_paths: Optional[List[str]] = None,
+    ) -> Tuple[str, List[Any]]:
+        """Build the hybrid search statement of a single window size"""
+        query, params = self._build_dense_stage(
+            query_vector_str, window_size, k, pre_filtered_doc_paths
+        )
+
+        query += f"""
+            , lexical_scores AS ({self._lexical_scores_cte(query_lexical_weights, window_size, params)})
+            SELECT
+                dm.doc_path,
+                ls.start_pos,
+                ls.end_pos,
+                ls.dense_score,
+                ls.lexical_score,
+                (%s * ls.dense_score + %s * ls.lexical_score) as combined_score,
+                %s::integer as window_size
+            FROM lexical_scores ls
+            JOIN document_metadata dm ON ls.file_hash = dm.file_hash
+            ORDER BY combined_score DESC
+            LIMIT %s
+        """
+        params.extend([dense_weight, sparse_weight, int(window_size), k])
+        return query, params
+
+    def _lexical_scores_cte(
+        self, query_lexical_weights: Dict[str, float], window_size: int, params: List[Any]
+    ) -> str:
+        """
+        Body of the `lexical_scores` CTE scoring the rows of `dense_scores`,
+        appending its parameters to `params`. The query is passed as arrays or as
+        a sparsevec, so the statement has the same shape whatever the query and
+        can be prepared once. The inlined window size prunes partitioned tables.
+        """
+        if self.lexical_storage == "sparsevec":
+            params.append(sparse_to_str(query_lexical_weights))
+            return f"""
+                SELECT
+                    ds.passage_id,
+                    ds.file_hash,
+                    ds.start_pos,
+                    ds.end_pos,
+                    ds.dense_score,
+                    COALESCE(-(p.lexical_vector <#> %s::sparsevec), 0) as lexical_score
+                FROM dense_scores ds
+                JOIN passages p
+                    ON p.passage_id = ds.passage_id AND p.window_size = {int(window_size)}
+            """
+
+        params.extend(self._lexical_arrays(query_lexical_weights))
+        return f"""
+                SELECT
+                    ds.passage_id,
+                    ds.file_hash,
+                    ds.start_pos,
+                    ds.end_pos,
+                    ds.dense_score,
+                    COALESCE((
+                        SELECT SUM(lw.weight * q.weight)
+                        FROM unnest(%s::text[], %s::float8[]) AS q(token, weight)
+                        JOIN lexical_weights lw ON lw.token = q.token
+                        WHERE lw.passage_id = ds.passage_id
+                        AND lw.window_size = {int(window_size)}
+                    ), 0) as lexical_score
+                FROM dense_scores ds
+            """
+
+    def _build_multi_window_query(
+        self,
+        query_dense_vector: np.ndarray,
+        query_lexical_weights: Dict[str, float],
+        window_sizes: List[int],
+        pre_filtered_doc_paths: Optional[List[str]],
+        dense_weight: float,
+        sparse_weight: Optional[float],
+        k: int,
+    ) -> Tuple[str, List[Any]]:
+        """
+        UNION ALL of the hybrid search statements of several window sizes. Each
+        window size is its own branch using its own index, so the query vector is
+        sent once and the branches can be executed by a parallel append.
+        """
+        sparse_weight = sparse_weight or (1 - dense_weight)
+        query_vector_str = vector_to_str(query_dense_vector)
+
+        branches = []
+        params = []
+        for window_size in window_sizes:
+            branch_query, branch_params = self._build_ml_search_query(
+                query_vector_str,
+                query_lexical_weights,
+                window_size,
+                dense_weight,
+                sparse_weight,
+                k,
+                pre_filtered_doc_paths,
+            )
+            branches.append(f"SELECT * FROM ({branch_query}) w{len(branches)}")
+            params.extend(branch_params)
+        return "\nUNION ALL\n".join(branches), params
+
+    def _parse_multi_window_rows(
+        self, rows: List[Tuple], window_sizes: List[int]
+    ) -> Dict[int, List[SearchResult]]:
+        results_by_window = {int(window_size): [] for window_size in window_sizes}
+        for row in rows:
+            results_by_window[int(row[6])].append(
+                ((row[0], row[1], row[2]), (row[3], row[4], row[5]))
+            )
+        for window_results in results_by_window.values():
+            window_results.sort(key=lambda result: result[1][2], reverse=True)
+        return results_by_window
+
+    def _build_documents_query(
+        self,
+        hits_query: str,
+        params: List[Any],
+        passages_per_doc: int,
+        n_docs: int,
+        doc_score: str,
+    ) -> Tuple[str, List[Any]]:
+        """
+        Collapse the hits of `hits_query` by document: drop passages overlapping a
+        better passage of the same document, keep the best `passages_per_doc` of
+        each, score documents by max or sum and slice the passage texts.
+        """
+        if doc_score not in ("max", "sum"):
+            raise ValueError(f"Unsupported document score '{doc_score}', expected 'max' or 'sum'")
+
+        query = f"""
+            WITH hits AS (
+                {hits_query}
+            ), distinct_hits AS (
+                -- Drop passages overlapping a better passage of the same document
+                SELECT h.*
+                FROM hits h
+                WHERE NOT EXISTS (
+                    SELECT 1
+                    FROM hits b
+                    WHERE b.doc_path = h.doc_path
+                    AND b.start_pos < h.end_pos
+                    AND h.start_pos < b.end_pos
+                    AND (
+                        b.combined_score > h.combined_score
+                        OR (
+                            b.combined_score = h.combined_score
+                            AND (b.start_pos, b.end_pos, b.window_size)
+                                < (h.start_pos, h.end_pos, h.window_size)
+                        )
+                    )
+                )
+            ), top_passages AS (
+                SELECT *
+                FROM (
+                    SELECT
+                        dh.*,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY dh.doc_path ORDER BY dh.combined_score DESC
+                        ) AS passage_rank
+                    FROM distinct_hits dh
+                ) ranked
+                WHERE passage_rank <= %s
+            ), doc_scores AS (
+                SELECT doc_path, {doc_score.upper()}(combined_score) AS doc_score
+                FROM top_passages
+                GROUP BY doc_path
+                ORDER BY doc_score DESC
+                LIMIT %s
+            )
+            SELECT
+                tp.doc_path,
+                ds.doc_score,
+                tp.start_pos,
+                tp.end_pos,
+                tp.dense_score,
+                tp.lexical_score,
+                tp.combined_score,
+                tp.window_size,
+                substr(dt.content, tp.start_pos + 1, tp.end_pos - tp.start_pos) AS text
+            FROM top_passages tp
+            JOIN doc_scores ds ON ds.doc_path = tp.doc_path
+            JOIN document_metadata dm ON dm.doc_path = tp.doc_path
+            LEFT JOIN document_texts dt ON dt.file_hash = dm.file_hash
+            ORDER BY ds.doc_score DESC, tp.doc_path, tp.combined_score DESC
+        """
+        return query, params + [passages_per_doc, n_docs]
+
+    def _parse_document_rows(self, rows: List[Tuple]) -> List[Dict]:
+        documents = []
+        for row in rows:
+            if not documents or documents[-1]["doc_path"] != row[0]:
+                documents.append({"doc_path": row[0], "doc_score": row[1], "passages": []})
+            documents[-1]["passages"].append({
+                "start_pos": row[2],
+                "end_pos": row[3],
+                "scores": (row[4], row[5], row[6]),
+                "window_size": row[7],
+                "text": row[8] or "",
+            })
+        return documents
+
+    def _build_batch_query(
+        self,
+        queries: List[Tuple[np.ndarray, Dict[str, float]]],
+        window_size: int,
+        pre_filtered_doc_paths: Optional[List[str]],
+        dense_weight: float,
+        sparse_weight: Optional[float],
+        k: int,
+    ) -> Tuple[str, List[Any]]:
+        """
+        Many hybrid searches sharing the same filters in a single statement: the
+        query vectors and lexical weights are sent as one JSON array and each query
+        is resolved by a LATERAL subquery using the ANN index.
+        """
+        sparse_weight = sparse_weight or (1 - dense_weight)
+        order_by, oversample = self._dense_order_by(window_size, "q.dense_vector")
+        payload = [
+            {
+                "query_index": i,
+                "dense_vector": vector_to_str(dense_vector),
+                "lexical_weights": {
+                    token: float(weight) for token, weight in (lexical_weights or {}).items()
+                },
+                "lexical_vector": sparse_to_str(lexical_weights),
+            }
+            for i, (dense_vector, lexical_weights) in enumerate(queries)
+        ]
+
+        if self.lexical_storage == "sparsevec":
+            lexical_score = f"""COALESCE(-(
+                            SELECT p.lexical_vector <#> q.lexical_vector
+                            FROM passages p
+                            WHERE p.passage_id = ds.passage_id
+                            AND p.window_size = {int(window_size)}
+                        ), 0)"""
+        else:
+            lexical_score = f"""COALESCE((
+                            SELECT SUM(lw.weight * qt.weight::float)
+                            FROM lexical_weights lw
+                            JOIN jsonb_each_text(q.lexical_weights) AS qt(token, weight)
+                                ON lw.token = qt.token
+                            WHERE lw.passage_id = ds.passage_id
+                            AND lw.window_size = {int(window_size)}
+                        ), 0)"""
+
+        query = f"""
+            WITH queries AS (
+                SELECT
+                    q.query_index,
+                    q.dense_vector::vector({self.dense_dim}) AS dense_vector,
+                    q.lexical_weights,
+                    q.lexical_vector::sparsevec AS lexical_vector
+                FROM jsonb_to_recordset(%s::jsonb)
+                    AS q(query_index INTEGER, dense_vector TEXT, lexical_weights JSONB, lexical_vector TEXT)
+            )
+            SELECT
+                q.query_index,
+                dm.doc_path,
+                r.start_pos,
+                r.end_pos,
+                r.dense_score,
+                r.lexical_score,
+                r.combined_score
+            FROM queries q
+            CROSS JOIN LATERAL (
+                SELECT
+                    ls.*,
+                    (%s * ls.dense_score + %s * ls.lexical_score) AS combined_score
+                FROM (
+                    SELECT
+                        ds.*,
+                        {lexical_score} AS lexical_score
+                    FROM (
+                        SELECT
+                            c.passage_id,
+                            c.file_hash,
+                            c.start_pos,
+                            c.end_pos,
+                            1 - (c.dense_vector <=> q.dense_vector) AS dense_score
+                        FROM (
+                            SELECT p.passage_id, p.file_hash, p.start_pos, p.end_pos, p.dense_vector
+                            FROM passages p
+                            JOIN document_metadata dm ON p.file_hash = dm.file_hash
+                            WHERE p.window_size = {int(window_size)}
+                            AND dm.deleted_at IS NULL
+                            {"AND dm.doc_path = ANY(%s)" if pre_filtered_doc_paths else ""}
+                            ORDER BY {order_by}
+                            LIMIT %s
+                        ) c
+                        ORDER BY dense_score DESC
+                        LIMIT %s
+                    ) ds
+                ) ls
+                ORDER BY combined_score DESC
+                LIMIT %s
+            ) r
+            JOIN document_metadata dm ON r.file_hash = dm.file_hash
+            ORDER BY q.query_index, r.combined_score DESC
+        """
+        params = [json.dumps(payload), dense_weight, sparse_weight]
+        if pre_filtered_doc_paths:
+            params.append(pre_filtered_doc_paths)
+        params.extend([k * oversample, k, k])
+        return query, params
+
+    def _parse_batch_rows(self, rows: List[Tuple], n_queries: int) -> List[List[SearchResult]]:
+        results_by_query = [[] for _ in range(n_queries)]
+        for row in rows:
+            results_by_query[row[0]].append(
+                ((row[1], row[2], row[3]), (row[4], row[5], row[6]))
+            )
+        return results_by_query
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+from collections import deque
+
+
+class PollingDetector:
+    """
+    Change detection by polling, for network filesystems (NFS, SMB) where
+    inotify events never fire. A snapshot of every directory (mtime, document
+    stats, subdirectories) is persisted between cycles. Adding, removing or
+    renaming an entry bumps the mtime of its directory, so a cycle only lists
+    directories whose mtime changed; files modified in place are caught by
+    re-stating the files of unchanged directories round-robin. Each cycle
+    performs at most `stat_budget` stat calls and picks up where the previous
+    one stopped.
+
+    New directories are queued and listed within the same budget, so copying a
+    large tree onto the mount spreads over several cycles. The snapshot and the
+    queue of new directories are saved after a cycle that changed them, and the
+    round-robin positions after every cycle, in a small file of their own
+    (`<snapshot_path>.cursors`), so an idle cycle does not rewrite the snapshot
+    of the whole tree. A restart resumes where the previous cycle stopped. Only
+    the baseline, taken on the first run, walks the whole tree at once.
+
+    Changes are reported as watchdog-style events to `on_event(event_type,
+    path, src_path=None)`, e.g. EventCoalescer.add. A document that disappeared
+    and one that appeared with the same size and mtime in the same cycle are
+    reported as a move.
+    """
+
+    def __init__(self, docs_path, on_event, extensions, snapshot_path, interval=60, stat_budget=20000):
+        self.docs_path = os.path.abspath(docs_path)
+        self.on_event = on_event
+        self.extensions = tuple(extensions)
+        self.snapshot_path = snapshot_path
+        self.cursors_path = f"{snapshot_path}.cursors"
+        self.interval = interval
+        self.stat_budget = stat_budget
+        self.snapshot = self._load()
+        self.cursors = self._load_cursors() if self.snapshot is not None else {}
+        # Whether the snapshot changed since it was last saved
+        self.changed = False
+        self.dir_queue = deque()
+        self.file_queue = deque()
+        if self.snapshot is not None:
+            # Resume the round-robin scans after the last directory visited
+            self.dir_queue.extend(self._after(self.cursors.get("dirs")))
+            self.file_queue.extend(self._after(self.cursors.get("files")))
+
+    def _load(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, "r") as file:
+                snapshot = json.load(file)
+        except ValueError:
+            print(f"Ignoring unreadable polling snapshot {self.snapshot_path}")
+            return None
+        return snapshot if snapshot.get("root") == self.docs_path else None
+
+    def _load_cursors(self):
+        try:
+            with open(self.cursors_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            # Scans start over from the first directory
+            return {}
+
+    def _after(self, cursor):
+        return [path for path in sorted(self.snapshot["dirs"]) if cursor is None or path > cursor]
+
+    @staticmethod
+    def _write(path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+
+    def save(self):
+        """Write the snapshot if it changed, and the positions of the scans"""
+        if self.changed:
+            self._write(self.snapshot_path, self.snapshot)
+            self.changed = False
+        self._write(self.cursors_path, self.cursors)
+
+    def _list_dir(self, path):
+        """Return (directory entry, number of stat calls)"""
+        entry = {"mtime": os.stat(path).st_mtime, "files": {}, "dirs": []}
+        stats = 1
+        with os.scandir(path) as entries:
+            for dir_entry in entries:
+                try:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        entry["dirs"].append(dir_entry.name)
+                    elif dir_entry.name.endswith(self.extensions) and dir_entry.is_file():
+                        stat = dir_entry.stat()
+                        entry["files"][dir_entry.name] = [stat.st_size, stat.st_mtime]
+                        stats += 1
+                except OSError:
+                    continue
+        return entry, stats
+
+    def _add_tree(self, path):
+        """Snapshot a directory and all its subdirectories, for the baseline"""
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            try:
+                entry, _ = self._list_dir(current)
+            except OSError:
+                continue
+            self.snapshot["dirs"][current] = entry
+            pending.extend(os.path.join(current, name) for name in entry["dirs"])
+        self.changed = True
+
+    def _add_pending(self, created, budget):
+        """
+        List queued new directories until the budget is spent, collect their
+        documents in `created` and queue their subdirectories. Return the budget left.
+        """
+        pending = self.snapshot["pending"]
+        while pending and budget > 0:
+            path = pending.pop(0)
+            self.changed = True
+            try:
+                entry, stats = self._list_dir(path)
+            except OSError:
+                # Gone before it was listed
+                budget -= 1
+                continue
+            budget -= stats
+            self.snapshot["dirs"][path] = entry
+            for name, stat in entry["files"].items():
+                created[os.path.join(path, name)] = stat
+            pending.extend(os.path.join(path, name) for name in entry["dirs"])
+        return budget
+
+    def _remove_tree(self, path, deleted):
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            entry = self.snapshot["dirs"].pop(current, None)
+            if entry is None:
+                continue
+            self.changed = True
+            for name, stat in entry["files"].items():
+                deleted[os.path.join(current, name)] = stat
+            pending.extend(os.path.join(current, name) for name in entry["dirs"])
+
+    def _diff_dir(self, path, created, deleted, modified):
+        old = self.snapshot["dirs"][path]
+        try:
+            new, stats = self._list_dir(path)
+        except OSError:
+            # Gone, its parent reports it on its own mtime change
+            return 1
+        self.snapshot["dirs"][path] = new
+        self.changed = True
+
+        for name, stat in new["files"].items():
+            old_stat = old["files"].get(name)
+            if old_stat is None:
+                created[os.path.join(path, name)] = stat
+            elif old_stat != stat:
+                modified.append(os.path.join(path, name))
+        for name, stat in old["files"].items():
+            if name not in new["files"]:
+                deleted[os.path.join(path, name)] = stat
+
+        old_dirs, new_dirs = set(old["dirs"]), set(new["dirs"])
+        # Listed by _add_pending, within the budget
+        self.snapshot["pending"].extend(sorted(os.path.join(path, name) for name in new_dirs - old_dirs))
+        for name in old_dirs - new_dirs:
+            self._remove_tree(os.path.join(path, name), deleted)
+        return stats
+
+    def _restat_files(self, path, modified):
+        entry = self.snapshot["dirs"].get(path)
+        if entry is None:
+            return 0
+        stats = 0
+        for name, old_stat in entry["files"].items():
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            stats += 1
+            if [stat.st_size, stat.st_mtime] != old_stat:
+                entry["files"][name] = [stat.st_size, stat.st_mtime]
+                self.changed = True
+                modified.append(os.path.join(path, name))
+        return stats
+
+    def poll_once(self):
+        """Run one bounded cycle, return the number of changes reported"""
+        if self.snapshot is None:
+            # Baseline, boot sync already handled what is on disk
+            self.snapshot = {"root": self.docs_path, "dirs": {}, "pending": []}
+            self.cursors = {}
+            self._add_tree(self.docs_path)
+            self.save()
+            return 0
+
+        created, deleted, modified = {}, {}, []
+        self.snapshot.setdefault("pending", [])
+        # New directories found by earlier cycles first
+        budget = self._add_pending(created, self.stat_budget)
+        if not self.dir_queue:
+            self.dir_queue.extend(sorted(self.snapshot["dirs"]))
+        while self.dir_queue and budget > 0:
+            path = self.dir_queue.popleft()
+            entry = self.snapshot["dirs"].get(path)
+            if entry is None:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                mtime = None
+            budget -= 1
+            if mtime is not None and mtime != entry["mtime"]:
+                budget -= self._diff_dir(path, created, deleted, modified)
+            self.cursors["dirs"] = path
+        # Then the ones found in this cycle, so that moved trees pair up when they fit
+        budget = self._add_pending(created, budget)
+
+        # Whatever is left of the budget goes to content changes, which leave
+        # the mtime of the directory untouched
+        if not self.file_queue:
+            self.file_queue.extend(sorted(self.snapshot["dirs"]))
+        while self.file_queue and budget > 0:
+            path = self.file_queue.popleft()
+            budget -= self._restat_files(path, modified)
+            self.cursors["files"] = path
+
+        # A rename within the cycle keeps size and mtime
+        moved_from = {}
+        for path, stat in deleted.items():
+            moved_from.setdefault(tuple(stat), []).append(path)
+        for path, stat in created.items():
+            sources = moved_from.get(tuple(stat))
+            if sources:
+                src_path = sources.pop()
+                del deleted[src_path]
+                self.on_event("moved", path, src_path=src_path)
+            else:
+                self.on_event("created", path)
+        for path in deleted:
+            self.on_event("deleted", path)
+        for path in modified:
+            self.on_event("modified", path)
+
+        self.save()
+        return len(created) + len(deleted) + len(modified)
+
+    def run(self):
+        while True:
+            start_time = time.time()
+            try:
+                changes = self.poll_once()
+                if changes:
+                    print(f"Polling: {changes} changes detected in {time.time() - start_time:.1f}s")
+            except Exception as e:
+                print(f"Error polling {self.docs_path}: {e}")
+            time.sleep(max(0, self.interval - (time.time() - start_time)))
@@ -0,0 +1,172 @@
+import math
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from typing import Dict, Optional
+from app.utils.metrics import metrics
+
+# By priority, waiters of a lane are served before those of the lanes after it
+LANES = ("interactive", "bulk")
+
+_current = threading.local()
+
+
+class Overloaded(Exception):
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"Too many pending {lane} requests, retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+def current_lane() -> str:
+    """Lane of the work running on this thread, interactive unless set"""
+    return getattr(_current, "lane", LANES[0])
+
+
+@contextmanager
+def lane(name: str):
+    """Run the enclosed work, on this thread, in the given lane"""
+    if name not in LANES:
+        raise ValueError(f"Unknown lane '{name}', expected one of {LANES}")
+    previous = getattr(_current, "lane", None)
+    _current.lane = name
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _current.lane
+        else:
+            _current.lane = previous
+
+
+class PriorityGate:
+    """
+    Counting semaphore whose waiters are served by lane: a slot freed while
+    interactive work waits never goes to bulk work. `reserved` slots are kept
+    for the first lane, so bulk work can never hold every slot. Bulk work is
+    preempted between slots, not in the middle of one, so the callers hold a
+    slot for one unit of work (a forward pass, a statement) at a time.
+    """
+
+    def __init__(self, name: str, capacity: int, reserved: int = 0):
+        self.name = name
+        self.capacity = capacity
+        self.reserved = min(reserved, capacity - 1)
+        self.in_use = 0
+        self.waiting = {lane_name: 0 for lane_name in LANES}
+        self.condition = threading.Condition()
+
+    def _available(self, lane_name: str) -> bool:
+        priority = LANES.index(lane_name)
+        if any(self.waiting[name] for name in LANES[:priority]):
+            return False
+        limit = self.capacity if priority == 0 else self.capacity - self.reserved
+        return self.in_use < limit
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        lane_name = current_lane()
+        labels = {"resource": self.name, "lane": lane_name}
+        depth = metrics.gauge("scheduler_queue_depth", "Work waiting for a slot of a resource", labels=labels)
+        start_time = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.waiting[lane_name] += 1
+            depth.inc()
+            acquired = False
+            try:
+                while not self._available(lane_name):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.in_use += 1
+                    acquired = True
+            finally:
+                self.waiting[lane_name] -= 1
+                depth.dec()
+                if not acquired:
+                    # Lanes behind this one may have been held back by it
+                    self.condition.notify_all()
+        if not acquired:
+            return False
+        metrics.histogram(
+            "scheduler_wait_seconds", "Time spent waiting for a slot of a resource", labels=labels
+        ).observe(time.perf_counter() - start_time)
+        return True
+
+    def release(self) -> None:
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class LaneScheduler:
+    """
+    Admission control in front of the encoder and the database. At most
+    `max_pending[lane]` requests of a lane are admitted at once, the next ones
+    are rejected with Overloaded (429 and Retry-After over HTTP) instead of
+    queueing behind the model. Admitted requests run in their lane, and take
+    encoder and database slots by lane priority, see PriorityGate.
+    """
+
+    def __init__(self, max_pending: Dict[str, int], encoder_slots: int = 1):
+        self.max_pending = {name: max_pending.get(name, 64) for name in LANES}
+        self.encoder = PriorityGate("encoder", encoder_slots)
+        self.pending = {name: 0 for name in LANES}
+        # Moving average of the time admitted requests take, for Retry-After
+        self.durations = {name: 1.0 for name in LANES}
+        self.lock = threading.Lock()
+
+    def retry_after(self, lane_name: str) -> int:
+        """
+        Seconds for the lane to work through its pending requests: the more
+        are admitted, the longer a retry should wait
+        """
+        with self.lock:
+            backlog = self.durations[lane_name] * self.pending[lane_name] / self.max_pending[lane_name]
+            return max(1, math.ceil(backlog))
+
+    @contextmanager
+    def admit(self, lane_name: str):
+        admitted = metrics.gauge("scheduler_admitted", "Admitted requests in flight", labels={"lane": lane_name})
+        with self.lock:
+            full = self.pending[lane_name] >= self.max_pending[lane_name]
+            if not full:
+                self.pending[lane_name] += 1
+        if full:
+            metrics.counter(
+                "scheduler_rejected_total", "Requests rejected because their lane was full", labels={"lane": lane_name}
+            ).inc()
+            raise Overloaded(lane_name, self.retry_after(lane_name))
+
+        admitted.inc()
+        start_time = time.perf_counter()
+        try:
+            with lane(lane_name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self.lock:
+                self.pending[lane_name] -= 1
+                self.durations[lane_name] = 0.8 * self.durations[lane_name] + 0.2 * elapsed
+            admitted.dec()
+
+    def admitted(self, lane_name: str):
+        """Decorator admitting a view in the given lane"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                with self.admit(lane_name):
+                    return view(*args, **kwargs)
+            return wrapper
+        return decorator
@@ -1,87 +1,325 @@
+import os
 import time
-import requests
+import heapq
+import itertools
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from app.utils.poll_sync import PollingDetector
 from config import config
-from queue import Queue
 import threading
 
+
+class EventCoalescer:
+    """
+    Merge the filesystem events of each path into one net action, and hand
+    paths over once they are quiescent (trailing-edge debouncing): a path is
+    ready when no event arrived for `quiet_period` seconds and its size and
+    mtime did not change meanwhile, so files still being copied are not
+    ingested half-written. Ready paths are flushed to `on_ready(upserts,
+    deletes, moves)` in batches of at most `batch_size`.
+
+    Net actions: created/modified -> upsert, deleted -> delete, created then
+    deleted -> nothing, deleted then created -> upsert, moved -> move (a path
+    rewrite, no re-embedding), unless the source was never ingested or the
+    destination is modified afterwards.
+    """
+
+    def __init__(self, on_ready, quiet_period=2.0, batch_size=32, poll_interval=0.5):
+        self.on_ready = on_ready
+        self.quiet_period = quiet_period
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def add(self, event_type, path, src_path=None):
+        now = time.time()
+        with self.lock:
+            entry = self.pending.get(path)
+            if event_type == "moved":
+                source = self.pending.pop(src_path, None)
+                if source is not None and source["action"] == "move":
+                    # Moved again, still the same stored document
+                    src_path = source["src_path"]
+                elif source is not None and source["action"] == "upsert":
+                    # The source has changes that were never ingested
+                    if not source["created"]:
+                        self.pending[src_path] = {"action": "delete", "created": False, "last_event": now, "stat": None}
+                    event_type = "created"
+                if event_type == "moved":
+                    self.pending[path] = {
+                        "action": "move",
+                        "src_path": src_path,
+                        "created": False,
+                        "last_event": now,
+                        "stat": None,
+                    }
+                    return
+
+            if entry is not None and entry["action"] == "move":
+                # The destination changed after the move: delete the stored
+                # source and handle the destination as a new file
+                self.pending[entry["src_path"]] = {"action": "delete", "created": False, "last_event": now, "stat": None}
+                entry = None
+
+            if event_type == "deleted":
+                if entry is not None and entry["created"]:
+                    # Came and went before it was ever ingested
+                    del self.pending[path]
+                else:
+                    self.pending[path] = {"action": "delete", "created": False, "last_event": now, "stat": None}
+            else:
+                created = event_type == "created" and (entry is None or entry["action"] != "delete")
+                if entry is not None and entry["action"] == "upsert":
+                    created = entry["created"]
+                self.pending[path] = {
+                    "action": "upsert",
+                    "created": created,
+                    "last_event": now,
+                    "stat": self._stat(path),
+                }
+
+    def flush_due(self, now=None):
+        """Pop the paths that are quiescent, return (upserts, deletes, [(src_path, dest_path)])"""
+        now = now or time.time()
+        upserts, deletes, moves = [], [], []
+        with self.lock:
+            for path, entry in list(self.pending.items()):
+                if now - entry["last_event"] < self.quiet_period:
+                    continue
+                if entry["action"] == "delete":
+                    deletes.append(path)
+                    del self.pending[path]
+                    continue
+                if entry["action"] == "move":
+                    moves.append((entry["src_path"], path))
+                    del self.pending[path]
+                    continue
+
+                stat = self._stat(path)
+                if stat is None:
+                    # Vanished without a deleted event (e.g. a temporary file)
+                    if not entry["created"]:
+                        deletes.append(path)
+                    del self.pending[path]
+                elif stat != entry["stat"]:
+                    # Still being written, wait for another quiet period
+                    entry["stat"] = stat
+                    entry["last_event"] = now
+                else:
+                    upserts.append(path)
+                    del self.pending[path]
+        return sorted(upserts), sorted(deletes), sorted(moves)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            upserts, deletes, moves = self.flush_due()
+            for i in range(0, len(moves), self.batch_size):
+                self.on_ready([], [], moves[i:i + self.batch_size])
+            for i in range(0, len(deletes), self.batch_size):
+                self.on_ready([], deletes[i:i + self.batch_size], [])
+            for i in range(0, len(upserts), self.batch_size):
+                self.on_ready(upserts[i:i + self.batch_size], [], [])
+
+
+class PathWorkQueue:
+    """
+    Priority work queue keyed by path: putting a path that is already pending
+    replaces its entry (action and priority) instead of queueing it twice.
+    Lower priorities come first. get_batch() pops the most urgent path and
+    fills the batch with the next most urgent paths of the same action, and
+    never hands out a path a worker is still processing.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.in_flight = set()
+        self.batches_in_flight = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.entries)
+
+    def put(self, path, action, priority=0, payload=None):
+        with self.condition:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                entry[-1] = False  # Lazily removed from the heap
+            entry = [priority, next(self.counter), path, action, payload, True]
+            self.entries[path] = entry
+            heapq.heappush(self.heap, entry)
+            self.condition.notify()
+
+    def _pop(self, action=None):
+        deferred, popped = [], None
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if not entry[-1]:
+                continue
+            if entry[2] in self.in_flight or (action is not None and entry[3] != action):
+                deferred.append(entry)
+                continue
+            popped = entry
+            break
+        for entry in deferred:
+            heapq.heappush(self.heap, entry)
+        return popped
+
+    def get_batch(self, max_items):
+        """Block until work is available, return (action, [paths], [payloads])"""
+        with self.condition:
+            while True:
+                entry = self._pop()
+                if entry is not None:
+                    break
+                self.condition.wait()
+
+            batch = [entry]
+            while len(batch) < max_items:
+                entry = self._pop(action=batch[0][3])
+                if entry is None:
+                    break
+                batch.append(entry)
+
+            paths = [entry[2] for entry in batch]
+            for path in paths:
+                del self.entries[path]
+            self.in_flight.update(paths)
+            self.batches_in_flight += 1
+            return batch[0][3], paths, [entry[4] for entry in batch]
+
+    def task_done(self, paths):
+        with self.condition:
+            self.in_flight.difference_update(paths)
+            self.batches_in_flight -= 1
+            # Paths re-queued while in flight may be handed out again
+            self.condition.notify_all()
+
+
 class DocumentWatchdog(FileSystemEventHandler):
-    def __init__(self, docs_path):
+    def __init__(self, docs_path, ingestion):
         self.docs_path = docs_path
-        self.queue = Queue()
-        self.processed_files = {}
-        self.processing = False
-        self.worker_thread = threading.Thread(target=self._process_queue, daemon=True)
-        self.worker_thread.start()
-        self.debounce_time = 1  # seconds
-
-    # def on_created(self, event):
-    #     if not event.is_directory and event.src_path.endswith(tuple(config.config["extensions"])):
-    #         print(f"WATCHDOG: Document {event.src_path} created.")
-    #         self.process_document(event.src_path)
-
-    # def on_modified(self, event):
-    #     if not event.is_directory and event.src_path.endswith(tuple(config.config["extensions"])):
-    #         print(f"WATCHDOG: Document {event.src_path} modified.")
-    #         self.process_document(event.src_path)
-
-    # def on_moved(self, event):
-    #     if not event.is_directory and event.src_path.endswith(tuple(config.config["extensions"])):
-    #         print(f"WATCHDOG: Document {event.src_path} moved.")
-    #         self.process_document(event.src_path)
-
-    # def on_deleted(self, event):
-    #     if not event.is_directory and event.src_path.endswith(tuple(config.config["extensions"])):
-    #         print(f"WATCHDOG: Document {event.src_path} deleted.")
-    #         self.delete_document(event.src_path)
+        self.ingestion = ingestion
+        self.extensions = tuple(config.config["extensions"])
+        watchdog_config = config.config.get("watchdog", {})
+        self.batch_size = watchdog_config.get("batch_size", 32)
+        self.queue = PathWorkQueue()
+        self.worker_threads = [
+            threading.Thread(target=self._process_queue, daemon=True)
+            for _ in range(watchdog_config.get("workers", 2))
+        ]
+        for worker_thread in self.worker_threads:
+            worker_thread.start()
+        self.coalescer = EventCoalescer(
+            self._enqueue,
+            quiet_period=watchdog_config.get("quiet_period", 2.0),
+            batch_size=self.batch_size,
+        )
 
     def on_any_event(self, event):
-        if not event.is_directory and event.src_path.endswith(tuple(config.config["extensions"])):
-            current_time = time.time()
+        if event.is_directory:
+            return
 
-            if event.event_type == 'deleted':
-                self.delete_document(event.src_path)
-                self.processed_files.pop(event.src_path, None)
-            elif event.event_type in ['created', 'modified', 'moved']:
-                last_processed = self.processed_files.get(event.src_path, 0)
-                if current_time - last_processed >= self.debounce_time:
-                    self.process_document(event.src_path)
-                    self.processed_files[event.src_path] = current_time
+        if event.event_type == "moved":
+            is_src_doc = event.src_path.endswith(self.extensions)
+            is_dest_doc = event.dest_path.endswith(self.extensions)
+            if is_src_doc and is_dest_doc:
+                self.coalescer.add("moved", event.dest_path, src_path=event.src_path)
+            # Either side alone may be a document, e.g. "report.pdf.part" -> "report.pdf"
+            elif is_src_doc:
+                self.coalescer.add("deleted", event.src_path)
+            elif is_dest_doc:
+                self.coalescer.add("created", event.dest_path)
+        elif event.event_type in ("created", "modified", "deleted") and event.src_path.endswith(self.extensions):
+            self.coalescer.add(event.event_type, event.src_path)
 
-    def process_document(self, doc_path):
-        self.queue.put(doc_path)
+    def _enqueue(self, upserts, deletes, moves):
+        # Moves and deletes are cheap and make stale results disappear, they go
+        # first, then documents by size so small files are not stuck behind huge ones
+        for src_path, dest_path in moves:
+            self.queue.put(dest_path, "move", priority=-1, payload=src_path)
+        for doc_path in deletes:
+            self.queue.put(doc_path, "delete", priority=-1)
+        for doc_path in upserts:
+            try:
+                size = os.path.getsize(doc_path)
+            except OSError:
+                continue
+            self.queue.put(doc_path, "upsert", priority=size)
+
+    @property
+    def processing(self):
+        """Number of batches the workers are processing"""
+        with self.queue.condition:
+            return self.queue.batches_in_flight
 
     def _process_queue(self):
         while True:
-            doc_path = self.queue.get()
-            self.processing = True
+            action, doc_paths, payloads = self.queue.get_batch(self.batch_size)
             try:
-                response = requests.post(
-                    f"http://{config.config['backend']['host']}:{config.config['backend']['port']}/insert_documents",
-                    json={"doc_paths": [doc_path], "window_sizes": config.config["windows"]},
-                )
-                if response.status_code == 200:
-                    print(f"Document {doc_path} processed successfully.")
+                if action == "move":
+                    self.move_documents(list(zip(payloads, doc_paths)))
+                elif action == "delete":
+                    self.delete_documents(doc_paths)
                 else:
-                    print(f"Error processing document {doc_path}: {response.json()}")
+                    self.process_documents(doc_paths)
+            except Exception as e:
+                print(f"Error processing {len(doc_paths)} documents: {e}")
             finally:
-                self.processing = False
-                self.queue.task_done()
+                self.queue.task_done(doc_paths)
 
-    def delete_document(self, doc_path):
-        response = requests.post(
-            f"http://{config.config['backend']['host']}:{config.config['backend']['port']}/delete_documents",
-            json={"doc_path": doc_path},
-        )
-        if response.status_code == 200:
-            print(f"Document {doc_path} removed from the datastore.")
-        else:
-            print(f"Error removing document {doc_path} from the datastore: {response.json()}")
+    def process_documents(self, doc_paths):
+        result = self.ingestion.ingest(doc_paths, window_sizes=config.config["windows"])
+        print(f"{len(result['inserted'])} documents processed successfully.")
+        for failure in result["failed"]:
+            print(f"Error processing document {failure['doc_path']}: {failure['error']}")
+
+    def move_documents(self, moves):
+        moved, missing = self.ingestion.move(dict(moves))
+        print(f"{len(moved)} documents moved.")
+        # Sources that were never stored: ingest their destination instead
+        missing = set(missing)
+        dest_paths = [dest_path for src_path, dest_path in moves if src_path in missing]
+        if dest_paths:
+            self.process_documents(dest_paths)
 
+    def delete_documents(self, doc_paths):
+        deleted = self.ingestion.delete(doc_paths)
+        print(f"{deleted} documents removed from the datastore.")
+
+
+def run_watchdog(docs_path, ingestion):
+    event_handler = DocumentWatchdog(docs_path, ingestion)
+
+    watchdog_config = config.config.get("watchdog", {})
+    if watchdog_config.get("mode", "events") == "polling":
+        # Network filesystems never deliver inotify events
+        detector = PollingDetector(
+            docs_path,
+            event_handler.coalescer.add,
+            config.config["extensions"],
+            watchdog_config.get("snapshot_path")
+            or os.path.join(os.path.dirname(config.config_file), "poll_snapshot.json"),
+            interval=watchdog_config.get("poll_interval", 60),
+            stat_budget=watchdog_config.get("poll_stat_budget", 20000),
+        )
+        detector.run()
+        return
 
-def run_watchdog(docs_path):
-    event_handler = DocumentWatchdog(docs_path)
     observer = Observer()
     observer.schedule(event_handler, path=docs_path, recursive=True)
     observer.start()
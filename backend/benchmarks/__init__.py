@@ -0,0 +1,8 @@
+# benchmarks/__init__.py
+"""
+Retrieval benchmarks for the chishiki backend.
+
+Run from the backend directory against a dedicated Postgres+pgvector database:
+
+    python -m benchmarks --database chishiki_bench --init-schema --reset --output bench.json
+"""
@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import datetime
+import platform
+import subprocess
+from collections import defaultdict
+
+import numpy as np
+
+from app.utils.misc import passages_generator
+from app.utils.pg_manager import PostgresManager
+from benchmarks.corpus import SyntheticCorpus
+from benchmarks.encoder import HashingEncoder
+
+DEFAULT_SCHEMA = os.path.join(
+    os.path.dirname(__file__), "..", "..", "init-scripts", "01-init.sql"
+)
+
+
+class ExactIndex:
+    """Brute-force ground truth over the passages of one window size"""
+
+    def __init__(self):
+        self.keys = []
+        self.dense = []
+        self.postings = defaultdict(lambda: ([], []))
+
+    def add(self, key, dense_vector, lexical_weights):
+        index = len(self.keys)
+        self.keys.append(key)
+        self.dense.append(dense_vector)
+        for token, weight in lexical_weights.items():
+            self.postings[token][0].append(index)
+            self.postings[token][1].append(weight)
+
+    def freeze(self):
+        self.dense = np.stack(self.dense)
+        self.postings = {
+            token: (np.asarray(indices), np.asarray(weights, dtype=np.float64))
+            for token, (indices, weights) in self.postings.items()
+        }
+
+    def search(self, query_dense_vector, query_lexical_weights, dense_weight, sparse_weight, k):
+        scores = dense_weight * (self.dense @ query_dense_vector)
+        if sparse_weight:
+            for token, weight in query_lexical_weights.items():
+                if token in self.postings:
+                    indices, weights = self.postings[token]
+                    scores[indices] += sparse_weight * weight * weights
+        top = np.argsort(-scores)[:k]
+        return [self.keys[i] for i in top]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__), text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def percentiles(latencies):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "mean_ms": round(float(np.mean(latencies_ms)), 3),
+    }
+
+
+def prepare_database(postgres_manager, schema_path, init_schema, reset):
+    with postgres_manager.connection() as conn, conn.cursor() as cur:
+        if init_schema:
+            with open(schema_path, "r") as file:
+                cur.execute(file.read())
+        if reset:
+            cur.execute("TRUNCATE document_metadata, indexing_configurations CASCADE")
+
+
+def ingest(postgres_manager, encoder, corpus, window_sizes, stride):
+    """Mirror of the /insert_documents loop, driven by the stand-in encoder"""
+    exact_indexes = {window_size: ExactIndex() for window_size in window_sizes}
+    n_docs = n_passages = 0
+    start_time = time.perf_counter()
+
+    for doc_path, text in corpus.documents():
+        file_hash = hashlib.md5(text.encode()).hexdigest()
+        filename = os.path.basename(doc_path)
+        now = time.time()
+        postgres_manager.insert_metadata(
+            doc_path, file_hash, filename, "txt", now, now, len(text)
+        )
+        postgres_manager.set_doc_text(doc_path, text)
+
+        all_dense_vectors = []
+        for window_size in window_sizes:
+            for passage_ids, passage_mask, start_pos, end_pos in passages_generator(
+                text, encoder.tokenizer, window_size=window_size, stride=stride
+            ):
+                encoding = encoder.encode([(passage_ids, passage_mask)])
+                dense_vector = encoding["dense_vecs"][0]
+                lexical_weights = encoding["lexical_weights"][0]
+                postgres_manager.insert_passage(
+                    None,
+                    doc_path,
+                    file_hash,
+                    filename,
+                    dense_vector,
+                    lexical_weights,
+                    start_pos,
+                    end_pos,
+                    window_size,
+                )
+                exact_indexes[window_size].add(
+                    (doc_path, start_pos, end_pos), dense_vector, lexical_weights
+                )
+                all_dense_vectors.append(dense_vector)
+                n_passages += 1
+
+        postgres_manager.insert_mean_dense_vector(doc_path, np.mean(all_dense_vectors, axis=0))
+        postgres_manager.update_doc_ml_synced(doc_path, True)
+        n_docs += 1
+
+    elapsed = time.perf_counter() - start_time
+    for exact_index in exact_indexes.values():
+        exact_index.freeze()
+    return exact_indexes, {
+        "docs": n_docs,
+        "passages": n_passages,
+        "seconds": round(elapsed, 3),
+        "docs_per_s": round(n_docs / elapsed, 3),
+        "passages_per_s": round(n_passages / elapsed, 3),
+    }
+
+
+def run_searches(postgres_manager, encoder, queries, exact_indexes, k, dense_weight):
+    results = {}
+    encoded = encoder.encode(
+        [(t["input_ids"][0], t["attention_mask"][0]) for t in map(encoder.tokenizer, queries)]
+    )
+    modes = {"ann": (1.0, 0.0), "hybrid": (dense_weight, 1 - dense_weight)}
+
+    for window_size, exact_index in exact_indexes.items():
+        for mode, (mode_dense_weight, mode_sparse_weight) in modes.items():
+            latencies, recalls = [], []
+            for query_dense_vector, query_lexical_weights in zip(
+                encoded["dense_vecs"], encoded["lexical_weights"]
+            ):
+                start_time = time.perf_counter()
+                search_results = postgres_manager.ml_search(
+                    query_dense_vector,
+                    query_lexical_weights,
+                    window_size=window_size,
+                    dense_weight=mode_dense_weight,
+                    sparse_weight=mode_sparse_weight,
+                    k=k,
+                )
+                latencies.append(time.perf_counter() - start_time)
+
+                found = {key for key, _ in search_results}
+                expected = exact_index.search(
+                    query_dense_vector,
+                    query_lexical_weights,
+                    mode_dense_weight,
+                    mode_sparse_weight,
+                    k,
+                )
+                recalls.append(len(found.intersection(expected)) / max(1, len(expected)))
+
+            results[f"{mode}_w{window_size}"] = {
+                **percentiles(latencies),
+                f"recall@{k}": round(float(np.mean(recalls)), 4),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chishiki retrieval benchmark")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--database", default="chishiki_bench")
+    parser.add_argument("--user", default="chishiki_user")
+    parser.add_argument("--password", default="your_secure_password")
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA, help="SQL file run by --init-schema")
+    parser.add_argument("--init-schema", action="store_true", help="Create the tables first")
+    parser.add_argument("--reset", action="store_true", help="Truncate all tables first")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=30)
+    parser.add_argument("--window-sizes", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--stride", type=float, default=0.75)
+    parser.add_argument("--dense-weight", type=float, default=0.7)
+    parser.add_argument("--precision", choices=["float32", "halfvec", "binary"], default=None,
+                        help="Build a vector index of this precision for every window size")
+    parser.add_argument("--oversample", type=int, default=4)
+    parser.add_argument("--index-method", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--lexical-storage", choices=["table", "sparsevec"], default="table")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON output file (default: stdout)")
+    args = parser.parse_args()
+
+    logging.getLogger("app.utils.pg_manager").setLevel(logging.WARNING)
+
+    postgres_manager = PostgresManager(
+        host=args.host,
+        port=args.port,
+        database=args.database,
+        user=args.user,
+        password=args.password,
+        lexical_storage=args.lexical_storage,
+    )
+    prepare_database(postgres_manager, args.schema, args.init_schema, args.reset)
+
+    encoder = HashingEncoder(dense_dim=postgres_manager.dense_dim)
+    corpus = SyntheticCorpus(n_docs=args.docs, seed=args.seed)
+
+    print(f"Ingesting {args.docs} synthetic documents...", file=sys.stderr)
+    exact_indexes, ingest_results = ingest(
+        postgres_manager, encoder, corpus, args.window_sizes, args.stride
+    )
+
+    index_results = {}
+    if args.precision:
+        for window_size in args.window_sizes:
+            start_time = time.perf_counter()
+            postgres_manager.create_vector_index(
+                window_size,
+                precision=args.precision,
+                oversample=args.oversample,
+                method=args.index_method,
+            )
+            index_results[window_size] = {"build_seconds": round(time.perf_counter() - start_time, 3)}
+
+    print(f"Running {args.queries} queries per window size...", file=sys.stderr)
+    search_results = run_searches(
+        postgres_manager,
+        encoder,
+        corpus.queries(args.queries),
+        exact_indexes,
+        args.k,
+        args.dense_weight,
+    )
+    postgres_manager.close()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "ingest": ingest_results,
+        "index": index_results,
+        "search": search_results,
+    }
+    report["params"].pop("password")
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
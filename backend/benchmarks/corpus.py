@@ -0,0 +1,70 @@
+from typing import List, Tuple
+
+import numpy as np
+
+SYLLABLES = [
+    "ka", "ri", "to", "mu", "se", "na", "lo", "vi", "de", "po",
+    "sha", "ken", "ji", "ro", "ba", "tsu", "me", "gu", "ha", "zo",
+]
+
+
+class SyntheticCorpus:
+    """
+    Seeded topic-model corpus: every document draws most of its words from one
+    topic's Zipf-distributed vocabulary, the rest from a shared background, so that
+    queries built from topic words have meaningful dense and lexical neighbours.
+    """
+
+    def __init__(
+        self,
+        n_docs: int = 1000,
+        n_topics: int = 50,
+        vocab_size: int = 8000,
+        words_per_topic: int = 200,
+        doc_words: Tuple[int, int] = (300, 3000),
+        topic_ratio: float = 0.6,
+        seed: int = 0,
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.n_docs = n_docs
+        self.doc_words = doc_words
+        self.topic_ratio = topic_ratio
+        self.vocabulary = self._make_vocabulary(vocab_size)
+        self.topics = [
+            self.rng.choice(vocab_size, size=words_per_topic, replace=False)
+            for _ in range(n_topics)
+        ]
+        ranks = np.arange(1, words_per_topic + 1)
+        self.topic_probs = (1.0 / ranks) / np.sum(1.0 / ranks)
+        self.doc_topics = self.rng.integers(0, n_topics, size=n_docs)
+
+    def _make_vocabulary(self, vocab_size: int) -> List[str]:
+        vocabulary = set()
+        while len(vocabulary) < vocab_size:
+            n_syllables = int(self.rng.integers(2, 5))
+            vocabulary.add("".join(self.rng.choice(SYLLABLES, size=n_syllables)))
+        return sorted(vocabulary)
+
+    def _topic_words(self, topic: int, n: int) -> np.ndarray:
+        return self.rng.choice(self.topics[topic], size=n, p=self.topic_probs)
+
+    def documents(self):
+        """Yield (doc_path, text) pairs"""
+        for i, topic in enumerate(self.doc_topics):
+            n_words = int(self.rng.integers(*self.doc_words))
+            n_topic = int(n_words * self.topic_ratio)
+            word_ids = np.concatenate([
+                self._topic_words(topic, n_topic),
+                self.rng.integers(0, len(self.vocabulary), size=n_words - n_topic),
+            ])
+            self.rng.shuffle(word_ids)
+            text = " ".join(self.vocabulary[w] for w in word_ids)
+            yield f"/bench/topic_{topic:03d}/doc_{i:06d}.txt", text
+
+    def queries(self, n_queries: int = 200, query_words: Tuple[int, int] = (2, 8)) -> List[str]:
+        queries = []
+        for _ in range(n_queries):
+            topic = int(self.rng.choice(self.doc_topics))
+            n_words = int(self.rng.integers(*query_words))
+            queries.append(" ".join(self.vocabulary[w] for w in self._topic_words(topic, n_words)))
+        return queries
@@ -0,0 +1,98 @@
+import zlib
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+
+class HashingTokenizer:
+    """
+    Whitespace tokenizer with hashed token ids, exposing the subset of the
+    HuggingFace tokenizer interface used by the backend (`__call__` and `decode`).
+    """
+
+    cls_token_id = 0
+    pad_token_id = 1
+    eos_token_id = 2
+    unk_token_id = 3
+
+    def __init__(self, vocab_size: int = 250002):
+        self.vocab_size = vocab_size
+        self.special_ids = {
+            self.cls_token_id,
+            self.pad_token_id,
+            self.eos_token_id,
+            self.unk_token_id,
+        }
+        self.id_to_token = {}
+
+    def token_id(self, token: str) -> int:
+        token_id = 4 + zlib.crc32(token.encode()) % (self.vocab_size - 4)
+        self.id_to_token.setdefault(token_id, token)
+        return token_id
+
+    def __call__(self, text, return_tensors=None, max_length=None, truncation=False, **kwargs):
+        ids = [self.token_id(token) for token in text.split()]
+        if truncation and max_length:
+            ids = ids[: max_length - 2]
+        ids = [self.cls_token_id] + ids + [self.eos_token_id]
+        return {"input_ids": [ids], "attention_mask": [[1] * len(ids)]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(
+            self.id_to_token.get(int(i), "")
+            for i in ids
+            if not (skip_special_tokens and int(i) in self.special_ids)
+        )
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for `BGEModel`: same `encode` contract and `tokenizer`
+    attribute, no model download and no GPU.
+
+    Dense vectors are the normalized sum of one seeded random vector per token, so
+    passages sharing words are close to each other. Lexical weights are sublinear
+    term frequencies in (0, 1], keyed by the token id as a string like BGE-M3.
+    """
+
+    def __init__(self, dense_dim: int = 1024, vocab_size: int = 250002):
+        self.dense_dim = dense_dim
+        self.tokenizer = HashingTokenizer(vocab_size)
+        self.token_vectors = {}
+
+    def token_vector(self, token_id: int) -> np.ndarray:
+        if token_id not in self.token_vectors:
+            rng = np.random.default_rng(token_id)
+            self.token_vectors[token_id] = rng.standard_normal(self.dense_dim).astype(np.float32)
+        return self.token_vectors[token_id]
+
+    def _encode_one(self, input_ids: List[int]):
+        counts = Counter(
+            int(i) for i in input_ids if int(i) not in self.tokenizer.special_ids
+        )
+        dense_vector = np.zeros(self.dense_dim, dtype=np.float32)
+        lexical_weights: Dict[str, float] = {}
+        for token_id, count in counts.items():
+            weight = float(np.log1p(count) / np.log1p(count + 1))
+            dense_vector += weight * self.token_vector(token_id)
+            lexical_weights[str(token_id)] = weight
+        norm = np.linalg.norm(dense_vector)
+        if norm > 0:
+            dense_vector /= norm
+        return dense_vector, lexical_weights
+
+    def encode(
+        self,
+        tokenized_sentences,
+        batch_size: int = 1,
+        return_dense: bool = True,
+        return_sparse: bool = True,
+        return_colbert_vecs: bool = False,
+    ) -> Dict:
+        encoded = [self._encode_one(ids) for ids, _ in tokenized_sentences]
+        return {
+            "dense_vecs": np.stack([dense for dense, _ in encoded]) if return_dense else None,
+            "lexical_weights": [lexical for _, lexical in encoded] if return_sparse else None,
+            "colbert_vecs": None,
+        }
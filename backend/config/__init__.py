@@ -6,15 +6,79 @@ default_config = {
         "host": "postgres",
         "port": 5432,
     },
+    "postgres": {
+        "host": "postgres",
+        "port": 5432,
+        "pool_min": 1,
+        "pool_max": 10,
+        "pool_timeout": 30,
+        "prepared_statements": True,
+        "lexical_storage": "table",  # or "sparsevec", see /migrate_lexical_storage
+    },
     "backend": {
         "host": "0.0.0.0",
         "port": 7710,
         "debug": False,
+        "server": "flask",  # "async" to serve the search routes on asyncio, "gunicorn" for multiple workers
+        "workers": 4,  # "gunicorn" server only
+        "threads": 4,
+        "async": {
+            "encoder_workers": 1,
+            "encoder_max_pending": 64,
+        },
+    },
+    "encoder": {
+        "mode": "local",  # "remote" to use the encoder service, always the case with the "gunicorn" server
+        "socket": "/tmp/chishiki-encoder.sock",
+        "max_batch": 64,
+        "max_wait_ms": 5,
+    },
+    "scheduler": {
+        "max_pending": {"interactive": 64, "bulk": 8},  # admitted requests per lane, 429 past that
+        "encoder_slots": None,  # concurrent forward passes, defaults to 1 (backend threads with a remote encoder)
+        "db_reserved": 2,  # pooled connections only searches may use
     },
     "windows": [128, 256, 512],
+    "vector_index": {
+        "precision": "float32",
+        "oversample": 4,
+        "config_ttl": 60,  # seconds before re-reading index configurations built by other processes
+    },
+    "search": {
+        "doc_overfetch": 4,
+        "highlight": True,
+        "explain_threshold_ms": None,
+        "batch_encode_size": 64,
+        "max_batch_queries": 1000,
+    },
+    "sync": {
+        "manifest_page_size": 5000,
+        "scan_workers": 8,
+        "hash_workers": 4,
+        "ingest_batch_size": 16,
+        "progress_interval": 5,
+        "journal_path": None,  # defaults to config/boot_journal.jsonl
+        "max_attempts": 3,
+    },
+    "watchdog": {
+        "quiet_period": 2.0,  # seconds without events and size/mtime changes before ingesting
+        "batch_size": 32,
+        "workers": 2,
+        "mode": "events",  # "polling" for NFS/SMB mounts, where inotify events never fire
+        "poll_interval": 60,
+        "poll_stat_budget": 20000,  # stat calls per polling cycle
+        "snapshot_path": None,  # defaults to config/poll_snapshot.json, scan positions in <snapshot_path>.cursors
+    },
+    "deletion": {
+        "mode": "hard",  # "tombstone" hides documents at once and reclaims them in the background
+        "reap_interval": 10,
+        "reap_batch_size": 5000,
+    },
     "extensions": [".pdf", ".txt"],
     "ml_services": {
         "use_bge": True,
+        "preload": True,  # load the model in the background at startup, see /readyz
+        "preload_docling": False,
         "bge_unload_interval": 300,
         "use_nougat": True,
         "nougat_unload_interval": 300,
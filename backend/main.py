@@ -1,15 +1,65 @@
 import os
 import sys
+import subprocess
 import threading
-import requests
-import time
 from app.api import create_app
 from app.utils.boot_sync import sync_on_boot
 from app.utils.watchdog_sync import run_watchdog
 from config import config
 
 
+def run_async_app():
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config as HypercornConfig
+    from app.api_async import create_async_app
+
+    hypercorn_config = HypercornConfig()
+    hypercorn_config.bind = [
+        f"{config.config['backend']['host']}:{config.config['backend']['port']}"
+    ]
+    # Signal handlers can only be installed from the main thread
+    asyncio.run(
+        serve(
+            create_async_app(),
+            hypercorn_config,
+            shutdown_trigger=lambda: asyncio.Future(),
+        )
+    )
+
+
+def run_gunicorn_app():
+    # One encoder service per node holds the models, the API workers are
+    # stateless and connect to it over a Unix socket
+    encoder_process = subprocess.Popen(
+        [sys.executable, "-m", "app.models.encoder_service"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        subprocess.run(
+            [
+                sys.executable, "-m", "gunicorn",
+                "--workers", str(config.config["backend"].get("workers", 4)),
+                "--threads", str(config.config["backend"].get("threads", 4)),
+                "--bind", f"{config.config['backend']['host']}:{config.config['backend']['port']}",
+                "wsgi:app",
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+        )
+    finally:
+        encoder_process.terminate()
+
+
 def run_app():
+    server = config.config["backend"].get("server", "flask")
+    if server == "async":
+        run_async_app()
+        return
+    if server == "gunicorn":
+        run_gunicorn_app()
+        return
+
     app = create_app()
     app.run(
         host=config.config["backend"]["host"],
@@ -25,15 +75,16 @@ def main():
 
     docs_path = sys.argv[1]  # Path to the directory containing the documents
 
+    # The sync components call the ingestion service of this process directly,
+    # they do not need to wait for the server to accept connections
+    from app.api.routes import ingestion_service
+
     # Start the Flask app in a separate thread
     app_thread = threading.Thread(target=run_app)
     app_thread.daemon = True
     app_thread.start()
     print("Flask app started.")
 
-    # Wait for the Flask app to start
-    time.sleep(5)  # Adjust the delay as needed
-
     # Try creating index
     # try:
     #     requests.post(
@@ -43,11 +94,11 @@ def main():
     #     print(f"Error creating index: {e}")
 
     # Perform boot-time sync
-    sync_on_boot(docs_path)
+    sync_on_boot(docs_path, ingestion_service)
     print("Boot-time sync complete.")
 
     # Start the watchdog in a separate thread
-    watchdog_thread = threading.Thread(target=run_watchdog, args=(docs_path,))
+    watchdog_thread = threading.Thread(target=run_watchdog, args=(docs_path, ingestion_service))
     watchdog_thread.daemon = True
     watchdog_thread.start()
     print("Watchdog thread started.")
@@ -0,0 +1,121 @@
+import importlib
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from config import config
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if self.connection.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+        if query.startswith("PREPARE "):
+            name, _, text = query[8:].partition(" AS ")
+            self.connection.prepared[name] = text
+        self.connection.statements.append(query)
+        self.connection.database.log.append(query)
+        self.rowcount = len(self.connection.database.rows_for(self._text(query)))
+
+    def _text(self, statement):
+        if statement.startswith("EXECUTE "):
+            # Canned rows are looked up by the text of the prepared statement
+            return self.connection.prepared.get(statement[8:].split("(")[0], statement)
+        return statement
+
+    def fetchall(self):
+        return self.connection.database.rows_for(self._text(self.connection.statements[-1]))
+
+    def fetchone(self):
+        rows = self.fetchall()
+        return rows[0] if rows else None
+
+
+class FakeInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.closed = 0
+        self.statements = []
+        self.prepared = {}
+        self.info = FakeInfo()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.database.log.append("COMMIT")
+
+    def rollback(self):
+        self.database.log.append("ROLLBACK")
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeDatabase(list):
+    """
+    The connections opened so far, canned rows by statement substring (their
+    number is also the rowcount of the statement), and the log of the
+    statements and transaction ends of all connections
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows = {}
+        self.log = []
+
+    def transactions(self):
+        """Statements of the log grouped by transaction"""
+        groups, current = [], []
+        for entry in self.log:
+            if entry in ("COMMIT", "ROLLBACK"):
+                if current:
+                    groups.append(current)
+                current = []
+            else:
+                current.append(entry)
+        return groups + ([current] if current else [])
+
+    def rows_for(self, statement):
+        for fragment, rows in self.rows.items():
+            if fragment in statement:
+                return list(rows)
+        return []
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Make psycopg2.connect hand out fake connections, return them as they are opened"""
+    database = FakeDatabase()
+
+    def connect(*args, **kwargs):
+        database.append(FakeConnection(database))
+        return database[-1]
+
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    return database
+
+
+def import_routes(name):
+    """
+    Import a routes module without a database or a model: the pools created at
+    import connect to fake databases, and the model is not preloaded
+    """
+    config.config["ml_services"]["preload"] = False
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(psycopg2, "connect", lambda *args, **kwargs: FakeConnection(FakeDatabase()))
+        return importlib.import_module(name)
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+import pytest
+from quart import Quart
+
+from tests.conftest import import_routes
+
+
+@pytest.fixture(scope="module")
+def async_routes():
+    return import_routes("app.api_async.routes")
+
+
+@pytest.fixture
+def client(async_routes):
+    app = Quart(__name__)
+    app.register_blueprint(async_routes.async_routes)
+    return app.test_client()
+
+
+def test_encoder_queue_counts_pending_requests(async_routes):
+    queue = async_routes.EncoderQueue(workers=1, max_pending=1)
+    started, release = threading.Event(), threading.Event()
+
+    def encode():
+        started.set()
+        release.wait(2)
+        return "encoded"
+
+    async def main():
+        task = asyncio.ensure_future(queue.run(encode))
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        assert queue.full()
+        release.set()
+        assert await task == "encoded"
+        assert not queue.full()
+
+    asyncio.run(main())
+
+
+def test_failed_encoding_leaves_the_queue(async_routes):
+    queue = async_routes.EncoderQueue(workers=1, max_pending=1)
+
+    def fail():
+        raise RuntimeError("CUDA out of memory")
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await queue.run(fail)
+
+    asyncio.run(main())
+    assert queue.pending == 0
+
+
+def test_search_is_rejected_while_the_encoder_queue_is_full(async_routes, client, monkeypatch):
+    monkeypatch.setattr(async_routes.encoder_queue, "pending", async_routes.encoder_queue.max_pending)
+
+    async def post():
+        return await client.post("/search", json={"query": "vector index"})
+
+    response = asyncio.run(post())
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+
+@pytest.mark.parametrize(
+    "path, payload",
+    [
+        ("/search", {"query": "vector index", "window_size": "abc"}),
+        ("/search", {"query": "vector index", "k": 0}),
+        ("/search_batch", {"queries": ["vector index"], "window_size": -512}),
+        ("/search_batch", {"queries": [{"query": "vector index", "k": "ten"}]}),
+    ],
+)
+def test_bad_window_size_or_k_is_rejected(client, path, payload):
+    async def post():
+        response = await client.post(path, json=payload)
+        return response.status_code, await response.get_json()
+
+    status_code, body = asyncio.run(post())
+    assert status_code == 400
+    assert body["error"].startswith("Invalid ")
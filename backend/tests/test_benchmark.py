@@ -0,0 +1,46 @@
+import numpy as np
+
+from benchmarks.__main__ import ExactIndex
+from benchmarks.corpus import SyntheticCorpus
+from benchmarks.encoder import HashingEncoder
+
+
+def encode(encoder, text):
+    tokenized = encoder.tokenizer(text)
+    encoded = encoder.encode([(tokenized["input_ids"][0], tokenized["attention_mask"][0])])
+    return encoded["dense_vecs"][0], encoded["lexical_weights"][0]
+
+
+def test_corpus_is_reproducible_from_its_seed():
+    def sample(seed):
+        corpus = SyntheticCorpus(n_docs=5, n_topics=2, vocab_size=200, words_per_topic=20, doc_words=(10, 20), seed=seed)
+        return list(corpus.documents()), corpus.queries(3)
+
+    assert sample(1) == sample(1)
+    assert sample(1) != sample(2)
+
+
+def test_encoder_is_deterministic_and_keeps_shared_words_close():
+    encoder = HashingEncoder(dense_dim=64)
+    dense, lexical = encode(encoder, "kari tomu kari")
+
+    assert np.array_equal(dense, encode(HashingEncoder(dense_dim=64), "kari tomu kari")[0])
+    assert np.isclose(np.linalg.norm(dense), 1.0)
+    # Special tokens carry no weight, repeated words weigh more
+    assert len(lexical) == 2
+    assert lexical[str(encoder.tokenizer.token_id("kari"))] > lexical[str(encoder.tokenizer.token_id("tomu"))]
+
+    close = dense @ encode(encoder, "kari tomu sena")[0]
+    far = dense @ encode(encoder, "bazo guha mese")[0]
+    assert close > far
+
+
+def test_exact_index_ranks_by_combined_score():
+    encoder = HashingEncoder(dense_dim=64)
+    index = ExactIndex()
+    for key, text in [("a", "kari tomu"), ("b", "sena vide"), ("c", "kari sena")]:
+        index.add(key, *encode(encoder, text))
+    index.freeze()
+
+    query_dense, query_lexical = encode(encoder, "kari tomu")
+    assert index.search(query_dense, query_lexical, dense_weight=0.7, sparse_weight=0.3, k=2) == ["a", "c"]
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("FlagEmbedding")
+
+from app.models.bge import BGEModel
+
+
+class FakeTokenizer:
+    cls_token_id = 0
+    pad_token_id = 1
+    eos_token_id = 2
+    unk_token_id = 3
+
+
+class FakeM3:
+    """Dense output is the sum of the unmasked ids, token weights are the ids themselves"""
+
+    def __init__(self):
+        self.batches = []
+
+    def eval(self):
+        pass
+
+    def __call__(self, batch_data, return_dense=True, return_sparse=True):
+        self.batches.append(batch_data)
+        ids = batch_data["input_ids"].float() * batch_data["attention_mask"]
+        return {"dense_vecs": ids.sum(dim=1, keepdim=True), "sparse_vecs": ids.unsqueeze(-1)}
+
+
+@pytest.fixture
+def model():
+    model = BGEModel.__new__(BGEModel)
+    model.device = torch.device("cpu")
+    model.bge = SimpleNamespace(model=FakeM3())
+    model.tokenizer = FakeTokenizer()
+    return model
+
+
+def pair(ids):
+    return torch.tensor(ids), torch.ones(len(ids), dtype=torch.long)
+
+
+def test_batches_are_padded_to_their_longest_sequence(model):
+    sentences = [pair([0, 5, 6, 2]), pair([0, 7, 2]), pair([0, 8, 9, 10, 2])]
+
+    encoded = model.encode(sentences, batch_size=2)
+
+    first, second = model.bge.model.batches
+    assert first["input_ids"].tolist() == [[0, 5, 6, 2], [0, 7, 2, 1]]
+    assert first["attention_mask"].tolist() == [[1, 1, 1, 1], [1, 1, 1, 0]]
+    assert second["input_ids"].shape == (1, 5)
+    # Padding does not leak into the outputs
+    assert encoded["dense_vecs"][:, 0].tolist() == [13, 9, 29]
+    assert [dict(weights) for weights in encoded["lexical_weights"]] == [
+        {"5": 5, "6": 6},
+        {"7": 7},
+        {"8": 8, "9": 9, "10": 10},
+    ]
+
+
+def test_one_pass_per_sequence_by_default(model):
+    model.encode([pair([0, 5, 2]), pair([0, 6, 2])])
+    assert [batch["input_ids"].shape for batch in model.bge.model.batches] == [(1, 3), (1, 3)]
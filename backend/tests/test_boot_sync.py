@@ -0,0 +1,158 @@
+import hashlib
+import os
+
+import pytest
+
+from app.utils.boot_sync import BootJournal, BootScanner, IngestionStream, ScanProgress, sync_on_boot
+from app.utils.ingestion import MLServiceUnavailable
+from app.utils.misc import calculate_file_hash
+from config import config
+
+
+def test_chunked_hash_matches_whole_file_md5(tmp_path):
+    path = tmp_path / "doc.pdf"
+    content = os.urandom(3 * 1024 + 17)
+    path.write_bytes(content)
+
+    assert calculate_file_hash(str(path), chunk_size=1024) == hashlib.md5(content).hexdigest()
+
+
+def test_empty_file_hash(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    assert calculate_file_hash(str(path)) == hashlib.md5(b"").hexdigest()
+
+
+def test_scanner_finds_documents_in_nested_directories(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    for name in ("top.pdf", "a/one.txt", "a/b/two.pdf", "a/b/skip.docx"):
+        (tmp_path / name).write_text(name)
+    progress = ScanProgress()
+
+    found = sorted(path for path, _ in BootScanner(str(tmp_path), [".pdf", ".txt"], workers=2, progress=progress).scan())
+
+    assert found == sorted(str(tmp_path / name) for name in ("top.pdf", "a/one.txt", "a/b/two.pdf"))
+    assert progress.counts["dirs"] == 3
+
+
+def test_journal_resumes_after_the_acknowledged_documents(tmp_path):
+    done, failed = tmp_path / "done.txt", tmp_path / "failed.txt"
+    done.write_text("done")
+    failed.write_text("failed")
+    journal_path = str(tmp_path / "boot.jsonl")
+
+    BootJournal(journal_path).record([(str(done), os.stat(done), None), (str(failed), os.stat(failed), "bad pdf")])
+    with open(journal_path, "a") as file:
+        file.write('{"doc_path": "torn')
+
+    journal = BootJournal(journal_path)
+    assert journal.should_skip(str(done), os.stat(done))
+    assert not journal.should_skip(str(failed), os.stat(failed))
+    assert journal.entries[str(failed)]["attempts"] == 1
+
+    done.write_text("changed since")
+    assert not journal.should_skip(str(done), os.stat(done))
+
+
+def test_journal_quarantines_repeated_failures_until_the_file_changes(tmp_path):
+    path = tmp_path / "bad.pdf"
+    path.write_text("bad")
+    journal = BootJournal(str(tmp_path / "boot.jsonl"), max_attempts=2)
+
+    for _ in range(2):
+        journal.record([(str(path), os.stat(path), "bad pdf")])
+    assert journal.should_skip(str(path), os.stat(path))
+    assert [entry["doc_path"] for entry in journal.quarantined()] == [str(path)]
+
+    path.write_text("fixed")
+    assert not journal.should_skip(str(path), os.stat(path))
+    journal.record([(str(path), os.stat(path), "still bad")])
+    assert journal.entries[str(path)]["attempts"] == 1
+
+
+def test_journal_compaction_keeps_failures_only(tmp_path):
+    done, failed = tmp_path / "done.txt", tmp_path / "failed.txt"
+    done.write_text("done")
+    failed.write_text("failed")
+    journal_path = str(tmp_path / "boot.jsonl")
+    journal = BootJournal(journal_path)
+    journal.record([(str(done), os.stat(done), None), (str(failed), os.stat(failed), "bad pdf")])
+
+    journal.compact()
+    assert list(BootJournal(journal_path).entries) == [str(failed)]
+
+    journal.compact(keep=set())
+    assert BootJournal(journal_path).entries == {}
+
+
+class FakeIngestion:
+    """Ingestion service failing the documents named in `bad`, or unavailable altogether"""
+
+    def __init__(self, bad=(), unavailable=False, stored=()):
+        self.bad = set(bad)
+        self.unavailable = unavailable
+        self.stored = list(stored)
+        self.deleted = []
+
+    def ingest(self, doc_paths, window_sizes=None):
+        if self.unavailable:
+            raise MLServiceUnavailable("ML service not enabled")
+        return {
+            "inserted": [doc_path for doc_path in doc_paths if doc_path not in self.bad],
+            "failed": [{"doc_path": doc_path, "error": "bad pdf"} for doc_path in doc_paths if doc_path in self.bad],
+        }
+
+    def manifest(self, prefix=None, after=None, limit=5000):
+        return [{"doc_path": doc_path} for doc_path in self.stored], None
+
+    def delete(self, doc_paths):
+        self.deleted.extend(doc_paths)
+
+
+def test_stream_journals_per_document_failures(tmp_path):
+    good, bad = tmp_path / "good.txt", tmp_path / "bad.txt"
+    good.write_text("good")
+    bad.write_text("bad")
+    journal = BootJournal(str(tmp_path / "boot.jsonl"))
+
+    stream = IngestionStream(FakeIngestion(bad=[str(bad)]), flush_interval=0.01, journal=journal)
+    stream.put(str(good), os.stat(good))
+    stream.put(str(bad), os.stat(bad))
+    stream.close()
+
+    assert (stream.inserted, stream.failed) == (1, 1)
+    assert journal.entries[str(good)]["status"] == "done"
+    assert journal.entries[str(bad)]["attempts"] == 1
+
+
+def test_unavailable_ingestion_stops_the_stream_without_journaling(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("text")
+    journal = BootJournal(str(tmp_path / "boot.jsonl"))
+
+    stream = IngestionStream(FakeIngestion(unavailable=True), batch_size=1, flush_interval=0.01, journal=journal)
+    stream.put(str(path), os.stat(path))
+    with pytest.raises(MLServiceUnavailable):
+        stream.close()
+    with pytest.raises(MLServiceUnavailable):
+        stream.put(str(path), os.stat(path))
+    assert journal.entries == {}
+
+
+def test_unavailable_boot_leaves_attempts_unchanged(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    path = docs / "bad.txt"
+    path.write_text("bad")
+    journal_path = str(tmp_path / "boot.jsonl")
+    BootJournal(journal_path).record([(str(path), os.stat(path), "bad pdf")])
+    monkeypatch.setitem(config.config, "sync", {"journal_path": journal_path})
+    ingestion = FakeIngestion(unavailable=True, stored=[str(docs / "gone.txt")])
+
+    sync_on_boot(str(docs), ingestion)
+
+    journal = BootJournal(journal_path)
+    assert journal.entries[str(path)]["attempts"] == 1
+    assert not journal.should_skip(str(path), os.stat(path))
+    # The boot did not complete, stored documents missing from it are kept
+    assert ingestion.deleted == []
@@ -0,0 +1,39 @@
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+
+
+@pytest.fixture
+def pm(connections):
+    return PostgresManager(pool_min=1, pool_max=2)
+
+
+def test_documents_are_deleted_with_one_statement_per_table(pm, connections):
+    connections.rows["SELECT file_hash"] = [("hash-a",), ("hash-b",)]
+
+    assert pm.delete_docs(["/docs/a.pdf", "/docs/b.pdf", "/docs/missing.pdf"]) == 2
+    (transaction,) = [t for t in connections.transactions() if t != ["SELECT 1"]]
+    deletes = [statement.split()[2] for statement in transaction if statement.lstrip().startswith("DELETE")]
+    # Bottom-up, so the cascades find nothing left to do
+    assert deletes == ["lexical_weights", "passages", "document_texts", "document_metadata"]
+
+
+def test_no_documents_means_no_statements(pm, connections):
+    assert pm.delete_docs([]) == 0
+    assert connections.log == []
+
+
+def test_tombstoned_documents_are_only_marked_deleted(pm, connections):
+    connections.rows["SET deleted_at"] = [("/docs/a.pdf",)]
+
+    assert pm.delete_docs(["/docs/a.pdf", "/docs/missing.pdf"], tombstone=True) == 1
+    assert not any(statement.lstrip().startswith("DELETE") for statement in connections.log)
+
+
+def test_tags_of_tombstoned_documents_are_neither_read_nor_updated(pm, connections):
+    pm.get_doc_tags("/docs/a.pdf")
+    pm.update_doc_tags("/docs/a.pdf", ["kept"])
+
+    tag_statements = [text for connection in connections for text in connection.prepared.values() if "tags" in text]
+    assert len(tag_statements) == 2
+    assert all("deleted_at IS NULL" in text for text in tag_statements)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+
+
+@pytest.fixture
+def pm(connections):
+    return PostgresManager()
+
+
+def search(pm, **kwargs):
+    return pm.ml_search_documents(np.ones(1024, dtype=np.float32), {"42": 0.3}, window_sizes=[256, 512], **kwargs)
+
+
+def test_passages_are_collapsed_by_document(pm, connections):
+    # doc_path, doc_score, start_pos, end_pos, dense, lexical, combined, window_size, text
+    connections.rows["doc_scores"] = [
+        ("/docs/a.pdf", 0.9, 0, 512, 0.8, 0.5, 0.9, 512, "first"),
+        ("/docs/a.pdf", 0.9, 1024, 1280, 0.7, 0.4, 0.6, 256, "second"),
+        ("/docs/b.pdf", 0.5, 0, 256, 0.4, 0.6, 0.5, 256, None),
+    ]
+
+    documents = search(pm)
+
+    assert [(document["doc_path"], document["doc_score"]) for document in documents] == [
+        ("/docs/a.pdf", 0.9),
+        ("/docs/b.pdf", 0.5),
+    ]
+    assert [passage["text"] for passage in documents[0]["passages"]] == ["first", "second"]
+    assert documents[0]["passages"][1]["window_size"] == 256
+    # Documents whose text is missing still come back
+    assert documents[1]["passages"][0]["text"] == ""
+
+
+def test_document_score_aggregates_the_kept_passages(pm, connections):
+    search(pm, doc_score="sum")
+    assert any("SUM(combined_score) AS doc_score" in statement for connection in connections for statement in connection.statements)
+
+    with pytest.raises(ValueError):
+        search(pm, doc_score="mean")
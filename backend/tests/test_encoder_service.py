@@ -0,0 +1,104 @@
+import threading
+import time
+from multiprocessing import Pipe
+
+import pytest
+
+from app.models.encoder_service import EncoderServer
+
+
+class RecordingModel:
+    """Encode a pair to its first token id, and record the pairs of every forward pass"""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, pairs, batch_size=1, return_dense=True, return_sparse=True, return_colbert_vecs=False):
+        self.batches.append([pair[0][0] for pair in pairs])
+        return {
+            "dense_vecs": [pair[0][0] for pair in pairs] if return_dense else None,
+            "lexical_weights": [{str(pair[0][0]): 1.0} for pair in pairs] if return_sparse else None,
+        }
+
+
+class Caller:
+    """A client connection of the server, sending one request from its own thread"""
+
+    def __init__(self, server, *request):
+        self.conn, server_conn = Pipe()
+        threading.Thread(target=server._handle, args=(server_conn,), daemon=True).start()
+        self.conn.send(request)
+
+    def result(self):
+        assert self.conn.poll(2), "timed out"
+        return self.conn.recv()
+
+
+def pairs(*ids):
+    return [([i], [1]) for i in ids]
+
+
+KWARGS = {"return_dense": True, "return_sparse": True, "return_colbert_vecs": False}
+
+
+@pytest.fixture
+def server():
+    server = EncoderServer("unused", max_batch=4, max_wait_ms=5)
+    server.model = RecordingModel()
+    return server
+
+
+def queue_then_encode(server, requests):
+    """Queue the requests in order before the encode loop starts, so the batches are deterministic"""
+    callers = []
+    for request in requests:
+        callers.append(Caller(server, *request))
+        deadline = time.monotonic() + 2
+        while server.jobs.qsize() < len(callers):
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.005)
+    threading.Thread(target=server._encode_loop, daemon=True).start()
+    return [caller.result() for caller in callers]
+
+
+def test_concurrent_requests_share_a_pass_and_get_their_own_slice(server):
+    first, second = queue_then_encode(server, [("encode", pairs(1, 2), KWARGS), ("encode", pairs(3), KWARGS)])
+
+    assert server.model.batches == [[1, 2, 3]]
+    assert first == {"dense_vecs": [1, 2], "lexical_weights": [{"1": 1.0}, {"2": 1.0}]}
+    assert second == {"dense_vecs": [3], "lexical_weights": [{"3": 1.0}]}
+
+
+def test_requests_asking_for_other_outputs_are_not_merged(server):
+    sparse_only = dict(KWARGS, return_dense=False)
+    first, second = queue_then_encode(server, [("encode", pairs(1), KWARGS), ("encode", pairs(2), sparse_only)])
+
+    assert server.model.batches == [[1], [2]]
+    assert first["dense_vecs"] == [1]
+    assert second == {"dense_vecs": None, "lexical_weights": [{"2": 1.0}]}
+
+
+def test_batches_are_split_at_max_batch(server):
+    results = queue_then_encode(server, [("encode", pairs(i, i + 10), KWARGS) for i in range(3)])
+
+    assert server.model.batches == [[0, 10, 1, 11], [2, 12]]
+    assert [result["dense_vecs"] for result in results] == [[0, 10], [1, 11], [2, 12]]
+
+
+def test_errors_are_sent_back_to_the_caller(server):
+    server.model.encode = lambda *args, **kwargs: 1 / 0
+    (result,) = queue_then_encode(server, [("encode", pairs(1), KWARGS)])
+    assert isinstance(result, ZeroDivisionError)
+
+    assert Caller(server, "ping").result() == "pong"
+    assert isinstance(Caller(server, "transcribe").result(), ValueError)
+
+
+def test_interactive_requests_are_encoded_before_queued_bulk_ones(server):
+    bulk, interactive = queue_then_encode(
+        server, [("encode", pairs(1), KWARGS, "bulk"), ("encode", pairs(2), KWARGS, "interactive")]
+    )
+
+    # Never merged either, an interactive request does not wait for a bulk batch
+    assert server.model.batches == [[2], [1]]
+    assert bulk["dense_vecs"] == [1] and interactive["dense_vecs"] == [2]
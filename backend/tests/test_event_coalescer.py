@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+from app.utils.watchdog_sync import EventCoalescer
+
+
+@pytest.fixture
+def coalescer():
+    # The background flush never runs, the tests call flush_due themselves
+    return EventCoalescer(on_ready=None, quiet_period=2.0, poll_interval=3600)
+
+
+def later():
+    return time.time() + 10
+
+
+def write(path, content="text"):
+    path.write_text(content)
+    return str(path)
+
+
+def test_events_of_a_path_are_merged_into_one_upsert(coalescer, tmp_path):
+    path = write(tmp_path / "a.txt")
+    coalescer.add("created", path)
+    coalescer.add("modified", path)
+    coalescer.add("modified", path)
+
+    assert coalescer.flush_due(later()) == ([path], [], [])
+    assert coalescer.pending == {}
+
+
+def test_quiet_paths_only_are_flushed(coalescer, tmp_path):
+    path = write(tmp_path / "a.txt")
+    coalescer.add("modified", path)
+
+    assert coalescer.flush_due() == ([], [], [])
+    assert path in coalescer.pending
+
+
+def test_file_still_being_written_waits_for_another_quiet_period(coalescer, tmp_path):
+    path = write(tmp_path / "a.txt")
+    coalescer.add("created", path)
+    write(tmp_path / "a.txt", "text, and some more")
+
+    now = later()
+    assert coalescer.flush_due(now) == ([], [], [])
+    assert coalescer.flush_due(now + 10) == ([path], [], [])
+
+
+def test_created_then_deleted_is_dropped(coalescer, tmp_path):
+    path = write(tmp_path / "a.txt")
+    coalescer.add("created", path)
+    os.remove(path)
+    coalescer.add("deleted", path)
+
+    assert coalescer.flush_due(later()) == ([], [], [])
+
+
+def test_deleted_then_created_is_an_upsert(coalescer, tmp_path):
+    path = str(tmp_path / "a.txt")
+    coalescer.add("deleted", path)
+    write(tmp_path / "a.txt")
+    coalescer.add("created", path)
+
+    assert coalescer.flush_due(later()) == ([path], [], [])
+
+
+def test_stored_file_vanishing_without_event_is_deleted(coalescer, tmp_path):
+    path = write(tmp_path / "a.txt")
+    coalescer.add("modified", path)
+    os.remove(path)
+
+    assert coalescer.flush_due(later()) == ([], [path], [])
+
+
+def test_moves_are_chained_to_the_stored_source(coalescer, tmp_path):
+    a, b, c = (str(tmp_path / name) for name in ("a.txt", "b.txt", "c.txt"))
+    coalescer.add("moved", b, src_path=a)
+    coalescer.add("moved", c, src_path=b)
+
+    assert coalescer.flush_due(later()) == ([], [], [(a, c)])
+
+
+def test_destination_modified_after_a_move_is_reingested(coalescer, tmp_path):
+    a = str(tmp_path / "a.txt")
+    b = write(tmp_path / "b.txt")
+    coalescer.add("moved", b, src_path=a)
+    coalescer.add("modified", b)
+
+    assert coalescer.flush_due(later()) == ([b], [a], [])
+
+
+def test_move_of_a_never_ingested_file_is_an_upsert(coalescer, tmp_path):
+    a = str(tmp_path / "a.txt")
+    coalescer.add("created", a)
+    b = write(tmp_path / "b.txt")
+    coalescer.add("moved", b, src_path=a)
+
+    assert coalescer.flush_due(later()) == ([b], [], [])
+
+
+def test_move_of_a_modified_file_deletes_the_stored_source(coalescer, tmp_path):
+    a = str(tmp_path / "a.txt")
+    coalescer.add("modified", a)
+    b = write(tmp_path / "b.txt")
+    coalescer.add("moved", b, src_path=a)
+
+    assert coalescer.flush_due(later()) == ([b], [a], [])
@@ -0,0 +1,52 @@
+import pytest
+
+from app.utils.fusion import fuse_window_results, span_overlap
+
+
+def hit(doc_path, start_pos, end_pos, score):
+    return (doc_path, start_pos, end_pos), (score, score, score)
+
+
+def test_span_overlap_is_relative_to_the_shorter_span():
+    assert span_overlap(0, 100, 200, 300) == 0.0
+    assert span_overlap(0, 100, 50, 150) == 0.5
+    assert span_overlap(0, 1000, 100, 200) == 1.0
+
+
+def test_span_found_at_several_window_sizes_ranks_first():
+    fused = fuse_window_results(
+        {
+            256: [hit("a.txt", 0, 256, 0.9), hit("b.txt", 0, 256, 0.8)],
+            512: [hit("b.txt", 0, 512, 0.7), hit("c.txt", 0, 512, 0.6)],
+        }
+    )
+
+    assert [passage["doc_path"] for passage in fused] == ["b.txt", "a.txt", "c.txt"]
+    assert fused[0]["window_sizes"] == [512, 256]
+    assert fused[0]["fused_score"] == pytest.approx(1 / 61 + 1 / 62)
+
+
+def test_max_keeps_the_best_combined_score():
+    fused = fuse_window_results(
+        {
+            256: [hit("a.txt", 0, 256, 0.9)],
+            512: [hit("a.txt", 0, 512, 0.7), hit("b.txt", 0, 512, 0.8)],
+        },
+        method="max",
+    )
+
+    assert [(passage["doc_path"], passage["fused_score"]) for passage in fused] == [("a.txt", 0.9), ("b.txt", 0.8)]
+    assert fused[0]["window_size"] == 256
+
+
+def test_disjoint_spans_of_a_document_are_kept_apart():
+    fused = fuse_window_results({512: [hit("a.txt", 0, 512, 0.9), hit("a.txt", 1024, 1536, 0.8)]})
+    assert [passage["start_pos"] for passage in fused] == [0, 1024]
+
+    fused = fuse_window_results({512: [hit("a.txt", 0, 512, 0.9), hit("a.txt", 1024, 1536, 0.8)]}, k=1)
+    assert [passage["start_pos"] for passage in fused] == [0]
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        fuse_window_results({}, method="sum")
@@ -0,0 +1,42 @@
+from app.utils.highlight import highlight_passages
+
+
+class WordTokenizer:
+    """One token per word, the id is the index of the word in the vocabulary"""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+
+    def __call__(self, texts, **kwargs):
+        input_ids, offset_mapping = [], []
+        for text in texts:
+            ids, offsets, start = [], [], 0
+            for word in text.split(" "):
+                ids.append(self.vocabulary.index(word))
+                offsets.append((start, start + len(word)))
+                start += len(word) + 1
+            input_ids.append(ids)
+            offset_mapping.append(offsets)
+        return {"input_ids": input_ids, "offset_mapping": offset_mapping}
+
+
+tokenizer = WordTokenizer(["the", "vector", "index", "is", "fast", "slow"])
+
+
+def test_matched_tokens_are_highlighted_per_text():
+    highlights = highlight_passages(
+        tokenizer, ["the index is fast", "the index is slow"], {"2": 0.5, "4": 0.3}
+    )
+
+    assert highlights == [[[4, 9, 0.5], [13, 17, 0.3]], [[4, 9, 0.5]]]
+
+
+def test_adjacent_tokens_are_merged_with_the_highest_weight():
+    highlights = highlight_passages(tokenizer, ["the vector index is fast"], {"1": 0.2, "2": 0.5})
+
+    assert highlights == [[[4, 16, 0.5]]]
+
+
+def test_no_query_weights_means_no_highlights():
+    assert highlight_passages(tokenizer, ["the index"], {}) == [[]]
+    assert highlight_passages(tokenizer, [], {"2": 0.5}) == []
@@ -0,0 +1,22 @@
+from app.utils.pg_manager import PostgresManager
+
+
+def test_index_config_is_reread_after_ttl(connections, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.utils.pg_manager.time.monotonic", lambda: now[0])
+    pm = PostgresManager(pool_min=1, pool_max=2, index_config_ttl=60)
+    connections.rows["FROM indexing_configurations"] = [({"precision": "halfvec", "oversample": 8},)]
+
+    assert pm.get_index_config(512)["precision"] == "halfvec"
+
+    # Rebuilt as binary by another process: cached until the TTL expires
+    connections.rows["FROM indexing_configurations"] = [({"precision": "binary", "oversample": 16},)]
+    now[0] += 30
+    assert pm.get_index_config(512)["precision"] == "halfvec"
+    now[0] += 31
+    assert pm.get_index_config(512) == {"precision": "binary", "oversample": 16}
+
+
+def test_index_config_defaults_without_row(connections):
+    pm = PostgresManager(pool_min=1, pool_max=2, default_precision="float32", default_oversample=4)
+    assert pm.get_index_config(128) == {"precision": "float32", "oversample": 4}
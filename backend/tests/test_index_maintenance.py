@@ -0,0 +1,76 @@
+import pytest
+
+from app.utils.index_maintenance import IndexMaintenance
+from app.utils.pg_manager import PostgresManager
+
+OLD_DEFINITION = (
+    "CREATE INDEX idx_passages_dense_w512 ON public.passages USING hnsw "
+    "(dense_vector vector_cosine_ops) WITH (m='16', ef_construction='64') WHERE (window_size = 512)"
+)
+
+
+@pytest.fixture
+def maintenance(connections):
+    connections.rows.update({
+        "pg_partitioned_table": [(False,)],
+        "pg_get_indexdef": [(OLD_DEFINITION,)],
+        "SELECT config_params": [({"precision": "float32", "oversample": 4, "method": "hnsw"},)],
+        "count(*)": [(1000,)],
+        "ORDER BY random()": [("[1,0,0,0]",), ("[0,1,0,0]",)],
+        # Recall query: approximate neighbours, checked before the exact ones
+        "c.passage_id": [("p1",), ("p2",)],
+        "SELECT passage_id": [("p1",), ("p2",)],
+    })
+    pm = PostgresManager(pool_min=1, pool_max=4, dense_dim=4)
+    return IndexMaintenance(pm, sample_queries=2, k=2, min_recall=0.9)
+
+
+def swap_transactions(connections):
+    return [
+        transaction for transaction in connections.transactions()
+        if any("RENAME TO" in statement for statement in transaction)
+    ]
+
+
+def test_swap_transaction_only_drops_renames_and_saves(maintenance, connections):
+    result = maintenance.rebuild(512, index_params={"m": 16, "ef_construction": 64})
+
+    assert result["swapped"] and result["recall"] == 1.0
+    (swap,) = swap_transactions(connections)
+    assert "lock_timeout" in swap[0]
+    assert [statement.split()[0] for statement in swap[1:]] == ["DROP", "ALTER", "SELECT"]
+    assert "add_indexing_configuration" in swap[-1]
+    # No search ran while the passages table was locked
+    assert not any("passages p" in statement for statement in swap)
+
+
+def test_new_index_recall_is_measured_before_the_swap_and_rolled_back(maintenance, connections):
+    maintenance.rebuild(512, index_params={"m": 16, "ef_construction": 64})
+
+    drop = connections.log.index("DROP INDEX IF EXISTS idx_passages_dense_w512")
+    rename = next(i for i, statement in enumerate(connections.log) if "RENAME TO" in statement)
+    assert drop < rename
+    # Recall measured through the new index only, then the drop is undone
+    searches = connections.log[drop + 1:connections.log.index("ROLLBACK", drop)]
+    assert len([statement for statement in searches if "c.passage_id" in statement]) == 2
+
+
+def test_low_recall_keeps_the_current_index(maintenance, connections):
+    # Half of the exact neighbours are missed through the new index
+    connections.rows["c.passage_id"] = [("p1",), ("p9",)]
+
+    result = maintenance.rebuild(512, index_params={"m": 4, "ef_construction": 8})
+
+    assert not result["swapped"] and result["recall"] == 0.5
+    assert swap_transactions(connections) == []
+    assert connections.log[-2] == "DROP INDEX CONCURRENTLY IF EXISTS idx_passages_dense_w512_new"
+    creates = [statement for statement in connections.log if "CREATE INDEX" in statement]
+    assert len(creates) == 1 and "m = 4" in creates[0]
+
+
+def test_samples_and_ground_truth_skip_tombstoned_documents(maintenance, connections):
+    maintenance.measure_recall(512)
+    searches = [statement for statement in connections.log if "FROM passages p" in statement]
+    # Sampling, then the exact and approximate search of each of the 2 queries
+    assert len(searches) == 1 + 2 + 2
+    assert all("dm.deleted_at IS NULL" in statement for statement in searches)
@@ -0,0 +1,168 @@
+import psycopg2
+import pytest
+
+from app.utils.ingestion import IngestionService, MLServiceUnavailable
+
+
+class CharTokenizer:
+    """One token per character, the id is the code point"""
+
+    def __call__(self, text, **kwargs):
+        ids = [ord(char) for char in text]
+        return {"input_ids": [ids], "attention_mask": [[1] * len(ids)]}
+
+    def decode(self, ids, **kwargs):
+        return "".join(chr(i) for i in ids)
+
+
+class FakeModel:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, pairs, **kwargs):
+        self.encoded.extend(pairs)
+        return {"dense_vecs": [[1.0, 0.0] for _ in pairs], "lexical_weights": [{"1": 0.5} for _ in pairs]}
+
+
+class FakeModelManager:
+    def __init__(self, model):
+        self.model = model
+
+    def get_model(self):
+        return self.model, CharTokenizer()
+
+
+class FakeStore:
+    """The postgres_manager calls of the service, on in-memory documents"""
+
+    def __init__(self, docs=None, failing=(), error=RuntimeError("disk error")):
+        self.docs = docs or {}
+        self.failing = set(failing)
+        self.error = error
+        self.passages = []
+        self.synced = {}
+        self.moves = []
+
+    def get_doc_by_hash(self, file_hash):
+        for doc_path, doc in self.docs.items():
+            if doc["file_hash"] == file_hash:
+                return {"doc_path": doc_path, "ml_synced": doc["ml_synced"]}
+        return None
+
+    def move_docs(self, moves):
+        self.moves.append(moves)
+        return [src_path for src_path in moves if src_path in self.docs]
+
+    def insert_metadata(self, doc_path, file_hash, *args):
+        if doc_path in self.failing:
+            raise self.error
+        self.docs[doc_path] = {"file_hash": file_hash, "ml_synced": False}
+
+    def set_doc_text(self, doc_path, text):
+        self.docs[doc_path]["text"] = text
+
+    def insert_passage(self, passage_id, doc_path, *args):
+        self.passages.append(doc_path)
+
+    def insert_mean_dense_vector(self, doc_path, mean_dense_vector):
+        pass
+
+    def update_doc_ml_synced(self, doc_path, ml_synced):
+        self.synced[doc_path] = ml_synced
+
+    def get_manifest(self, prefix=None, after=None, limit=5000):
+        doc_paths = sorted(doc_path for doc_path in self.docs if after is None or doc_path > after)
+        return [{"doc_path": doc_path} for doc_path in doc_paths[:limit]]
+
+
+def write(path, content="some text"):
+    path.write_text(content)
+    return str(path)
+
+
+def test_documents_are_embedded_and_synced(tmp_path):
+    model = FakeModel()
+    store = FakeStore()
+    service = IngestionService(store, FakeModelManager(model))
+    doc_path = write(tmp_path / "a.txt")
+
+    assert service.ingest([doc_path]) == {"inserted": [doc_path], "failed": []}
+    assert store.docs[doc_path]["text"] == "some text"
+    assert store.passages == [doc_path]
+    assert store.synced == {doc_path: True}
+
+
+def test_rename_is_moved_instead_of_embedded(tmp_path):
+    model = FakeModel()
+    store = FakeStore()
+    service = IngestionService(store, FakeModelManager(model))
+    old_path = write(tmp_path / "a.txt")
+    service.ingest([old_path])
+    store.docs[old_path]["ml_synced"] = True
+    model.encoded.clear()
+
+    new_path = str(tmp_path / "b.txt")
+    (tmp_path / "a.txt").rename(new_path)
+
+    assert service.ingest([new_path]) == {"inserted": [new_path], "failed": []}
+    assert store.moves == [{old_path: new_path}]
+    assert model.encoded == []
+
+
+def test_failing_document_does_not_sink_the_others(tmp_path):
+    store = FakeStore(failing=[str(tmp_path / "bad.txt")])
+    service = IngestionService(store, FakeModelManager(FakeModel()))
+    good, bad = write(tmp_path / "good.txt"), write(tmp_path / "bad.txt")
+
+    result = service.ingest([bad, good])
+
+    assert result == {"inserted": [good], "failed": [{"doc_path": bad, "error": "disk error"}]}
+    assert store.synced == {bad: False, good: True}
+
+
+def test_unsupported_file_type_is_reported(tmp_path):
+    service = IngestionService(FakeStore(), FakeModelManager(FakeModel()))
+    doc_path = write(tmp_path / "a.xyz")
+
+    assert service.ingest([doc_path])["failed"] == [{"doc_path": doc_path, "error": "Unsupported file type"}]
+
+
+def test_disabled_model_aborts_the_batch(tmp_path):
+    service = IngestionService(FakeStore(), FakeModelManager(None))
+
+    with pytest.raises(MLServiceUnavailable):
+        service.ingest([write(tmp_path / "a.txt"), write(tmp_path / "b.txt")])
+
+
+def test_unreachable_database_aborts_the_batch(tmp_path):
+    bad = str(tmp_path / "bad.txt")
+    store = FakeStore(failing=[bad], error=psycopg2.OperationalError("server closed the connection"))
+    service = IngestionService(store, FakeModelManager(FakeModel()))
+
+    with pytest.raises(psycopg2.OperationalError):
+        service.ingest([write(tmp_path / "bad.txt"), write(tmp_path / "good.txt")])
+    assert store.synced == {}
+
+
+def test_move_returns_the_sources_that_are_not_stored():
+    service = IngestionService(FakeStore({"/a.txt": {"file_hash": "1", "ml_synced": True}}), FakeModelManager(None))
+
+    assert service.move({"/a.txt": "/b.txt", "/c.txt": "/d.txt"}) == (["/a.txt"], ["/c.txt"])
+
+
+def test_manifest_pages_end_on_a_short_page():
+    store = FakeStore({f"/{name}.txt": {"file_hash": name, "ml_synced": True} for name in "abc"})
+    service = IngestionService(store, FakeModelManager(None))
+
+    documents, after = service.manifest(limit=2)
+    assert [document["doc_path"] for document in documents] == ["/a.txt", "/b.txt"]
+    assert after == "/b.txt"
+
+    documents, after = service.manifest(after=after, limit=2)
+    assert [document["doc_path"] for document in documents] == ["/c.txt"]
+    assert after is None
+
+
+def test_unknown_deletion_mode_is_rejected():
+    with pytest.raises(ValueError):
+        IngestionService(FakeStore(), FakeModelManager(None)).delete(["/a.txt"], mode="soft")
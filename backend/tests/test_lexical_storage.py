@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+from tests.conftest import FakeCursor
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    executed = []
+    original = FakeCursor.execute
+
+    def execute(self, query, params=None):
+        executed.append((query, params))
+        return original(self, query, params)
+
+    monkeypatch.setattr(FakeCursor, "execute", execute)
+    return executed
+
+
+def searches(connections):
+    return [statement for connection in connections for statement in connection.statements if "lexical_scores" in statement]
+
+
+def test_unknown_storage_is_rejected(connections):
+    with pytest.raises(ValueError):
+        PostgresManager(lexical_storage="jsonb")
+
+
+def test_sparsevec_weights_are_stored_on_the_passage_row(connections, executed):
+    pm = PostgresManager(lexical_storage="sparsevec")
+    connections.rows["pg_partitioned_table"] = [(False,)]
+    connections.rows["RETURNING passage_id"] = [(7,)]
+
+    pm.insert_passage(None, "/docs/a.pdf", "hash-a", "a.pdf", np.ones(1024), {"41": 0.5, "2": 0.25}, 0, 512, 512)
+
+    (query, params), = [(query, params) for query, params in executed if "INSERT INTO passages" in query]
+    assert params[-2:] == ("{3:0.25,42:0.5}/250002", [2, 41])
+    assert not any("lexical_weights" in query for query, _ in executed)
+
+
+@pytest.mark.parametrize(
+    "lexical_storage, scored_from",
+    [("table", "JOIN lexical_weights lw"), ("sparsevec", "lexical_vector <#>")],
+)
+def test_search_scores_from_the_configured_storage(connections, lexical_storage, scored_from):
+    pm = PostgresManager(lexical_storage=lexical_storage)
+
+    pm.ml_search(np.ones(1024, dtype=np.float32), {"42": 0.3}, window_size=512)
+
+    (search,) = searches(connections)
+    assert scored_from in search
@@ -0,0 +1,52 @@
+import datetime
+
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+from tests.conftest import FakeCursor
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    executed = []
+    original = FakeCursor.execute
+
+    def execute(self, query, params=None):
+        executed.append((query, params))
+        return original(self, query, params)
+
+    monkeypatch.setattr(FakeCursor, "execute", execute)
+    return executed
+
+
+@pytest.fixture
+def pm(connections):
+    return PostgresManager(prepare_statements=False)
+
+
+def manifest_params(executed):
+    (params,) = [params for query, params in executed if "FROM document_metadata" in query]
+    return params
+
+
+def test_pages_are_keyed_on_the_last_path(pm, connections, executed):
+    modified = datetime.datetime(2024, 5, 1, 12, 30)
+    connections.rows["ORDER BY doc_path"] = [("/docs/b.pdf", "hash-b", 2048, modified, True)]
+
+    page = pm.get_manifest(after="/docs/a.pdf", limit=2)
+
+    assert page == [
+        {
+            "doc_path": "/docs/b.pdf",
+            "file_hash": "hash-b",
+            "size": 2048,
+            "modification_time": "2024-05-01T12:30:00",
+            "ml_synced": True,
+        }
+    ]
+    assert manifest_params(executed) == ["/docs/a.pdf", 2]
+
+
+def test_prefix_matches_literally(pm, executed):
+    pm.get_manifest(prefix="/docs/100%_done")
+    assert manifest_params(executed) == ["/docs/100\\%\\_done%", 5000]
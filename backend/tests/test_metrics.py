@@ -0,0 +1,44 @@
+import pytest
+
+from app.utils import metrics as metrics_module
+from app.utils.metrics import MetricsRegistry, StageTimer
+
+
+def test_histogram_buckets_are_rendered_cumulatively():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("search_seconds", "Search time", labels={"route": "search"}, buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 2.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP search_seconds Search time", "# TYPE search_seconds histogram"]
+    assert 'search_seconds_bucket{route="search",le="0.1"} 1' in lines
+    assert 'search_seconds_bucket{route="search",le="1.0"} 3' in lines
+    assert 'search_seconds_bucket{route="search",le="+Inf"} 4' in lines
+    assert 'search_seconds_count{route="search"} 4' in lines
+    assert 'search_seconds_sum{route="search"} 3.05' in lines
+
+
+def test_same_name_and_labels_share_a_histogram():
+    registry = MetricsRegistry()
+    assert registry.histogram("a", labels={"x": "1"}) is registry.histogram("a", labels={"x": "1"})
+    assert registry.histogram("a", labels={"x": "1"}) is not registry.histogram("a", labels={"x": "2"})
+
+
+def test_stage_timer_reports_milliseconds_and_records_histograms(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics_module, "metrics", registry)
+
+    timer = StageTimer("search")
+    with timer.stage("encode"):
+        pass
+    with timer.stage("sql"):
+        pass
+    with pytest.raises(RuntimeError):
+        with timer.stage("sql"):
+            raise RuntimeError("statement timeout")
+    timings = timer.finish()
+
+    assert set(timings) == {"encode", "sql", "total"}
+    assert timings["total"] >= timings["sql"] >= 0
+    assert registry.histogram("search_stage_seconds", labels={"stage": "sql"}).count == 2
@@ -0,0 +1,79 @@
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+from tests.conftest import FakeCursor
+
+
+@pytest.fixture
+def pm(connections):
+    return PostgresManager(pool_min=1, pool_max=2)
+
+
+def only_transaction(connections):
+    # Leaving out the health check of the connection
+    (transaction,) = [t for t in connections.transactions() if t != ["SELECT 1"]]
+    return transaction
+
+
+def test_unknown_source_leaves_the_destination_alone(pm, connections):
+    connections.rows["FOR UPDATE"] = []
+
+    assert pm.move_docs({"/docs/missing.pdf": "/docs/b.pdf"}) == []
+    assert not any("DELETE" in statement for statement in connections.log)
+    assert not any("UPDATE document_metadata" in statement for statement in connections.log)
+
+
+def test_replaced_destination_is_deleted_in_the_same_transaction(pm, connections):
+    connections.rows["FOR UPDATE"] = [("/docs/a.pdf",)]
+    connections.log.clear()
+
+    assert pm.move_docs({"/docs/a.pdf": "/docs/b.pdf"}) == ["/docs/a.pdf"]
+    transaction = only_transaction(connections)
+    assert "FOR UPDATE" in transaction[0]
+    assert any(statement.startswith("DELETE FROM document_metadata") for statement in transaction)
+    assert sum("UPDATE document_metadata dm" in statement for statement in transaction) == 2
+
+
+@pytest.mark.parametrize(
+    "moves",
+    [
+        {"/docs/a.pdf": "/docs/b.pdf", "/docs/b.pdf": "/docs/c.pdf"},  # Chain
+        {"/docs/a.pdf": "/docs/b.pdf", "/docs/b.pdf": "/docs/a.pdf"},  # Swap
+    ],
+)
+def test_vacated_destinations_are_not_deleted(pm, connections, moves):
+    connections.rows["FOR UPDATE"] = [("/docs/a.pdf",), ("/docs/b.pdf",)]
+    connections.log.clear()
+
+    assert sorted(pm.move_docs(moves)) == ["/docs/a.pdf", "/docs/b.pdf"]
+    transaction = only_transaction(connections)
+    deleted = [statement for statement in transaction if "SELECT file_hash" in statement]
+    if moves["/docs/b.pdf"] == "/docs/c.pdf":
+        # Only c.pdf may be replaced, b.pdf is moved away in the same batch
+        assert len(deleted) == 1
+    else:
+        assert not deleted
+
+
+def test_moves_go_through_temporary_paths(pm, connections, monkeypatch):
+    connections.rows["FOR UPDATE"] = [("/docs/a.pdf",), ("/docs/b.pdf",)]
+    executed = []
+    original = FakeCursor.execute
+
+    def execute(self, query, params=None):
+        executed.append((query, params))
+        return original(self, query, params)
+
+    monkeypatch.setattr(FakeCursor, "execute", execute)
+    pm.move_docs({"/docs/a.pdf": "/docs/b.pdf", "/docs/b.pdf": "/docs/a.pdf"})
+
+    updates = [params for query, params in executed if "UPDATE document_metadata dm" in query]
+    assert updates[0] == (["/docs/a.pdf", "/docs/b.pdf"], ["chishiki-move:/docs/a.pdf", "chishiki-move:/docs/b.pdf"])
+    assert updates[1][0] == updates[0][1]
+    assert updates[1][1] == ["/docs/b.pdf", "/docs/a.pdf"]
+
+
+def test_one_document_per_destination(pm, connections):
+    connections.rows["FOR UPDATE"] = [("/docs/a.pdf",), ("/docs/b.pdf",)]
+
+    assert pm.move_docs({"/docs/a.pdf": "/docs/c.pdf", "/docs/b.pdf": "/docs/c.pdf"}) == ["/docs/a.pdf"]
@@ -0,0 +1,39 @@
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+
+
+@pytest.fixture
+def pm(connections):
+    return PostgresManager()
+
+
+def statements(connections, fragment):
+    return [statement for statement in connections.log if fragment in statement]
+
+
+def test_window_partitions_are_created_once(pm, connections):
+    pm.ensure_window_partition(512)
+    pm.ensure_window_partition("512")
+
+    created = statements(connections, "PARTITION OF")
+    assert len(created) == 2
+    assert "passages_w512" in created[0] and "lexical_weights_w512" in created[1]
+
+
+def test_dropping_a_window_detaches_lexical_weights_first(pm, connections):
+    connections.rows["pg_partitioned_table"] = [(True,)]
+
+    pm.drop_window_partition(256)
+
+    detached = statements(connections, "DETACH PARTITION")
+    assert ["lexical_weights_w256" in detached[0], "passages_w256" in detached[1]] == [True, True]
+    assert any("DELETE FROM indexing_configurations" in statement for statement in connections.log)
+
+
+def test_unpartitioned_passages_cannot_drop_a_window(pm, connections):
+    connections.rows["pg_partitioned_table"] = [(False,)]
+
+    with pytest.raises(ValueError):
+        pm.drop_window_partition(256)
+    assert not statements(connections, "DETACH PARTITION")
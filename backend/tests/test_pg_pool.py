@@ -0,0 +1,98 @@
+import psycopg2
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+
+
+def make_manager(**kwargs):
+    return PostgresManager(pool_min=1, pool_max=3, **kwargs)
+
+
+def prepares(conn):
+    return [statement for statement in conn.statements if statement.startswith("PREPARE")]
+
+
+def test_idle_connections_are_kept_up_to_pool_max(connections):
+    pm = make_manager()
+    # Nothing is opened before the first checkout
+    assert len(connections) == 0 and not pm.connected
+
+    with pm.connection():
+        pass
+    assert len(connections) == 1
+
+    with pm.connection(), pm.connection(), pm.connection():
+        pass
+    assert len(connections) == 3
+    assert not any(conn.closed for conn in connections)
+
+    # Returned connections are reused, not reopened
+    with pm.connection(), pm.connection(), pm.connection():
+        pass
+    assert len(connections) == 3
+
+
+def test_statements_are_prepared_once_per_connection(connections):
+    pm = make_manager()
+    query = "SELECT content FROM document_texts WHERE doc_path = %s"
+
+    for _ in range(2):
+        with pm.connection() as conn, conn.cursor() as cur:
+            pm._execute_prepared(cur, query, ("a.txt",))
+    assert len(prepares(connections[0])) == 1
+    assert connections[0].statements[-1].startswith("EXECUTE chishiki_")
+
+
+def test_replacement_connection_prepares_again(connections):
+    pm = make_manager()
+    query = "SELECT content FROM document_texts WHERE doc_path = %s"
+
+    with pm.connection() as conn, conn.cursor() as cur:
+        pm._execute_prepared(cur, query, ("a.txt",))
+    connections[0].close()
+
+    # The closed connection is discarded on checkout, its replacement knows
+    # nothing about the statements prepared on it
+    with pm.connection() as conn, conn.cursor() as cur:
+        assert conn is not connections[0]
+        pm._execute_prepared(cur, query, ("a.txt",))
+    assert len(prepares(conn)) == 1
+    assert connections[0] not in pm._prepared
+
+
+def test_connections_closed_on_return_are_forgotten(connections):
+    pm = make_manager()
+    query = "SELECT content FROM document_texts WHERE doc_path = %s"
+
+    with pytest.raises(psycopg2.OperationalError):
+        with pm.connection() as conn, conn.cursor() as cur:
+            pm._execute_prepared(cur, query, ("a.txt",))
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+    assert conn.closed
+    assert conn not in pm._prepared
+    assert conn not in pm._last_used
+
+
+def test_new_connections_are_health_checked(connections):
+    pm = make_manager(health_check_interval=30)
+
+    with pm.connection(), pm.connection():
+        pass
+    # The second connection was opened for this checkout, it was never used
+    assert connections[1].statements == ["SELECT 1"]
+
+
+def test_unreachable_database_is_retried_on_next_use(connections, monkeypatch):
+    pm = make_manager()
+    connect = psycopg2.connect
+
+    def unreachable(*args, **kwargs):
+        raise psycopg2.OperationalError("could not connect to server")
+
+    monkeypatch.setattr(psycopg2, "connect", unreachable)
+    assert not pm.ping()
+    assert not pm.connected
+
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    assert pm.ping()
+    assert pm.connected
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from app.utils.pg_manager import PostgresManager
+from app.utils.pg_queries import SearchQueryBuilder, parse_positive_int, parse_window_sizes, sparse_to_str
+
+
+class Builder(SearchQueryBuilder):
+    dense_dim = 4
+
+    def __init__(self, index_configs=None):
+        self.index_configs = index_configs or {}
+
+    def get_index_config(self, window_size):
+        return self.index_configs.get(window_size, {"precision": "float32", "oversample": 4})
+
+
+def test_parse_window_sizes_converts_to_int():
+    assert parse_window_sizes([128, "512", 256.0]) == [128, 512, 256]
+
+
+@pytest.mark.parametrize(
+    "window_sizes",
+    [None, [], "512", ["abc"], [None], [True], [0], [-128], [128.5], [512, "512"]],
+)
+def test_parse_window_sizes_rejects_bad_values(window_sizes):
+    with pytest.raises(ValueError):
+        parse_window_sizes(window_sizes)
+
+
+def test_parse_positive_int_converts_to_int():
+    assert parse_positive_int("30", "k") == 30
+    assert parse_positive_int(512.0, "window_size") == 512
+
+
+@pytest.mark.parametrize("value", [None, "abc", True, 0, -1, 2.5, [512]])
+def test_parse_positive_int_rejects_bad_values(value):
+    with pytest.raises(ValueError, match="Invalid k"):
+        parse_positive_int(value, "k")
+
+
+def test_single_window_search_accepts_a_string_window_size(connections):
+    connections.rows["dense_scores"] = [("a.txt", 0, 512, 0.9, 0.1, 0.7, 512)]
+
+    results = PostgresManager().ml_search(np.ones(1024, dtype=np.float32), {"42": 0.3}, window_size="512")
+
+    assert results == [(("a.txt", 0, 512), (0.9, 0.1, 0.7))]
+
+
+def test_multi_window_query_has_one_branch_per_window_size():
+    query, params = Builder()._build_multi_window_query(
+        np.zeros(4), {"10": 0.5}, [128, 512], None, 0.7, None, 10
+    )
+    assert query.count("UNION ALL") == 1
+    assert "p.window_size = 128" in query and "p.window_size = 512" in query
+    assert query.count("%s") == len(params)
+    assert 128 in params and 512 in params
+
+
+def test_multi_window_rows_are_grouped_and_sorted_by_score():
+    rows = [
+        ("a.txt", 0, 10, 0.5, 0.1, 0.4, 128),
+        ("b.txt", 0, 10, 0.9, 0.1, 0.8, 128),
+        ("c.txt", 5, 50, 0.7, 0.2, 0.6, 512),
+    ]
+    results = Builder()._parse_multi_window_rows(rows, [128, 512])
+    assert [result[0][0] for result in results[128]] == ["b.txt", "a.txt"]
+    assert results[512] == [(("c.txt", 5, 50), (0.7, 0.2, 0.6))]
+
+
+def test_quantized_index_oversamples_candidates():
+    builder = Builder({512: {"precision": "binary", "oversample": 8}})
+    query, params = builder._build_dense_stage("[0,0,0,0]", 512, 10)
+    assert "binary_quantize" in query
+    assert params[-3] == 80
+
+
+def test_sparse_to_str_is_one_based_and_sorted():
+    assert sparse_to_str({"5": 0.25, "1": 0.5, "9": 0.0}, dim=10) == "{2:0.5,6:0.25}/10"
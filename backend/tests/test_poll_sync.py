@@ -0,0 +1,137 @@
+import json
+import os
+
+from app.utils.poll_sync import PollingDetector
+
+
+def make_detector(root, snapshot_path, events, stat_budget=20000):
+    return PollingDetector(
+        str(root),
+        lambda event_type, path, src_path=None: events.append((event_type, path, src_path)),
+        [".pdf", ".txt"],
+        str(snapshot_path),
+        stat_budget=stat_budget,
+    )
+
+
+def bump_mtime(path):
+    # Directory mtimes may not change within the clock resolution of the filesystem
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_baseline_reports_nothing_then_changes_are_reported(tmp_path):
+    root = tmp_path / "docs"
+    root.mkdir()
+    (root / "a.pdf").write_text("a")
+    events = []
+    detector = make_detector(root, tmp_path / "snapshot.json", events)
+
+    assert detector.poll_once() == 0 and events == []
+
+    (root / "b.txt").write_text("b")
+    (root / "a.pdf").unlink()
+    bump_mtime(root)
+    detector.poll_once()
+    assert sorted(events) == [("created", str(root / "b.txt"), None), ("deleted", str(root / "a.pdf"), None)]
+
+
+def test_rename_is_reported_as_a_move(tmp_path):
+    root = tmp_path / "docs"
+    root.mkdir()
+    (root / "a.pdf").write_text("a")
+    events = []
+    detector = make_detector(root, tmp_path / "snapshot.json", events)
+    detector.poll_once()
+
+    os.rename(root / "a.pdf", root / "renamed.pdf")
+    bump_mtime(root)
+    detector.poll_once()
+    assert events == [("moved", str(root / "renamed.pdf"), str(root / "a.pdf"))]
+
+
+def test_new_tree_is_listed_within_the_budget(tmp_path):
+    root = tmp_path / "docs"
+    root.mkdir()
+    events = []
+    detector = make_detector(root, tmp_path / "snapshot.json", events, stat_budget=8)
+    detector.poll_once()
+
+    # 10 directories of 3 documents copied at once
+    for i in range(10):
+        (root / "copy" / f"d{i}").mkdir(parents=True)
+        for j in range(3):
+            (root / "copy" / f"d{i}" / f"{j}.pdf").write_text(f"{i}-{j}")
+    bump_mtime(root)
+
+    cycles = 0
+    while len(events) < 30:
+        created_before = len(events)
+        detector.poll_once()
+        cycles += 1
+        # Each directory costs a stat plus one per document
+        assert len(events) - created_before <= 8
+        assert cycles < 20
+    assert cycles > 3
+    assert all(event_type == "created" for event_type, _, _ in events)
+    assert len({path for _, path, _ in events}) == 30
+
+
+def test_restart_resumes_pending_directories_and_positions(tmp_path):
+    root = tmp_path / "docs"
+    for i in range(6):
+        (root / f"d{i}").mkdir(parents=True)
+        (root / f"d{i}" / "doc.pdf").write_text(str(i))
+    snapshot_path = tmp_path / "snapshot.json"
+    events = []
+    detector = make_detector(root, snapshot_path, events, stat_budget=3)
+    detector.poll_once()
+    detector.poll_once()
+    cursors = dict(detector.cursors)
+    assert cursors["dirs"] != sorted(detector.snapshot["dirs"])[-1]
+
+    (root / "new").mkdir()
+    for j in range(5):
+        (root / "new" / f"sub{j}").mkdir()
+        (root / "new" / f"sub{j}" / "doc.pdf").write_text(str(j))
+    bump_mtime(root)
+    # Small cycles: the root is visited when its turn comes, then its new
+    # directory is listed a few subdirectories at a time
+    for _ in range(10):
+        detector.poll_once()
+        if detector.snapshot["pending"]:
+            break
+    assert detector.snapshot["pending"]
+
+    restarted = make_detector(root, snapshot_path, events, stat_budget=1000)
+    assert restarted.snapshot["pending"] == detector.snapshot["pending"]
+    assert restarted.dir_queue and restarted.dir_queue[0] > detector.cursors["dirs"]
+    restarted.poll_once()
+    assert not restarted.snapshot["pending"]
+    created = {path for event_type, path, _ in events if event_type == "created"}
+    assert created == {str(root / "new" / f"sub{j}" / "doc.pdf") for j in range(5)}
+
+
+def test_idle_cycles_only_save_the_scan_positions(tmp_path):
+    root = tmp_path / "docs"
+    for i in range(4):
+        (root / f"d{i}").mkdir(parents=True)
+        (root / f"d{i}" / "doc.pdf").write_text(str(i))
+    snapshot_path = tmp_path / "snapshot.json"
+    events = []
+    detector = make_detector(root, snapshot_path, events, stat_budget=3)
+    detector.poll_once()
+    snapshot_inode = os.stat(snapshot_path).st_ino
+
+    for _ in range(3):
+        detector.poll_once()
+    assert events == []
+    assert os.stat(snapshot_path).st_ino == snapshot_inode
+    with open(f"{snapshot_path}.cursors") as file:
+        assert json.load(file) == detector.cursors
+
+    (root / "d1" / "doc.pdf").write_text("changed")
+    for _ in range(4):
+        detector.poll_once()
+    assert events == [("modified", str(root / "d1" / "doc.pdf"), None)]
+    assert os.stat(snapshot_path).st_ino != snapshot_inode
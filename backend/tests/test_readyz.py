@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from tests.conftest import import_routes
+
+
+@pytest.fixture(scope="module")
+def routes():
+    return import_routes("app.api.routes")
+
+
+@pytest.fixture
+def client(routes):
+    app = Flask(__name__)
+    app.register_blueprint(routes.api_routes)
+    return app.test_client()
+
+
+def event(is_set):
+    event = threading.Event()
+    if is_set:
+        event.set()
+    return event
+
+
+def test_healthz_answers_while_loading(client, routes, monkeypatch):
+    monkeypatch.setattr(routes, "warm_up_done", event(False))
+    monkeypatch.setattr(routes.postgres_manager, "ping", lambda: False)
+
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "ok"
+
+
+def test_readyz_is_ready_once_warmed_up_with_a_database(client, routes, monkeypatch):
+    monkeypatch.setattr(routes, "warm_up_done", event(True))
+    monkeypatch.setattr(routes, "database_ready", event(True))
+    monkeypatch.setattr(routes.postgres_manager, "ping", lambda: True)
+
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "ready"
+    assert response.get_json()["components"]["database"] == "ok"
+
+
+def test_readyz_is_not_ready_without_a_database(client, routes, monkeypatch):
+    monkeypatch.setattr(routes, "warm_up_done", event(True))
+    monkeypatch.setattr(routes, "database_ready", event(True))
+    monkeypatch.setattr(routes.postgres_manager, "ping", lambda: False)
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["components"]["database"] == "unavailable"
+
+
+def test_readyz_is_not_ready_while_warming_up(client, routes, monkeypatch):
+    monkeypatch.setattr(routes, "warm_up_done", event(False))
+    monkeypatch.setattr(routes.postgres_manager, "ping", lambda: True)
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "not ready"
+
+
+def test_readyz_reports_the_database_pending_until_first_reached(client, routes, monkeypatch):
+    monkeypatch.setattr(routes, "warm_up_done", event(True))
+    monkeypatch.setattr(routes, "database_ready", event(False))
+    monkeypatch.setattr(routes.postgres_manager, "ping", lambda: True)
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["components"]["database"] == "pending"
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.scheduler import LaneScheduler, Overloaded, PriorityGate, current_lane, lane
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_lane_is_restored_on_exit():
+    assert current_lane() == "interactive"
+    with lane("bulk"):
+        assert current_lane() == "bulk"
+        with lane("interactive"):
+            assert current_lane() == "interactive"
+        assert current_lane() == "bulk"
+    assert current_lane() == "interactive"
+
+    with pytest.raises(ValueError):
+        with lane("batch"):
+            pass
+
+
+def test_reserved_slots_are_kept_for_interactive_work():
+    gate = PriorityGate("test", capacity=2, reserved=1)
+
+    with lane("bulk"):
+        assert gate.acquire(timeout=0)
+        # The last slot is reserved
+        assert not gate.acquire(timeout=0)
+    assert gate.acquire(timeout=0)
+    assert gate.in_use == 2
+
+
+def test_freed_slot_goes_to_interactive_waiters_first():
+    gate = PriorityGate("test", capacity=1)
+    gate.acquire()
+    served = []
+
+    def waiter(lane_name):
+        with lane(lane_name), gate.slot():
+            served.append(lane_name)
+
+    bulk = threading.Thread(target=waiter, args=("bulk",), daemon=True)
+    bulk.start()
+    wait_for(lambda: gate.waiting["bulk"] == 1)
+    interactive = threading.Thread(target=waiter, args=("interactive",), daemon=True)
+    interactive.start()
+    wait_for(lambda: gate.waiting["interactive"] == 1)
+
+    gate.release()
+    bulk.join(2)
+    interactive.join(2)
+    assert served == ["interactive", "bulk"]
+
+
+def test_timed_out_waiter_does_not_hold_back_other_lanes():
+    gate = PriorityGate("test", capacity=1)
+    gate.acquire()
+    assert not gate.acquire(timeout=0.01)
+    assert gate.waiting == {"interactive": 0, "bulk": 0}
+
+    gate.release()
+    with lane("bulk"):
+        assert gate.acquire(timeout=0)
+
+
+def test_full_lane_is_rejected():
+    scheduler = LaneScheduler({"bulk": 1})
+
+    with scheduler.admit("bulk"):
+        assert current_lane() == "bulk"
+        with pytest.raises(Overloaded) as rejected:
+            with scheduler.admit("bulk"):
+                pass
+        # Other lanes are admitted independently
+        with scheduler.admit("interactive"):
+            pass
+    assert rejected.value.lane == "bulk"
+    assert rejected.value.retry_after >= 1
+    assert scheduler.pending == {"interactive": 0, "bulk": 0}
+
+
+def test_retry_after_grows_with_pending():
+    scheduler = LaneScheduler({"bulk": 8})
+    scheduler.durations["bulk"] = 10.0
+
+    hints = []
+    for pending in (1, 4, 8):
+        scheduler.pending["bulk"] = pending
+        hints.append(scheduler.retry_after("bulk"))
+    assert hints == sorted(hints) and hints[0] < hints[-1]
+    assert hints[-1] == 10
+
+
+def test_admitted_view_releases_on_error():
+    scheduler = LaneScheduler({"interactive": 1})
+
+    @scheduler.admitted("interactive")
+    def view():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        view()
+    assert scheduler.pending["interactive"] == 0
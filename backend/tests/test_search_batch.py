@@ -0,0 +1,41 @@
+import numpy as np
+
+from app.utils.pg_manager import PostgresManager
+
+
+def queries(n):
+    return [(np.full(1024, i, dtype=np.float32), {str(i): 0.5}) for i in range(n)]
+
+
+def test_results_are_split_by_query_in_one_statement(connections):
+    pm = PostgresManager()
+    connections.rows["jsonb_to_recordset"] = [
+        (0, "/docs/a.pdf", 0, 512, 0.9, 0.2, 0.7),
+        (0, "/docs/b.pdf", 0, 512, 0.8, 0.1, 0.6),
+        (2, "/docs/c.pdf", 512, 1024, 0.5, 0.5, 0.5),
+    ]
+
+    results = pm.ml_search_batch(queries(3), window_size=512, k=2)
+
+    assert results == [
+        [(("/docs/a.pdf", 0, 512), (0.9, 0.2, 0.7)), (("/docs/b.pdf", 0, 512), (0.8, 0.1, 0.6))],
+        [],
+        [(("/docs/c.pdf", 512, 1024), (0.5, 0.5, 0.5))],
+    ]
+    searches = [
+        statement
+        for connection in connections
+        for statement in connection.statements
+        if "jsonb_to_recordset" in statement
+    ]
+    assert len(searches) == 1
+
+
+def test_failed_batch_returns_empty_results_for_every_query(connections, monkeypatch):
+    pm = PostgresManager()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("canceling statement due to statement timeout")
+
+    monkeypatch.setattr(pm, "_execute_search", fail)
+    assert pm.ml_search_batch(queries(2), window_size=512) == [[], []]
@@ -0,0 +1,47 @@
+import pytest
+from flask import Flask
+
+from tests.conftest import import_routes
+
+
+@pytest.fixture(scope="module")
+def routes():
+    return import_routes("app.api.routes")
+
+
+@pytest.fixture
+def client(routes, monkeypatch):
+    # Validation happens before the model is needed
+    monkeypatch.setattr(routes.model_manager, "get_model", lambda: pytest.fail("model loaded"))
+    app = Flask(__name__)
+    app.register_blueprint(routes.api_routes)
+    return app.test_client()
+
+
+@pytest.mark.parametrize(
+    "params, error",
+    [
+        ({"window_size": "abc"}, "Invalid window_size 'abc'"),
+        ({"window_size": 0}, "Invalid window_size 0"),
+        ({"k": -5}, "Invalid k -5"),
+        ({"k": 2.5}, "Invalid k 2.5"),
+        ({"window_sizes": [512, "x"]}, "Invalid window size 'x'"),
+    ],
+)
+def test_search_rejects_bad_window_size_and_k(client, params, error):
+    response = client.post("/search", json={"query": "vector index", **params})
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == error
+
+
+def test_search_batch_rejects_bad_shared_and_per_query_values(client):
+    response = client.post("/search_batch", json={"queries": ["vector index"], "k": "many"})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid k 'many'"
+
+    response = client.post(
+        "/search_batch", json={"queries": ["vector index", {"query": "hnsw", "window_size": None}]}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid window_size None"
@@ -0,0 +1,31 @@
+import numpy as np
+
+from app.utils.pg_manager import PostgresManager
+
+
+def search(pm, stats):
+    return pm.ml_search(np.ones(1024, dtype=np.float32), {"42": 0.3}, window_size=512, stats=stats)
+
+
+def test_slow_statement_plans_are_captured(connections):
+    pm = PostgresManager(explain_threshold_ms=0)
+    connections.rows["EXPLAIN"] = [([{"Plan": {"Node Type": "Limit"}}],)]
+    stats = {}
+
+    search(pm, stats)
+
+    assert stats["sql_ms"] >= 0
+    assert stats["plan"] == [{"Plan": {"Node Type": "Limit"}}]
+    (captured,) = pm.slow_query_plans
+    assert "dense_scores" in captured["query"]
+
+
+def test_plans_are_not_captured_by_default(connections):
+    pm = PostgresManager()
+    stats = {}
+
+    search(pm, stats)
+
+    assert "plan" not in stats
+    assert not any("EXPLAIN" in statement for connection in connections for statement in connection.statements)
+    assert not pm.slow_query_plans
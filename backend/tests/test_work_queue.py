@@ -0,0 +1,76 @@
+import threading
+
+from app.utils.watchdog_sync import PathWorkQueue
+
+
+def test_putting_a_pending_path_replaces_it():
+    queue = PathWorkQueue()
+    queue.put("/docs/a.pdf", "upsert", priority=10)
+    queue.put("/docs/a.pdf", "delete", priority=-1)
+
+    assert len(queue) == 1
+    assert queue.get_batch(10) == ("delete", ["/docs/a.pdf"], [None])
+
+
+def test_batches_hold_one_action_in_priority_order():
+    queue = PathWorkQueue()
+    queue.put("/docs/big.pdf", "upsert", priority=1000)
+    queue.put("/docs/small.pdf", "upsert", priority=10)
+    queue.put("/docs/old.pdf", "delete", priority=-1)
+    queue.put("/docs/b.pdf", "move", priority=-1, payload="/docs/a.pdf")
+
+    assert queue.get_batch(10) == ("delete", ["/docs/old.pdf"], [None])
+    assert queue.get_batch(10) == ("move", ["/docs/b.pdf"], ["/docs/a.pdf"])
+    assert queue.get_batch(10) == ("upsert", ["/docs/small.pdf", "/docs/big.pdf"], [None, None])
+
+
+def test_paths_in_flight_are_not_handed_out_twice():
+    queue = PathWorkQueue()
+    queue.put("/docs/a.pdf", "upsert")
+    _, paths, _ = queue.get_batch(1)
+
+    # Modified again while a worker is ingesting it
+    queue.put("/docs/a.pdf", "upsert")
+    queue.put("/docs/b.pdf", "upsert", priority=5)
+    assert queue.get_batch(10) == ("upsert", ["/docs/b.pdf"], [None])
+
+    got = []
+    worker = threading.Thread(target=lambda: got.append(queue.get_batch(10)))
+    worker.start()
+    worker.join(0.1)
+    assert worker.is_alive()
+
+    queue.task_done(paths)
+    worker.join(1)
+    assert got == [("upsert", ["/docs/a.pdf"], [None])]
+
+
+def test_batches_in_flight_are_counted_across_workers():
+    queue = PathWorkQueue()
+    for i in range(200):
+        queue.put(f"/docs/{i}.pdf", "upsert")
+
+    # 66 batches of 3 paths and a last one of 2
+    tickets = iter(range(67))
+    tickets_lock = threading.Lock()
+    counts = []
+
+    def work():
+        while True:
+            with tickets_lock:
+                if next(tickets, None) is None:
+                    return
+            _, paths, _ = queue.get_batch(3)
+            with queue.condition:
+                counts.append(queue.batches_in_flight)
+            queue.task_done(paths)
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(5)
+
+    assert len(queue) == 0 and len(counts) == 67
+    assert queue.batches_in_flight == 0
+    assert max(counts) <= 4
@@ -0,0 +1,7 @@
+# WSGI entry point for production servers, e.g.
+#   gunicorn --workers 4 --bind 0.0.0.0:7710 wsgi:app
+# API workers are stateless, they share the encoder service of the node
+# (python -m app.models.encoder_service), see "server": "gunicorn" in main.py
+from app.api import create_app
+
+app = create_app()
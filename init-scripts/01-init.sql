@@ -15,7 +15,9 @@ CREATE TABLE IF NOT EXISTS document_metadata (
     ml_synced BOOLEAN DEFAULT FALSE,
     size BIGINT CHECK (size >= 0),
     metadata JSONB DEFAULT '{}',
-    mean_dense_vector vector(1024)
+    mean_dense_vector vector(1024),
+    -- Set by tombstone deletions, the row is removed once its passages are reclaimed
+    deleted_at TIMESTAMP
 );
 
 -- Create passages table with composite unique constraint
@@ -28,6 +30,9 @@ CREATE TABLE IF NOT EXISTS passages (
     start_pos INTEGER NOT NULL,
     end_pos INTEGER NOT NULL,
     window_size INTEGER NOT NULL,
+    -- Compact lexical weights, indexed by token id + 1, see 02-lexical-sparsevec.sql
+    lexical_vector sparsevec(250002),
+    lexical_tokens INTEGER[],
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT valid_position CHECK (end_pos > start_pos),
     -- A file can have the same passage with different window sizes or models
@@ -143,6 +148,11 @@ CREATE INDEX IF NOT EXISTS idx_passages_dense_vector
     WITH (lists = 100);
 CREATE INDEX IF NOT EXISTS idx_passages_positions
     ON passages(file_hash, start_pos, end_pos);
+CREATE INDEX IF NOT EXISTS idx_document_metadata_deleted
+    ON document_metadata(deleted_at) WHERE deleted_at IS NOT NULL;
+-- Posting lists of the compact lexical storage
+CREATE INDEX IF NOT EXISTS idx_passages_lexical_tokens
+    ON passages USING gin (lexical_tokens);
 
 -- Create function to add new indexing configuration
 CREATE OR REPLACE FUNCTION add_indexing_configuration(
@@ -0,0 +1,16 @@
+-- Compact lexical storage for databases created before it existed.
+--
+-- Every passage keeps its lexical weights as a single sparsevec, indexed by
+-- token id + 1 since sparsevec indices are 1-based, and the token ids as an
+-- int4[] whose GIN index serves as the posting lists for inverted lookups.
+--
+-- After running this script, fill the new columns with
+--     curl -X POST localhost:7710/migrate_lexical_storage -d '{}' -H 'Content-Type: application/json'
+-- then set "lexical_storage": "sparsevec" in the postgres section of the config.
+-- Passing {"truncate": true} empties the legacy lexical_weights table once done.
+
+ALTER TABLE passages ADD COLUMN IF NOT EXISTS lexical_vector sparsevec(250002);
+ALTER TABLE passages ADD COLUMN IF NOT EXISTS lexical_tokens INTEGER[];
+
+CREATE INDEX IF NOT EXISTS idx_passages_lexical_tokens
+    ON passages USING gin (lexical_tokens);
@@ -0,0 +1,10 @@
+-- Tombstone deletions for databases created before they existed.
+--
+-- Documents deleted with "mode": "tombstone" only get deleted_at set, which hides
+-- them from search; a background task of the backend then reclaims their passages
+-- and lexical weights in bounded batches and finally removes the row.
+
+ALTER TABLE document_metadata ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_document_metadata_deleted
+    ON document_metadata(deleted_at) WHERE deleted_at IS NOT NULL;
@@ -0,0 +1,106 @@
+-- Partition passages and lexical_weights by window size.
+--
+-- Not run by the postgres entrypoint, which ignores subdirectories: run it by
+-- hand, with the backend stopped, on a database created by 01-init.sql:
+--     psql -U chishiki_user -d chishiki -f init-scripts/migrations/partition-by-window.sql
+--
+-- Every window size gets its own passages_w<size> and lexical_weights_w<size>
+-- partitions. Searches, which always name a single window size, prune to one
+-- partition, vector indexes are built per partition, and a window size can be
+-- removed by dropping its partitions (PostgresManager.drop_window_partition).
+-- The backend creates the partitions of new window sizes on first insert.
+--
+-- Partitioned tables need the partition key in their primary key, so passages
+-- are keyed on (passage_id, window_size) and lexical_weights references that
+-- pair; passage ids stay unique as they still come from the same sequence.
+-- Vector indexes are not carried over, rebuild them with /create_vector_index.
+
+BEGIN;
+
+ALTER TABLE lexical_weights RENAME TO lexical_weights_unpartitioned;
+ALTER TABLE lexical_weights_unpartitioned
+    RENAME CONSTRAINT lexical_weights_pkey TO lexical_weights_unpartitioned_pkey;
+ALTER TABLE passages RENAME TO passages_unpartitioned;
+ALTER TABLE passages_unpartitioned
+    RENAME CONSTRAINT passages_pkey TO passages_unpartitioned_pkey;
+ALTER TABLE passages_unpartitioned
+    RENAME CONSTRAINT unique_passage_per_window_and_model TO passages_unpartitioned_unique;
+ALTER SEQUENCE passages_passage_id_seq OWNED BY NONE;
+
+CREATE TABLE passages (
+    passage_id BIGINT NOT NULL DEFAULT nextval('passages_passage_id_seq'),
+    file_hash TEXT REFERENCES document_metadata(file_hash) ON DELETE CASCADE,
+    dense_vector vector(1024),
+    embedding_model TEXT NOT NULL,
+    start_pos INTEGER NOT NULL,
+    end_pos INTEGER NOT NULL,
+    window_size INTEGER NOT NULL,
+    lexical_vector sparsevec(250002),
+    lexical_tokens INTEGER[],
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT valid_position CHECK (end_pos > start_pos),
+    CONSTRAINT passages_pkey PRIMARY KEY (passage_id, window_size),
+    CONSTRAINT unique_passage_per_window_and_model UNIQUE (
+        file_hash,
+        start_pos,
+        end_pos,
+        window_size
+    )
+) PARTITION BY LIST (window_size);
+
+ALTER SEQUENCE passages_passage_id_seq OWNED BY passages.passage_id;
+
+CREATE TABLE lexical_weights (
+    passage_id BIGINT NOT NULL,
+    token TEXT NOT NULL,
+    weight FLOAT NOT NULL,
+    window_size INTEGER NOT NULL,
+    CONSTRAINT lexical_weights_pkey PRIMARY KEY (passage_id, token, window_size),
+    FOREIGN KEY (passage_id, window_size)
+        REFERENCES passages(passage_id, window_size) ON DELETE CASCADE
+) PARTITION BY LIST (window_size);
+
+DO $$
+DECLARE
+    v_window_size INTEGER;
+BEGIN
+    FOR v_window_size IN SELECT DISTINCT window_size FROM passages_unpartitioned LOOP
+        EXECUTE format(
+            'CREATE TABLE passages_w%s PARTITION OF passages FOR VALUES IN (%s)',
+            v_window_size, v_window_size
+        );
+        EXECUTE format(
+            'CREATE TABLE lexical_weights_w%s PARTITION OF lexical_weights FOR VALUES IN (%s)',
+            v_window_size, v_window_size
+        );
+    END LOOP;
+END;
+$$;
+
+INSERT INTO passages (
+    passage_id, file_hash, dense_vector, embedding_model, start_pos, end_pos,
+    window_size, lexical_vector, lexical_tokens, created_at
+)
+SELECT
+    passage_id, file_hash, dense_vector, embedding_model, start_pos, end_pos,
+    window_size, lexical_vector, lexical_tokens, created_at
+FROM passages_unpartitioned;
+
+INSERT INTO lexical_weights (passage_id, token, weight, window_size)
+SELECT passage_id, token, weight, window_size
+FROM lexical_weights_unpartitioned;
+
+DROP TABLE lexical_weights_unpartitioned;
+DROP TABLE passages_unpartitioned;
+
+-- Created on the parent, hence on every current and future partition
+CREATE INDEX idx_passages_file_hash_window
+    ON passages(file_hash, window_size);
+CREATE INDEX idx_passages_embedding_model
+    ON passages(embedding_model);
+CREATE INDEX idx_passages_positions
+    ON passages(file_hash, start_pos, end_pos);
+CREATE INDEX idx_passages_lexical_tokens
+    ON passages USING gin (lexical_tokens);
+
+COMMIT;